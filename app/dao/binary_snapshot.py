@@ -0,0 +1,86 @@
+import gc
+import logging
+import marshal
+import mmap
+import os
+import struct
+import sys
+from typing import Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TUTORBIN"
+# magic, python major, python minor, marshal version, source mtime (ns), source size
+HEADER = struct.Struct("<8sHHIqq")
+
+
+def snapshot_path(json_path: str) -> str:
+    return f"{json_path}.bin"
+
+
+def _header_fields(stat: os.stat_result):
+    return (MAGIC, sys.version_info[0], sys.version_info[1], marshal.version, stat.st_mtime_ns, stat.st_size)
+
+
+def read(json_path: str) -> Optional[Any]:
+    """
+    Contents of the binary snapshot of `json_path`, or None if there is none or it is stale.
+
+    The snapshot is memory-mapped and decoded with marshal straight from the mapping. A snapshot is only
+    used if it was built from the current JSON file (same mtime and size) by the same Python version.
+    """
+    try:
+        stat = os.stat(json_path)
+        file = open(snapshot_path(json_path), "rb")
+    except FileNotFoundError:
+        return None
+    with file:
+        if os.fstat(file.fileno()).st_size <= HEADER.size:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if HEADER.unpack_from(mapped) != _header_fields(stat):
+                return None
+            # The decoded documents are acyclic, so the cyclic GC has nothing to find while they are being
+            # built and only slows the decoding down. It is paused for the duration.
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                with memoryview(mapped) as view, view[HEADER.size:] as payload:
+                    return marshal.loads(payload)
+            except (EOFError, ValueError, TypeError):
+                logger.warning(f"Ignoring corrupt binary snapshot {snapshot_path(json_path)}")
+                return None
+            finally:
+                if gc_enabled:
+                    gc.enable()
+
+
+def write(json_path: str, data: Any, stat: os.stat_result) -> None:
+    """Write the binary snapshot of `json_path`, whose contents `data` were read when the file had `stat`."""
+    path = snapshot_path(json_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(*_header_fields(stat)))
+        marshal.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def load(json_path: str, load_json: Callable[[str], Any]) -> Tuple[Any, bool]:
+    """
+    Load `json_path` from its binary snapshot if it is up to date. Otherwise load it with `load_json` and
+    (re)build the snapshot for the next start. Returns (data, whether the snapshot was used).
+    """
+    data = read(json_path)
+    if data is not None:
+        return data, True
+    try:
+        # Taken before reading, so a concurrent rewrite of the JSON file leaves the snapshot stale, not wrong
+        stat = os.stat(json_path)
+    except FileNotFoundError:
+        return load_json(json_path), False
+    data = load_json(json_path)
+    try:
+        write(json_path, data, stat)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not write binary snapshot of {json_path}: {str(e)}")
+    return data, False
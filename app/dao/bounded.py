@@ -0,0 +1,206 @@
+import heapq
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+
+from app.dao.indexes import HashIndex
+from app.dao.sharded import ShardedStore
+from app.utils.misc import json_default
+
+
+def document_size(document: Dict[str, Any]) -> int:
+    """Bytes a document counts for against the budget: the size of its JSON serialization."""
+    return len(json.dumps(document, default=json_default))
+
+
+def _recency(document: Dict[str, Any]) -> str:
+    # ISO timestamps sort chronologically as strings. Sessions that were never alive sort first.
+    return str(document.get("last_alive_timestamp") or document.get("created_at") or "")
+
+
+class BoundedCollection(MutableMapping):
+    """
+    Dict-like collection backed by a ShardedStore that keeps at most `max_bytes` of documents in memory.
+
+    Every key is known (from the store's manifest), but only recently used documents are resident. When
+    the resident documents exceed the budget, the least recently used ones are evicted: written out first
+    if they changed since their last write, then dropped from memory. Reading an evicted key rehydrates it
+    from its entity file. Keys for which `is_pinned` returns True (e.g. sessions with a live connection)
+    are never evicted.
+
+    On load the most recently alive documents (by `last_alive_timestamp`) are the ones kept resident.
+    Hash indexes cover every key, resident or not, like IndexedDict's.
+    """
+
+    def __init__(
+        self,
+        store: ShardedStore,
+        fields: Iterable[str] = (),
+        max_bytes: int = 64 * 1024 * 1024,
+        is_pinned: Optional[Callable[[str], bool]] = None,
+    ):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.is_pinned = is_pinned or (lambda key: False)
+        self.indexes = {field: HashIndex(field) for field in fields}
+        # Indexed field values of every key, so that index entries can be removed without the document
+        self._indexed: Dict[str, Dict[str, Any]] = {}
+        # Resident documents, least recently used first
+        self._resident: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        # Resident keys whose document changed since it was last written to the store
+        self._unwritten: Dict[str, None] = {}
+        self._lock = threading.RLock()
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.write_outs = 0
+        self.rehydrations = 0
+
+    def load(self, documents: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Index every document and keep the most recently alive ones resident, within the budget."""
+        with self._lock:
+            kept: List[Tuple[str, str]] = []
+            kept_bytes = 0
+            resident: Dict[str, Dict[str, Any]] = {}
+            for key, document in documents:
+                self._index(key, document)
+                size = document_size(document)
+                heapq.heappush(kept, (_recency(document), key))
+                resident[key] = document
+                self._sizes[key] = size
+                kept_bytes += size
+                while kept_bytes > self.max_bytes and len(kept) > 1:
+                    _, oldest = heapq.heappop(kept)
+                    del resident[oldest]
+                    kept_bytes -= self._sizes.pop(oldest)
+            for _, key in sorted(kept):
+                self._resident[key] = resident[key]
+            self.resident_bytes = kept_bytes
+
+    def _index(self, key: str, document: Dict[str, Any]) -> None:
+        values = {field: document.get(field) for field in self.indexes}
+        for index in self.indexes.values():
+            index.add(key, values)
+        self._indexed[key] = values
+
+    def _unindex(self, key: str) -> None:
+        values = self._indexed.pop(key, None)
+        if values is not None:
+            for index in self.indexes.values():
+                index.remove(key, values)
+
+    def _make_resident(self, key: str, document: Dict[str, Any]) -> None:
+        self.resident_bytes -= self._sizes.get(key, 0)
+        size = document_size(document)
+        self._resident[key] = document
+        self._resident.move_to_end(key)
+        self._sizes[key] = size
+        self.resident_bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        if self.resident_bytes <= self.max_bytes:
+            return
+        # The most recently used document (the one just touched) always stays
+        for key in list(self._resident)[:-1]:
+            if self.resident_bytes <= self.max_bytes:
+                break
+            if self.is_pinned(key):
+                continue
+            if key in self._unwritten:
+                self.store.write(key, self._resident[key])
+                del self._unwritten[key]
+                self.write_outs += 1
+            del self._resident[key]
+            self.resident_bytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            document = self._resident.get(key)
+            if document is not None:
+                self._resident.move_to_end(key)
+                return document
+            if key not in self._indexed:
+                raise KeyError(key)
+            document = self.store.read(key)
+            if document is None:
+                raise KeyError(key)
+            self.rehydrations += 1
+            self._make_resident(key, document)
+            return document
+
+    def __setitem__(self, key: str, document: Dict[str, Any]) -> None:
+        with self._lock:
+            self._unindex(key)
+            self._index(key, document)
+            self._unwritten[key] = None
+            self._make_resident(key, document)
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            if key not in self._indexed:
+                raise KeyError(key)
+            self._unindex(key)
+            self._unwritten.pop(key, None)
+            if self._resident.pop(key, None) is not None:
+                self.resident_bytes -= self._sizes.pop(key)
+            self.store.delete(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._indexed
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._indexed))
+
+    def __len__(self) -> int:
+        return len(self._indexed)
+
+    def write_out(self, key: str) -> bool:
+        """
+        Write the resident document of `key` to the store if it changed since its last write. Evicted keys
+        were written out when they were evicted. Runs under the lock, so a write never races an eviction.
+        """
+        with self._lock:
+            if key not in self._unwritten:
+                return False
+            self.store.write(key, self._resident[key])
+            del self._unwritten[key]
+            return True
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        # Bulk reads (listings, index lookups) read evicted documents without making them resident,
+        # so that one dashboard build or listing does not push the live sessions out
+        document = self._resident.get(key)
+        return document if document is not None else self.store.read(key)
+
+    def values(self) -> List[Dict[str, Any]]:
+        return [document for _, document in self.items()]
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        items = [(key, self._read(key)) for key in list(self._indexed)]
+        return [(key, document) for key, document in items if document is not None]
+
+    def lookup(self, field: str, values: Iterable[Any]) -> List[Dict[str, Any]]:
+        documents = [self._read(key) for key in self.indexes[field].lookup(values)]
+        return [document for document in documents if document is not None]
+
+    def check_indexes(self) -> List[str]:
+        problems = []
+        items = self.items()
+        for index in self.indexes.values():
+            problems += index.check(items)
+        return problems
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self._indexed),
+            "resident": len(self._resident),
+            "resident_bytes": self.resident_bytes,
+            "budget_bytes": self.max_bytes,
+            "unwritten": len(self._unwritten),
+            "evictions": self.evictions,
+            "write_outs": self.write_outs,
+            "rehydrations": self.rehydrations,
+        }
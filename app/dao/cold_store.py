@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.utils.misc import json_default
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where only a single process can use the store anyway
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PACK_FILE = "pack.z"
+INDEX_FILE = "index.jsonl"
+# Length prefix of every record in the pack
+RECORD_HEADER = struct.Struct("<I")
+# Session fields kept in the index, so that lookups by them do not decompress anything
+INDEXED_FIELDS = ["user_id", "course_id"]
+
+# Raw event, as stored by the event stores: (type, timestamp, data)
+EventRecord = Tuple[str, Optional[str], Optional[dict]]
+
+
+class ColdStore:
+    """
+    Compressed, append-only storage for data that is no longer live: completed sessions and the event
+    history that was trimmed from the event store.
+
+    `pack.z` is a sequence of length-prefixed, zlib-compressed JSON records, either
+        {"kind": "session", "id": ..., "document": {...}, "events": [[type, timestamp, data], ...]}
+    or
+        {"kind": "events", "id": ..., "events": [...]}.
+    `index.jsonl` has one line per record with its offset, length and the session's indexed fields, so a
+    session is read with one seek and one decompression, and never by scanning the pack.
+
+    Appends take an exclusive file lock, so several workers can share the directory. The index is re-read
+    from where it was last read whenever a lookup misses, which picks up other workers' appends.
+    Archiving a session again appends a new record; the latest one wins. A restored session (see
+    Db.restore_session) takes the events of its latest record back, so its next record holds them again.
+    """
+
+    def __init__(self, root: str, compression_level: int = 6):
+        self.root = root
+        self.pack_path = os.path.join(root, PACK_FILE)
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        # session id -> index entry of its latest session record
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        # session id -> index entries of its event records, in append order
+        self._events: Dict[str, List[Dict[str, Any]]] = {}
+        self._index_position = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.reads = 0
+        self._refresh()
+
+    def _refresh(self) -> None:
+        """Read the index entries appended (by this or another process) since the last refresh."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r") as file:
+            file.seek(self._index_position)
+            while True:
+                line = file.readline()
+                if not line.endswith("\n"):
+                    # Nothing more, or an entry another process is still writing
+                    break
+                self._index_position = file.tell()
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt cold store index entry in {self.index_path}")
+                    continue
+                self._add_to_index(entry)
+
+    def _add_to_index(self, entry: Dict[str, Any]) -> None:
+        self.raw_bytes += entry.get("raw", 0)
+        self.compressed_bytes += entry["length"]
+        if entry["kind"] == "session":
+            self._sessions[entry["id"]] = entry
+        else:
+            self._events.setdefault(entry["id"], []).append(entry)
+
+    def _append(self, record: Dict[str, Any], fields: Dict[str, Any]) -> None:
+        raw = json.dumps(record, default=json_default).encode("utf-8")
+        payload = zlib.compress(raw, self.compression_level)
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.pack_path, "ab") as pack, open(self.index_path, "a") as index:
+                if fcntl:
+                    fcntl.flock(pack.fileno(), fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    offset = pack.seek(0, os.SEEK_END)
+                    pack.write(RECORD_HEADER.pack(len(payload)) + payload)
+                    pack.flush()
+                    os.fsync(pack.fileno())
+                    entry = {"kind": record["kind"], "id": record["id"], "offset": offset, "length": len(payload), "raw": len(raw), **fields}
+                    index.write(json.dumps(entry) + "\n")
+                    index.flush()
+                    self._index_position = index.tell()
+                finally:
+                    if fcntl:
+                        fcntl.flock(pack.fileno(), fcntl.LOCK_UN)
+            self._add_to_index(entry)
+
+    def _read(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        with open(self.pack_path, "rb") as pack:
+            pack.seek(entry["offset"] + RECORD_HEADER.size)
+            payload = pack.read(entry["length"])
+        self.reads += 1
+        return json.loads(zlib.decompress(payload))
+
+    def put_session(self, document: Dict[str, Any], events: Iterable[EventRecord] = ()) -> None:
+        fields = {field: getattr(document.get(field), "value", document.get(field)) for field in INDEXED_FIELDS}
+        self._append({"kind": "session", "id": document["id"], "document": document, "events": list(events)}, fields)
+
+    def put_events(self, session_id: str, events: Iterable[EventRecord]) -> None:
+        events = list(events)
+        if events:
+            self._append({"kind": "events", "id": session_id, "events": events}, {})
+
+    def _session_entry(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            with self._lock:
+                self._refresh()
+            entry = self._sessions.get(session_id)
+        return entry
+
+    def __contains__(self, session_id: object) -> bool:
+        return self._session_entry(session_id) is not None
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._session_entry(session_id)
+        return self._read(entry)["document"] if entry else None
+
+    def find(self, field: str, values: List[Any]) -> List[Dict[str, Any]]:
+        """Archived session documents whose indexed `field` is one of `values`."""
+        values = {getattr(value, "value", value) for value in values}
+        with self._lock:
+            self._refresh()
+        entries = [entry for entry in list(self._sessions.values()) if entry.get(field) in values]
+        return [self._read(entry)["document"] for entry in entries]
+
+    def session_events(self, session_id: str) -> List[EventRecord]:
+        """Events archived with the latest session record (not the trimmed history, see iter_events)."""
+        entry = self._session_entry(session_id)
+        return [tuple(event) for event in self._read(entry)["events"]] if entry else []
+
+    def iter_events(self, session_id: str) -> Iterator[EventRecord]:
+        """Archived events of a session, oldest first."""
+        for entry in list(self._events.get(session_id, [])):
+            yield from (tuple(event) for event in self._read(entry)["events"])
+        yield from self.session_events(session_id)
+
+    def iter_records(self, latest_only: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Every record of the pack in append order, read sequentially (for exports and offline jobs).
+        With `latest_only`, session records superseded by a later record of the same session are skipped:
+        a session archived again after being restored carries the events of its previous record.
+        """
+        if not os.path.exists(self.pack_path):
+            return
+        if latest_only:
+            with self._lock:
+                self._refresh()
+            latest = {entry["id"]: entry["offset"] for entry in list(self._sessions.values())}
+        with open(self.pack_path, "rb") as pack:
+            while True:
+                offset = pack.tell()
+                header = pack.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                payload = pack.read(RECORD_HEADER.unpack(header)[0])
+                try:
+                    record = json.loads(zlib.decompress(payload))
+                except zlib.error:
+                    # Torn append at the tail of the pack
+                    logger.warning(f"Skipping corrupt cold store record in {self.pack_path}")
+                    break
+                if latest_only and record["kind"] == "session" and latest.get(record["id"], offset) != offset:
+                    continue
+                yield record
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "event_batches": sum(len(entries) for entries in self._events.values()),
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "compression_ratio": round(self.raw_bytes / self.compressed_bytes, 2) if self.compressed_bytes else None,
+            "reads": self.reads,
+        }
@@ -1,43 +1,57 @@
-
-import json
 import os
+import threading
+import time
 from datetime import date, datetime
-from enum import Enum
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, Iterable, List, Optional, Union
 
+from app.dao.cold_store import ColdStore, EventRecord
+from app.dao.model_cache import ModelCache
+from app.dao.snapshotter import Snapshotter
+from app.dao.sqlite_storage import SqliteBackend
+from app.dao.storage import COLLECTION_FILES, JsonBackend, StorageBackend
+from app.dao.timeseries import UserHistory
 from app.models.character import Character
 from app.models.course import Course
 from app.models.dashboard import Dashboard
-from app.models.session import Session
+from app.models.session import Session, SessionStatus
 from app.models.user import User
 from app.models.game import Game
+from app.utils.metrics import metrics
+
+
+DATA_DIR = os.environ.get("DB_DATA_DIR", "app/data")
+# "json": collections held in memory and persisted to the JSON files in DATA_DIR.
+# "sqlite": collections stored in a SQLite database (DB_SQLITE_PATH, defaults to DATA_DIR/tutor.db).
+STORAGE_BACKEND = os.environ.get("DB_BACKEND", "json")
+# Only used by the json backend, see JsonBackend
+PERSISTENCE_MODE = os.environ.get("DB_PERSISTENCE_MODE", "file")
+BACKGROUND_WRITER = os.environ.get("DB_BACKGROUND_WRITER", "false").lower() in ("1", "true", "yes")
+# Load the json backend's collection files from binary snapshots written next to them, see binary_snapshot
+BINARY_SNAPSHOT = os.environ.get("DB_BINARY_SNAPSHOT", "false").lower() in ("1", "true", "yes")
+# Memory budget of resident sessions in the sharded json backend (0: keep every session in memory)
+SESSION_CACHE_BYTES = int(os.environ.get("DB_SESSION_CACHE_BYTES", 0))
+# How long a connection owns a session after its last message, see SessionLeases
+SESSION_LEASE_TTL = float(os.environ.get("SESSION_LEASE_TTL", 120))
+# Seconds between background flushes of sessions changed through update_session_in_memory (0 disables)
+SNAPSHOT_INTERVAL = float(os.environ.get("DB_SNAPSHOT_INTERVAL", 10))
+# Move completed sessions and trimmed event history to a compressed cold tier in DATA_DIR/cold, see ColdStore
+COLD_TIER = os.environ.get("DB_COLD_TIER", "false").lower() in ("1", "true", "yes")
+COLD_DIR = "cold"
 
 
-def load_json_data(file_path: str) -> Dict[str, Any]:
-    """Load data from a JSON file."""
-    try:
-        with open(file_path, 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        return {}
-
-def save_json_data(file_path: str, data: Dict[str, Any]) -> None:
-    """Save data to a JSON file."""
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w') as file:
-        # Ensure complex types like datetime and Enum are converted to JSON-serialisable
-        # representations before writing to disk.
-        def _json_default(obj):
-            if isinstance(obj, (datetime, date)):
-                return obj.isoformat()
-            if isinstance(obj, Enum):
-                return obj.value
-            # Fallback to string representation for any other non-serialisable types
-            return str(obj)
-
-        json.dump(data, file, indent=2, default=_json_default)
+def create_backend(backend: str, data_dir: str, persistence_mode: str) -> StorageBackend:
+    if backend == "json":
+        return JsonBackend(
+            data_dir,
+            persistence_mode,
+            background_writer=BACKGROUND_WRITER,
+            binary_snapshot=BINARY_SNAPSHOT,
+            session_cache_bytes=SESSION_CACHE_BYTES,
+        )
+    if backend == "sqlite":
+        return SqliteBackend(os.environ.get("DB_SQLITE_PATH") or os.path.join(data_dir, "tutor.db"))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
 
 class Db:
     _instance = None
@@ -48,60 +62,245 @@ class Db:
             Db._instance = Db()
         return Db._instance
     
-    def __init__(self):
-        self.users = load_json_data("app/data/users.json")
-        self.courses = load_json_data("app/data/courses.json")
-        self.sessions = load_json_data("app/data/sessions.json")
-        self.games = load_json_data("app/data/games.json")
-        self.reports = load_json_data("app/data/dashboards.json")
-        self.characters = load_json_data("app/data/characters.json")
+    def __init__(self, data_dir: str = None, persistence_mode: str = None, backend: str = None, cold_tier: bool = None):
+        self.data_dir = data_dir or DATA_DIR
+        self.backend = create_backend(backend or STORAGE_BACKEND, self.data_dir, persistence_mode or PERSISTENCE_MODE)
+        # Session events live outside the session documents, see EventStore
+        self.events = self.backend.event_store()
+        # Validated courses, games, users and characters. Shared instances, see ModelCache.
+        self.model_cache = ModelCache()
+        # Collection versions the cached models were loaded at (only tracked for storage shared between workers)
+        self._cache_versions: Dict[str, int] = {}
+        self.leases = self.backend.session_leases()
+        # Sessions changed in memory but not persisted yet: session id -> time it first became dirty
+        self._dirty_sessions: Dict[str, float] = {}
+        self._dirty_lock = threading.Lock()
+        # Last day each user was recorded as active, so that only the first activity of a day writes
+        self._active_days: Dict[str, date] = {}
+        self.snapshotter = None
+        if not self.backend.write_through and SNAPSHOT_INTERVAL > 0:
+            self.snapshotter = Snapshotter(self.flush_dirty_sessions, SNAPSHOT_INTERVAL)
+        self.cold = None
+        if COLD_TIER if cold_tier is None else cold_tier:
+            self.cold = ColdStore(os.path.join(self.data_dir, COLD_DIR))
+        metrics.register("db", self.backend.stats)
+        metrics.register("db.model_cache", self.model_cache.stats)
+        metrics.register("db.sessions", self.session_stats)
+        if self.cold:
+            metrics.register("db.cold", self.cold.stats)
+
+    def __getattr__(self, name: str):
+        # db.users, db.sessions, ...: collections are loaded by the backend on first access, not at startup
+        if name in COLLECTION_FILES:
+            return self.backend.collection(name)
+        raise AttributeError(name)
+
+    def _persist(self, collection: str, key: str):
+        """Persist a write to `collection[key]`. Bulk writes (create_users, update_sessions, ...) go through backend.put_many instead."""
+        self.backend.persist(collection, key)
+
+    async def flush(self):
+        """Durability point: wait until every write so far has reached the storage."""
+        await self.backend.flush()
+
+    def check_consistency(self) -> List[str]:
+        """Problems found in the backend's derived structures (e.g. secondary indexes). Empty when consistent."""
+        return self.backend.check_consistency()
+
+    def acquire_session_lease(self, session_id: str, owner: str) -> bool:
+        """Take or renew ownership of a live session. False if another connection (possibly in another worker) owns it."""
+        return self.leases.acquire(session_id, owner, SESSION_LEASE_TTL)
+
+    def release_session_lease(self, session_id: str, owner: str):
+        self.leases.release(session_id, owner)
+
+    def flush_dirty_sessions(self, session_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        Persist sessions changed through update_session_in_memory (all of them, or only `session_ids`).
+        Runs on the snapshotter thread as well as on the event loop. Returns the number of sessions flushed.
+        """
+        with self._dirty_lock:
+            if session_ids is None:
+                flushed = list(self._dirty_sessions)
+                self._dirty_sessions = {}
+            else:
+                flushed = [session_id for session_id in session_ids if self._dirty_sessions.pop(session_id, None) is not None]
+        flushed = [session_id for session_id in flushed if session_id in self.sessions]
+        if flushed:
+            self.backend.persist_many("sessions", flushed)
+        return len(flushed)
+
+    def session_stats(self) -> Dict[str, Any]:
+        with self._dirty_lock:
+            oldest = min(self._dirty_sessions.values(), default=None)
+            dirty = len(self._dirty_sessions)
+        stats = {
+            "dirty_sessions": dirty,
+            # How much in-memory progress a crash right now would lose
+            "recovery_point_lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+        }
+        if self.snapshotter:
+            stats["snapshotter"] = self.snapshotter.stats()
+        return stats
+
+    def _event_records(self, session_id: str) -> List[EventRecord]:
+        return [
+            (event.type, event.timestamp.isoformat() if event.timestamp else None, event.data)
+            for event in self.events.iter_events(session_id)
+        ]
+
+    def trim_events(self, session_id: str, keep: Iterable[str]):
+        """Drop every event of a session except those of the `keep` types. With a cold tier, they are archived there first."""
+        keep = list(keep)
+        if self.cold:
+            self.cold.put_events(session_id, [record for record in self._event_records(session_id) if record[0] not in keep])
+        self.events.retain(session_id, keep)
+
+    def archive_session(self, session_id: str) -> bool:
+        """
+        Move a completed session whose dashboard stats are built, with its remaining events, to the cold tier.
+        It stays readable through get_session and get_sessions_by_user_id. Returns whether it was archived.
+        """
+        if not self.cold:
+            return False
+        session_json = self.sessions.get(session_id)
+        if not session_json or getattr(session_json.get("status"), "value", session_json.get("status")) != SessionStatus.COMPLETED.value:
+            return False
+        last_event = self.events.last(session_id)
+        if last_event is None or last_event.type != "dashboard_built":
+            return False
+        with self._dirty_lock:
+            self._dirty_sessions.pop(session_id, None)
+        self.cold.put_session(session_json, self._event_records(session_id))
+        del self.sessions[session_id]
+        self.events.retain(session_id, [])
+        self._persist("sessions", session_id)
+        return True
+
+    def archive_completed_sessions(self) -> int:
+        """Archive every archivable session (see archive_session). For offline sweeps, not while a server runs on the data."""
+        return sum(self.archive_session(session_id) for session_id in list(self.sessions))
+
+    def is_archived(self, session_id: str) -> bool:
+        return self.cold is not None and session_id not in self.sessions and session_id in self.cold
+
+    def restore_session(self, session_id: str) -> bool:
+        """
+        Bring an archived session back into the live store, with the events it was archived with, so that it
+        can be worked on again (archive_session moves it back out later). True if the session is live now.
+        """
+        if session_id in self.sessions:
+            return True
+        if not self.is_archived(session_id):
+            return False
+        for event_type, timestamp, data in self.cold.session_events(session_id):
+            self.events.append(session_id, event_type, data, timestamp)
+        self.update_session(session_id, self.cold.get_session(session_id))
+        return True
+
+    def close(self):
+        if self.snapshotter:
+            self.snapshotter.stop()
+        self.flush_dirty_sessions()
+        self.backend.close()
 
     def get_session(self, session_id: str):
         session_json = self.sessions.get(session_id, None)
+        if not session_json and self.cold:
+            session_json = self.cold.get_session(session_id)
         if not session_json:
             return None
         return Session(**session_json)
     
-    def get_user(self, user_id: str):
-        user_json = self.users.get(user_id, None)
-        if not user_json:
+    def _load_model(self, collection: str, key: str, model):
+        document = getattr(self, collection).get(key, None)
+        if not document:
             return None
-        return User(**user_json)
+        return model(**document)
+
+    def _cached_model(self, collection: str, key: str, load, copy: bool = False):
+        # Another worker may have written the collection since the models were cached
+        version = self.backend.collection_version(collection)
+        if version is not None and version != self._cache_versions.get(collection):
+            self.model_cache.invalidate(collection)
+            self._cache_versions[collection] = version
+        return self.model_cache.get(collection, key, load, copy=copy)
+
+    def get_user(self, user_id: str):
+        # Callers (e.g. DashboardBuilder) modify the user, so they get their own copy
+        return self._cached_model("users", user_id, lambda: self._load_model("users", user_id, User), copy=True)
     
     def create_user(self, user_id: str, user_data: Dict[str, Any]):
         self.users[user_id] = user_data
-        save_json_data("app/data/users.json", self.users)
+        self.model_cache.invalidate("users", user_id)
+        self._persist("users", user_id)
+
+    def create_users(self, users: Dict[str, Dict[str, Any]]):
+        """Write many users with a single persistence flush (bulk imports)."""
+        self.backend.put_many("users", list(users.items()))
+        for user_id in users:
+            self.model_cache.invalidate("users", user_id)
+
+    def update_sessions(self, sessions: Dict[str, Dict[str, Any]]):
+        """Write many sessions with a single persistence flush (bulk imports)."""
+        sessions = {session_id: Session(**session_data).model_dump() for session_id, session_data in sessions.items()}
+        self.backend.put_many("sessions", list(sessions.items()))
+        with self._dirty_lock:
+            for session_id in sessions:
+                self._dirty_sessions.pop(session_id, None)
+
+    def update_courses(self, courses: Dict[str, Dict[str, Any]]):
+        """Write many courses with a single persistence flush (bulk imports)."""
+        self.backend.put_many("courses", list(courses.items()))
+        for course_id in courses:
+            self.model_cache.invalidate("courses", course_id)
 
     def update_session(self, session_id: str, session_data: Dict[str, Any]):
         session_data = Session(**session_data)
         self.sessions[session_id] = session_data.model_dump()
-        save_json_data("app/data/sessions.json", self.sessions)
+        with self._dirty_lock:
+            self._dirty_sessions.pop(session_id, None)
+        self._persist("sessions", session_id)
     
     def update_session_in_memory(self, session_id: str, session_data: Union[Dict[str, Any], Session]):
+        """Update a session without persisting it right away. It is flushed by the snapshotter, on disconnect or on shutdown."""
         if isinstance(session_data, Session):
             self.sessions[session_id] = session_data.model_dump()
         else:
             self.sessions[session_id] = session_data
+        if not self.backend.write_through:
+            with self._dirty_lock:
+                self._dirty_sessions.setdefault(session_id, time.time())
+
+    def patch_session(self, session_id: str, changes: Dict[str, Any]) -> bool:
+        """
+        Update some top-level fields of a session, in memory like update_session_in_memory, without the
+        caller serializing the whole session. An archived session is restored first (see restore_session).
+        False if there is no such session.
+        """
+        if not self.restore_session(session_id):
+            return False
+        session_json = self.sessions[session_id]
+        self.update_session_in_memory(session_id, {**session_json, **changes})
+        return True
 
     def update_user(self, user_id: str, user_data: Dict[str, Any]):
         self.users[user_id] = user_data
-        save_json_data("app/data/users.json", self.users)
+        self.model_cache.invalidate("users", user_id)
+        self._persist("users", user_id)
     
     def update_course(self, course_id: str, course_data: Dict[str, Any]):
         self.courses[course_id] = course_data
-        save_json_data("app/data/courses.json", self.courses)
+        self.model_cache.invalidate("courses", course_id)
+        self._persist("courses", course_id)
 
     def get_course(self, course_id: str):
-        course_json = self.courses.get(course_id, None)
-        if not course_json:
-            return None
-        return Course(**course_json)
+        # Shared instance, frozen (see ModelCache): model_copy it to modify it
+        return self._cached_model("courses", course_id, lambda: self._load_model("courses", course_id, Course))
     
     def get_game(self, game_id: str):
-        game_json = self.games.get(game_id, None)
-        if not game_json:
-            return None
-        return Game(**game_json)
+        # Shared instance, frozen (see ModelCache): model_copy it to modify it
+        return self._cached_model("games", game_id, lambda: self._load_model("games", game_id, Game))
     
     def get_dashboard(self, user_id: str):
         dashboard_json = self.reports.get(user_id, None)
@@ -111,13 +310,50 @@ class Db:
     
     def update_dashboard(self, user_id: str, dashboard_data: Dict[str, Any]):
         self.reports[user_id] = dashboard_data
-        save_json_data("app/data/dashboards.json", self.reports)
+        self._persist("reports", user_id)
+
+    def get_user_history(self, user_id: str) -> UserHistory:
+        return UserHistory(user_id, self.histories.get(user_id))
+
+    def update_user_history(self, history: UserHistory):
+        self.histories[history.user_id] = history.to_document()
+        self._persist("histories", history.user_id)
+
+    def record_skill_stats(self, user_id: str, session_id: str, timestamp: datetime, skill_stats: Dict[str, Optional[float]]):
+        """Record a session's skill stats snapshot in the user's time series, replacing its earlier one, see UserHistory."""
+        history = self.get_user_history(user_id)
+        if history.append(timestamp, skill_stats, session_id=session_id):
+            self.update_user_history(history)
+
+    def record_activity(self, user_id: str, day: Optional[date] = None):
+        """Mark the user as active on `day` (today by default). Only the first call of a day touches storage."""
+        day = day or date.today()
+        if self._active_days.get(user_id) == day:
+            return
+        history = self.get_user_history(user_id)
+        if history.mark_active(day):
+            self.update_user_history(history)
+        self._active_days[user_id] = day
 
     def get_sessions_by_user_id(self, user_id: str):
-        return [Session(**session_json) for session_json in self.sessions.values() if session_json.get("user_id") == user_id]
+        sessions = [Session(**session_json) for session_json in self.backend.find("sessions", "user_id", [user_id])]
+        if self.cold:
+            # Archived sessions that are not live again
+            hot_ids = {session.id for session in sessions}
+            sessions += [Session(**session_json) for session_json in self.cold.find("user_id", [user_id]) if session_json["id"] not in hot_ids]
+        return sessions
+
+    def _load_character(self, name: str):
+        character_jsons = self.backend.find("characters", "name", [name])
+        return Character(**character_jsons[0]) if character_jsons else None
 
     def get_characters_by_names(self, character_names: List[str]):
-        return [Character(**character_json) for character_json in self.characters if character_json.get("name") in character_names]
+        # Shared, frozen instances, returned in the order of the requested names
+        characters = [
+            self._cached_model("characters", name, lambda name=name: self._load_character(name))
+            for name in dict.fromkeys(character_names or [])
+        ]
+        return [character for character in characters if character is not None]
     
     def get_all_characters(self):
         return [Character(**character_json) for character_json in self.characters]
@@ -0,0 +1,146 @@
+"""
+Columnar export of the session events archived in the cold tier.
+
+Writes a NumPy `.npz` archive (readable with `numpy.load`, numpy itself is not needed to write it) with one
+array per column, one row per event:
+
+    session        int32           index into `session_ids`
+    event_type     int32           index into `event_types`
+    timestamp      datetime64[us]  NaT when the event had none
+    command_type   int32           index into `command_types`, -1 if none. The command type of executed
+                                   commands, the interaction type of student interactions.
+    correct        int8            1 / 0 for answered questions, -1 otherwise
+    session_ids, event_types, command_types   the category labels (unicode arrays)
+
+Only the cold tier is read, sequentially, so the export can run next to a live server.
+
+Usage:
+    python -m app.dao.event_export --data-dir app/data --output events.npz [--archive]
+
+`--archive` first moves completed sessions to the cold tier (offline only: not while a server uses the data).
+"""
+import argparse
+import logging
+import os
+import struct
+import sys
+import zipfile
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.dao.cold_store import ColdStore
+from app.dao.db import COLD_DIR, Db
+
+logger = logging.getLogger(__name__)
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+EPOCH = datetime(1970, 1, 1)
+NAT = -2 ** 63
+
+
+class _Categories:
+    """Maps labels to dense integer codes in order of first appearance."""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+
+    def code(self, label: Optional[str]) -> int:
+        if label is None:
+            return -1
+        return self.codes.setdefault(label, len(self.codes))
+
+    def labels(self) -> List[str]:
+        return list(self.codes)
+
+
+def _npy(descr: str, length: int, data: bytes) -> bytes:
+    """A 1-D array in the .npy format (version 1.0)."""
+    header = repr({"descr": descr, "fortran_order": False, "shape": (length,)})
+    # The header is padded so that the data starts on a 64 byte boundary
+    header += " " * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1") + data
+
+
+def _numeric(values: array, descr: str) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return _npy(descr, len(values), values.tobytes())
+
+
+def _strings(values: List[str]) -> bytes:
+    width = max([len(value) for value in values] + [1])
+    data = "".join(value.ljust(width, "\0") for value in values).encode("utf-32-le")
+    return _npy(f"<U{width}", len(values), data)
+
+
+def _timestamp(value: Optional[str]) -> int:
+    if not value:
+        return NAT
+    try:
+        return (datetime.fromisoformat(value).replace(tzinfo=None) - EPOCH) // timedelta(microseconds=1)
+    except ValueError:
+        return NAT
+
+
+def _command_type(event_type: str, data: Optional[Dict[str, Any]]) -> Optional[str]:
+    data = data or {}
+    if event_type == "execute_command":
+        return (data.get("command") or {}).get("command_type")
+    if event_type == "student_interaction":
+        return (data.get("interaction") or {}).get("type")
+    return None
+
+
+def _correct(event_type: str, data: Optional[Dict[str, Any]]) -> int:
+    interaction = (data or {}).get("interaction") or {}
+    if event_type != "student_interaction" or "correct" not in interaction:
+        return -1
+    return 1 if interaction["correct"] else 0
+
+
+def export_events(cold: ColdStore, path: str) -> int:
+    """Write the events of the cold tier to `path` as a compressed .npz. Returns the number of events."""
+    sessions, event_types, command_types = _Categories(), _Categories(), _Categories()
+    session_column, type_column, command_column = array("i"), array("i"), array("i")
+    timestamp_column, correct_column = array("q"), array("b")
+    # A session archived more than once only counts with its latest record, which holds the earlier events too
+    for record in cold.iter_records(latest_only=True):
+        session_code = sessions.code(record["id"])
+        for event_type, timestamp, data in record.get("events", []):
+            session_column.append(session_code)
+            type_column.append(event_types.code(event_type))
+            timestamp_column.append(_timestamp(timestamp))
+            command_column.append(command_types.code(_command_type(event_type, data)))
+            correct_column.append(_correct(event_type, data))
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        archive.writestr("session.npy", _numeric(session_column, "<i4"))
+        archive.writestr("event_type.npy", _numeric(type_column, "<i4"))
+        archive.writestr("timestamp.npy", _numeric(timestamp_column, "<M8[us]"))
+        archive.writestr("command_type.npy", _numeric(command_column, "<i4"))
+        archive.writestr("correct.npy", _numeric(correct_column, "|i1"))
+        archive.writestr("session_ids.npy", _strings(sessions.labels()))
+        archive.writestr("event_types.npy", _strings(event_types.labels()))
+        archive.writestr("command_types.npy", _strings(command_types.labels()))
+    os.replace(tmp_path, path)
+    return len(session_column)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export the archived session events as a columnar .npz file")
+    parser.add_argument("--data-dir", default=os.environ.get("DB_DATA_DIR", "app/data"))
+    parser.add_argument("--output", default="events.npz")
+    parser.add_argument("--archive", action="store_true", help="Archive completed sessions first (offline only)")
+    args = parser.parse_args()
+    if args.archive:
+        db = Db(data_dir=args.data_dir, cold_tier=True)
+        logger.info(f"Archived {db.archive_completed_sessions()} completed sessions")
+        db.close()
+    count = export_events(ColdStore(os.path.join(args.data_dir, COLD_DIR)), args.output)
+    logger.info(f"Exported {count} events to {args.output}")
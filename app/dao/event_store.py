@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.models.session import Event
+from app.utils.misc import json_default
+
+logger = logging.getLogger(__name__)
+
+# Record type marking that the events of a session before it were dropped (see `retain`)
+TRUNCATE = "__truncate__"
+
+
+class EventStore:
+    """
+    Append-only store of session events, keyed by session id. Events are kept out of the Session document
+    so that logging one does not re-serialize the session.
+    """
+
+    def append(self, session_id: str, event_type: str, data: Optional[dict] = None, timestamp: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def iter_events(self, session_id: str) -> Iterator[Event]:
+        """Events of a session in the order they were appended."""
+        raise NotImplementedError
+
+    def last(self, session_id: str) -> Optional[Event]:
+        raise NotImplementedError
+
+    def retain(self, session_id: str, event_types: Iterable[str]) -> None:
+        """Drop every event of a session except those of the given types."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+def _to_event(record: Tuple[str, str, Optional[dict]]) -> Event:
+    event_type, timestamp, data = record
+    return Event(type=event_type, timestamp=timestamp, data=data)
+
+
+class FileEventStore(EventStore):
+    """
+    Events are held in memory per session as compact (type, timestamp, data) tuples and appended to a
+    JSON lines file as `[session_id, type, timestamp, data]`. Appends are O(1) regardless of how many
+    events the session already has. The file is replayed on startup, and rewritten without the dropped
+    events if any `retain` happened since the last rewrite.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._events: Dict[str, List[Tuple[str, str, Optional[dict]]]] = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self.appends = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        truncated = False
+        with open(self.path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    session_id, event_type, timestamp, data = json.loads(line)
+                except (json.JSONDecodeError, ValueError):
+                    logger.warning(f"Skipping corrupt event record in {self.path}")
+                    continue
+                if event_type == TRUNCATE:
+                    self._events.pop(session_id, None)
+                    truncated = True
+                    continue
+                self._events.setdefault(session_id, []).append((event_type, timestamp, data))
+        if truncated:
+            self._rewrite()
+
+    def _rewrite(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            for session_id, records in self._events.items():
+                for event_type, timestamp, data in records:
+                    file.write(json.dumps([session_id, event_type, timestamp, data], default=json_default) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _write(self, session_id: str, event_type: str, timestamp: Optional[str], data: Optional[dict]) -> None:
+        line = json.dumps([session_id, event_type, timestamp, data], default=json_default) + "\n"
+        with self._lock:
+            if self._file is None:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a")
+            self._file.write(line)
+            self._file.flush()
+
+    def append(self, session_id: str, event_type: str, data: Optional[dict] = None, timestamp: Optional[str] = None) -> None:
+        timestamp = timestamp or datetime.now().isoformat()
+        self._events.setdefault(session_id, []).append((event_type, timestamp, data))
+        self._write(session_id, event_type, timestamp, data)
+        self.appends += 1
+
+    def session_ids(self) -> List[str]:
+        return list(self._events)
+
+    def iter_events(self, session_id: str) -> Iterator[Event]:
+        # Only the events present when iteration starts are yielded
+        records = self._events.get(session_id, [])
+        for index in range(len(records)):
+            yield _to_event(records[index])
+
+    def last(self, session_id: str) -> Optional[Event]:
+        records = self._events.get(session_id)
+        return _to_event(records[-1]) if records else None
+
+    def retain(self, session_id: str, event_types: Iterable[str]) -> None:
+        event_types = set(event_types)
+        kept = [record for record in self._events.get(session_id, []) if record[0] in event_types]
+        self._write(session_id, TRUNCATE, None, None)
+        self._events.pop(session_id, None)
+        for event_type, timestamp, data in kept:
+            self.append(session_id, event_type, data, timestamp)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._events),
+            "events": sum(len(records) for records in self._events.values()),
+            "appends": self.appends,
+        }
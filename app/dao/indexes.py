@@ -0,0 +1,126 @@
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+
+def index_value(value: Any) -> Optional[Hashable]:
+    # Enums (e.g. SessionStatus) are indexed by value so that "ACTIVE" and SessionStatus.ACTIVE match
+    value = getattr(value, "value", value)
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return value
+
+
+class HashIndex:
+    """Maps a document field value to the keys of the documents holding it (in insertion order)."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.entries: Dict[Hashable, Dict[Any, None]] = {}
+
+    def add(self, key: Any, document: Dict[str, Any]) -> None:
+        value = index_value(document.get(self.field))
+        if value is None:
+            return
+        self.entries.setdefault(value, {})[key] = None
+
+    def remove(self, key: Any, document: Dict[str, Any]) -> None:
+        value = index_value(document.get(self.field))
+        keys = self.entries.get(value)
+        if keys is None:
+            return
+        keys.pop(key, None)
+        if not keys:
+            del self.entries[value]
+
+    def lookup(self, values: Iterable[Any]) -> List[Any]:
+        keys = {}
+        for value in values:
+            keys.update(self.entries.get(index_value(value), {}))
+        return list(keys)
+
+    def rebuild(self, items: Iterable) -> None:
+        self.entries = {}
+        for key, document in items:
+            self.add(key, document)
+
+    def check(self, items: Iterable) -> List[str]:
+        """Compare the index against a fresh build from `items`. Returns the discrepancies found."""
+        expected = HashIndex(self.field)
+        expected.rebuild(items)
+        problems = []
+        for value in set(expected.entries) | set(self.entries):
+            expected_keys = set(expected.entries.get(value, {}))
+            actual_keys = set(self.entries.get(value, {}))
+            if expected_keys - actual_keys:
+                problems.append(f"{self.field}={value!r}: missing {sorted(map(str, expected_keys - actual_keys))}")
+            if actual_keys - expected_keys:
+                problems.append(f"{self.field}={value!r}: stale {sorted(map(str, actual_keys - expected_keys))}")
+        return problems
+
+
+class IndexedDict(dict):
+    """
+    A dict of documents that keeps hash indexes on some of their fields up to date on every write.
+    Documents must be replaced rather than mutated in place, otherwise the indexes go stale
+    (`check_indexes` detects that).
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, fields: Iterable[str] = ()):
+        super().__init__(data or {})
+        self.indexes = {field: HashIndex(field) for field in fields}
+        for index in self.indexes.values():
+            index.rebuild(super().items())
+
+    def _index(self, key, document) -> None:
+        if isinstance(document, dict):
+            for index in self.indexes.values():
+                index.add(key, document)
+
+    def _unindex(self, key) -> None:
+        document = super().get(key)
+        if isinstance(document, dict):
+            for index in self.indexes.values():
+                index.remove(key, document)
+
+    def __setitem__(self, key, value) -> None:
+        self._unindex(key)
+        super().__setitem__(key, value)
+        self._index(key, value)
+
+    def __delitem__(self, key) -> None:
+        self._unindex(key)
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        self._unindex(key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        for index in self.indexes.values():
+            index.remove(key, value)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self) -> None:
+        super().clear()
+        for index in self.indexes.values():
+            index.entries = {}
+
+    def lookup(self, field: str, values: Iterable[Any]) -> List[Dict[str, Any]]:
+        return [self[key] for key in self.indexes[field].lookup(values)]
+
+    def check_indexes(self) -> List[str]:
+        problems = []
+        for index in self.indexes.values():
+            problems += index.check(super().items())
+        return problems
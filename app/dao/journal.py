@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict
+
+from app.utils.misc import json_default
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = "journal.log"
+# Journal segment being folded into the snapshot. Only present on disk while a
+# compaction is running (or if the process died in the middle of one).
+COMPACTING_FILE = "journal.log.compacting"
+
+
+def write_snapshot(file_path: str, data: Any) -> None:
+    """Atomically replace a snapshot file with the given data."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=2, default=json_default)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class Journal:
+    """
+    Append-only write-ahead journal for the Db collections.
+
+    Every write appends a single line `{"c": collection, "k": key, "v": value}` holding only
+    the changed entity, so the cost of a write no longer depends on the size of the collection.
+    A deleted entity is journaled with a null value.
+    The collection JSON files act as the snapshot. A background compactor periodically folds the
+    journal into the snapshot and truncates it.
+
+    Startup: snapshot + `journal.log.compacting` (if a compaction was interrupted) + `journal.log`.
+    Entries are full entity values, so replaying an entry that is already part of the snapshot is harmless.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        snapshot_files: Dict[str, str],
+        compact_threshold_bytes: int = 4 * 1024 * 1024,
+        compact_interval_seconds: float = 300.0,
+    ):
+        self.data_dir = data_dir
+        self.snapshot_files = snapshot_files
+        self.compact_threshold_bytes = compact_threshold_bytes
+        self.compact_interval_seconds = compact_interval_seconds
+        self.journal_path = os.path.join(data_dir, JOURNAL_FILE)
+        self.compacting_path = os.path.join(data_dir, COMPACTING_FILE)
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._compactor = None
+        self.appends = 0
+        self.compactions = 0
+
+    def _open(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._file = open(self.journal_path, "a")
+        self._size = self._file.tell()
+
+    def replay(self, collections: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Apply the journal entries on top of the already loaded snapshot. Returns the number of entries applied.
+        Collections are loaded lazily, so `collections` may hold only some of the journaled collections.
+        """
+        applied = 0
+        for path in (self.compacting_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as file:
+                for line_number, line in enumerate(file, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write at the tail of the journal (crash mid-append). Everything before it is intact.
+                        logger.warning(f"Skipping corrupt journal entry at {path}:{line_number}")
+                        continue
+                    collection = collections.get(entry["c"])
+                    if collection is None:
+                        if entry["c"] not in self.snapshot_files:
+                            logger.warning(f"Skipping journal entry for unknown collection {entry['c']}")
+                        continue
+                    if entry["v"] is None:
+                        collection.pop(entry["k"], None)
+                    else:
+                        collection[entry["k"]] = entry["v"]
+                    applied += 1
+        return applied
+
+    def append(self, collection: str, key: str, value: Any) -> None:
+        line = json.dumps({"c": collection, "k": key, "v": value}, default=json_default) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self.appends += 1
+            should_compact = self._size >= self.compact_threshold_bytes
+        if should_compact:
+            self._wakeup.set()
+
+    def compact(self, get_collections: Callable[[], Dict[str, Dict[str, Any]]]) -> None:
+        """
+        Fold the journal into the snapshot files.
+        The current journal is rotated out first so that appends can continue while the snapshot is written.
+        """
+        with self._compact_lock:
+            with self._lock:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                if os.path.exists(self.journal_path) and not os.path.exists(self.compacting_path):
+                    os.replace(self.journal_path, self.compacting_path)
+                self._open()
+            # Entities are replaced wholesale on write and never mutated in place, so a shallow copy
+            # of each collection is a consistent view of everything that was in the rotated journal.
+            collections = {name: dict(data) for name, data in get_collections().items()}
+            for name, data in collections.items():
+                write_snapshot(self.snapshot_files[name], data)
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+            self.compactions += 1
+            logger.info(f"Journal compacted into {len(collections)} snapshot files")
+
+    def start_compactor(self, get_collections: Callable[[], Dict[str, Dict[str, Any]]]) -> None:
+        if self._compactor is not None:
+            return
+
+        def run():
+            while not self._stopped.is_set():
+                self._wakeup.wait(self.compact_interval_seconds)
+                self._wakeup.clear()
+                if self._stopped.is_set():
+                    break
+                if self._size == 0 and not os.path.exists(self.compacting_path):
+                    continue
+                try:
+                    self.compact(get_collections)
+                except Exception as e:
+                    logger.error(f"Journal compaction failed: {str(e)}")
+
+        self._compactor = threading.Thread(target=run, name="db-journal-compactor", daemon=True)
+        self._compactor.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "journal_bytes": self._size,
+            "appends": self.appends,
+            "compactions": self.compactions,
+        }
@@ -0,0 +1,49 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class SessionLeases:
+    """
+    Ownership leases on sessions: only the lease owner (one websocket connection) drives a live session.
+    A lease expires `ttl_seconds` after it was last acquired, so a crashed worker cannot hold a session forever.
+    """
+
+    def acquire(self, session_id: str, owner: str, ttl_seconds: float) -> bool:
+        """Take or renew the lease. False if another owner holds an unexpired lease."""
+        raise NotImplementedError
+
+    def release(self, session_id: str, owner: str) -> None:
+        raise NotImplementedError
+
+    def owner(self, session_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+
+class LocalSessionLeases(SessionLeases):
+    """Leases for a single process (the json backend cannot be shared between workers anyway)."""
+
+    def __init__(self):
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, session_id: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(session_id)
+            if current and current[0] != owner and current[1] > now:
+                return False
+            self._leases[session_id] = (owner, now + ttl_seconds)
+            return True
+
+    def release(self, session_id: str, owner: str) -> None:
+        with self._lock:
+            current = self._leases.get(session_id)
+            if current and current[0] == owner:
+                del self._leases[session_id]
+
+    def owner(self, session_id: str) -> Optional[str]:
+        current = self._leases.get(session_id)
+        if current and current[1] > time.time():
+            return current[0]
+        return None
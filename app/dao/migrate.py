@@ -0,0 +1,76 @@
+"""
+Import the JSON data files into a SQLite database for the sqlite storage backend.
+
+Usage:
+    python -m app.dao.migrate [--data-dir app/data] [--sqlite-path app/data/tutor.db] [--persistence-mode sharded]
+
+The persistence mode of the data directory (journal or sharded) is detected unless given, so the import
+matches what the json backend would load. Existing documents with the same key are replaced. Session events (from
+events.jsonl and from `event_logs` embedded in old session documents) are appended to the events table,
+so run the import into a fresh database.
+"""
+import argparse
+import logging
+import os
+from typing import Dict, Mapping, Optional
+
+from app.dao.journal import JOURNAL_FILE
+from app.dao.sharded import MANIFEST_FILE
+from app.dao.sqlite_storage import KEY_FIELDS, SqliteBackend
+from app.dao.storage import COLLECTION_FILES, SHARDED_COLLECTIONS, JsonBackend
+
+logger = logging.getLogger(__name__)
+
+
+def _move_embedded_events(target: SqliteBackend, session_id: str, document: dict) -> dict:
+    # Sessions written before the event store existed carry their events inline
+    for event in document.get("event_logs") or []:
+        target.events.append(session_id, event.get("type"), event.get("data"), event.get("timestamp"))
+    return {key: value for key, value in document.items() if key != "event_logs"}
+
+
+def detect_persistence_mode(data_dir: str) -> str:
+    if os.path.exists(os.path.join(data_dir, JOURNAL_FILE)):
+        return "journal"
+    # Any sharded collection gives it away: a sharded data dir may have users but no sessions yet
+    if any(os.path.exists(os.path.join(data_dir, name, MANIFEST_FILE)) for name in SHARDED_COLLECTIONS):
+        return "sharded"
+    return "file"
+
+
+def migrate(data_dir: str, sqlite_path: str, persistence_mode: Optional[str] = None) -> Dict[str, int]:
+    persistence_mode = persistence_mode or detect_persistence_mode(data_dir)
+    # The source is only read: embedded events are moved into the target below, not into the source's event store
+    source = JsonBackend(data_dir, persistence_mode, migrate_events=False)
+    target = SqliteBackend(sqlite_path)
+    counts = {}
+    try:
+        for name in COLLECTION_FILES:
+            collection = source.collection(name)
+            if isinstance(collection, Mapping):
+                documents = list(collection.items())
+            else:
+                documents = [(document[KEY_FIELDS[name]], document) for document in collection]
+            if name == "sessions":
+                documents = [(key, _move_embedded_events(target, key, document)) for key, document in documents]
+            target.put_many(name, documents)
+            counts[name] = len(documents)
+            logger.info(f"Imported {len(documents)} documents into {name}")
+        for session_id in source.events.session_ids():
+            for event in source.events.iter_events(session_id):
+                target.events.append(session_id, event.type, event.data, event.timestamp.isoformat() if event.timestamp else None)
+    finally:
+        source.close()
+        target.close()
+    return counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Import the JSON data files into a SQLite database")
+    parser.add_argument("--data-dir", default=os.environ.get("DB_DATA_DIR", "app/data"))
+    parser.add_argument("--sqlite-path", default=None, help="Defaults to DB_SQLITE_PATH or <data-dir>/tutor.db")
+    parser.add_argument("--persistence-mode", choices=["file", "journal", "sharded"], default=None, help="Detected by default")
+    args = parser.parse_args()
+    sqlite_path = args.sqlite_path or os.environ.get("DB_SQLITE_PATH") or os.path.join(args.data_dir, "tutor.db")
+    migrate(args.data_dir, sqlite_path, args.persistence_mode)
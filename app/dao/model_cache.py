@@ -0,0 +1,105 @@
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict
+
+# Model class -> its frozen subclass, see freeze
+_frozen_classes: Dict[Type[BaseModel], Type[BaseModel]] = {}
+
+
+def _frozen_class(cls: Type[BaseModel]) -> Type[BaseModel]:
+    frozen = _frozen_classes.get(cls)
+    if frozen is None:
+
+        def model_copy(self, *, update=None, deep=False):
+            # Copies are the caller's own, so they can be modified (copy-on-write)
+            return _thaw(BaseModel.model_copy(self, update=update, deep=deep))
+
+        frozen = type(cls.__name__, (cls,), {
+            "__module__": cls.__module__,
+            "__qualname__": cls.__qualname__,
+            "model_config": ConfigDict(**{**cls.model_config, "frozen": True}),
+            "model_copy": model_copy,
+        })
+        _frozen_classes[cls] = frozen
+    return frozen
+
+
+def _walk(value: Any, model_class: Callable[[Type[BaseModel]], Type[BaseModel]]) -> None:
+    if isinstance(value, BaseModel):
+        object.__setattr__(value, "__class__", model_class(type(value)))
+        for field_value in value.__dict__.values():
+            _walk(field_value, model_class)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _walk(item, model_class)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _walk(item, model_class)
+
+
+def freeze(model: BaseModel) -> BaseModel:
+    """
+    Make `model` and every model nested in it frozen, in place: assigning a field raises a ValidationError
+    (frozen_instance). The models keep their class for isinstance checks (they become instances of a frozen
+    subclass of it). Lists and dicts in the fields stay mutable. `model_copy` returns a mutable copy.
+    """
+    _walk(model, _frozen_class)
+    return model
+
+
+def _thaw(model: BaseModel) -> BaseModel:
+    # Back to the original classes (the frozen class' base), for the models of a copy
+    _walk(model, lambda cls: cls.__bases__[0] if _frozen_classes.get(cls.__bases__[0]) is cls else cls)
+    return model
+
+
+class ModelCache:
+    """
+    Cache of validated pydantic models, keyed by (collection, key), so that documents are not re-validated
+    on every read. Entries are dropped by `invalidate` when the underlying document is written.
+
+    Instances are shared between callers, so they are frozen (see freeze): writing to one raises instead of
+    changing it for every connection. Pass `copy=True` to `get`, or `model_copy` the instance, for a model
+    the caller can modify (copy-on-write).
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], BaseModel] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, collection: str, key: str, load: Callable[[], Optional[BaseModel]], copy: bool = False) -> Optional[BaseModel]:
+        model = self._entries.get((collection, key))
+        if model is None:
+            self.misses += 1
+            model = load()
+            if model is None:
+                return None
+            self._entries[(collection, key)] = freeze(model)
+        else:
+            self.hits += 1
+        return model.model_copy(deep=True) if copy else model
+
+    def invalidate(self, collection: str, key: Optional[str] = None) -> None:
+        """Drop one entry, or every entry of `collection` when no key is given."""
+        self.invalidations += 1
+        if key is not None:
+            self._entries.pop((collection, key), None)
+            return
+        for entry in [entry for entry in self._entries if entry[0] == collection]:
+            del self._entries[entry]
+
+    def clear(self) -> None:
+        self.invalidations += 1
+        self._entries = {}
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from app.utils.misc import json_default
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.jsonl"
+
+
+class ShardedStore:
+    """
+    One JSON file per entity, fanned out over two levels of hashed directories:
+
+        <root>/<sha1(key)[:2]>/<sha1(key)[2:4]>/<quoted key>.json
+
+    Files are written to a temporary file and renamed over the old one, so a crash never leaves a torn entity.
+    A write only costs the size of the entity being written.
+
+    `manifest.jsonl` lists the keys that exist (one JSON string per line, appended when a new key is first
+    written, and `{"deleted": key}` when it is deleted), so startup knows which files to read without walking
+    the directory tree.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        self._keys: Dict[str, None] = {}
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.bytes_written = 0
+
+    def path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{quote(key, safe='')}.json")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    def keys(self) -> Iterable[str]:
+        return list(self._keys)
+
+    def _read_manifest(self) -> None:
+        self._keys = {}
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn append at the tail; the entity file may still exist and gets re-added on its next write
+                    logger.warning(f"Skipping corrupt manifest entry in {self.manifest_path}")
+                    continue
+                if isinstance(entry, dict):
+                    self._keys.pop(entry.get("deleted"), None)
+                else:
+                    self._keys[entry] = None
+
+    def read(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path(key), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logger.error(f"Corrupt entity file for {key} in {self.root}")
+            return None
+
+    def iter_all(self) -> Iterator[Tuple[str, Any]]:
+        """(key, document) of every stored entity, read one at a time."""
+        self._read_manifest()
+        for key in list(self._keys):
+            document = self.read(key)
+            if document is not None:
+                yield key, document
+
+    def load_all(self) -> Dict[str, Any]:
+        return dict(self.iter_all())
+
+    def write(self, key: str, value: Any) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = json.dumps(value, default=json_default)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+        self.writes += 1
+        self.bytes_written += len(content)
+        with self._lock:
+            if key not in self._keys:
+                os.makedirs(self.root, exist_ok=True)
+                with open(self.manifest_path, "a") as manifest:
+                    manifest.write(json.dumps(key) + "\n")
+                self._keys[key] = None
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key not in self._keys:
+                return
+            with open(self.manifest_path, "a") as manifest:
+                manifest.write(json.dumps({"deleted": key}) + "\n")
+            del self._keys[key]
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def import_all(self, data: Dict[str, Any]) -> None:
+        """Write every entity of `data`, e.g. when switching an existing monolithic collection file to shards."""
+        for key, value in data.items():
+            self.write(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entities": len(self._keys),
+            "writes": self.writes,
+            "bytes_written": self.bytes_written,
+        }
@@ -0,0 +1,48 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshotter:
+    """Calls `flush` every `interval_seconds` on a background thread (see Db.flush_dirty_sessions)."""
+
+    def __init__(self, flush: Callable[[], int], interval_seconds: float):
+        self.flush = flush
+        self.interval_seconds = interval_seconds
+        self.snapshots = 0
+        self.sessions_flushed = 0
+        self.errors = 0
+        self.last_snapshot_seconds = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-snapshotter", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            started = time.monotonic()
+            try:
+                flushed = self.flush()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Session snapshot failed: {str(e)}")
+                continue
+            if flushed:
+                self.snapshots += 1
+                self.sessions_flushed += flushed
+                self.last_snapshot_seconds = time.monotonic() - started
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join(self.interval_seconds + 5)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "snapshots": self.snapshots,
+            "sessions_flushed": self.sessions_flushed,
+            "errors": self.errors,
+            "last_snapshot_seconds": round(self.last_snapshot_seconds, 6),
+        }
@@ -0,0 +1,258 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+
+from app.dao.event_store import EventStore
+from app.dao.leases import SessionLeases
+from app.dao.storage import COLLECTION_FILES, StorageBackend
+from app.models.session import Event
+from app.utils.misc import json_default
+
+# Field of the document used as the primary key of each collection
+KEY_FIELDS = {
+    "users": "id",
+    "courses": "id",
+    "sessions": "id",
+    "games": "id",
+    "reports": "user_id",
+    "characters": "name",
+    "histories": "user_id",
+}
+# Document fields copied into their own indexed columns so that they can be queried without a scan
+INDEXED_FIELDS = {
+    "sessions": ["user_id", "course_id", "status"],
+}
+
+
+def _column_value(value: Any):
+    # Enums (e.g. SessionStatus) are stored by value
+    return getattr(value, "value", value)
+
+
+def _bump_version(connection: sqlite3.Connection, name: str) -> None:
+    connection.execute(
+        "INSERT INTO collection_versions (name, version) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET version = version + 1",
+        (name,),
+    )
+
+
+class SqliteCollection(MutableMapping):
+    """Dict-like, write-through view of one collection table. Documents are stored as JSON text."""
+
+    def __init__(self, backend: "SqliteBackend", name: str):
+        self.backend = backend
+        self.name = name
+        self.indexed_fields = INDEXED_FIELDS.get(name, [])
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        row = self.backend.query_one(f"SELECT doc FROM {self.name} WHERE key = ?", (key,))
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key: str, value: Dict[str, Any]) -> None:
+        self.backend.put_many(self.name, [(key, value)])
+
+    def __delitem__(self, key: str) -> None:
+        with self.backend.transaction() as connection:
+            if connection.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,)).rowcount == 0:
+                raise KeyError(key)
+            _bump_version(connection, self.name)
+
+    def __contains__(self, key: object) -> bool:
+        return self.backend.query_one(f"SELECT 1 FROM {self.name} WHERE key = ?", (key,)) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([row[0] for row in self.backend.query_all(f"SELECT key FROM {self.name} ORDER BY rowid")])
+
+    def __len__(self) -> int:
+        return self.backend.query_one(f"SELECT COUNT(*) FROM {self.name}")[0]
+
+    # Single query instead of one lookup per key
+    def values(self) -> List[Dict[str, Any]]:
+        return [json.loads(row[0]) for row in self.backend.query_all(f"SELECT doc FROM {self.name} ORDER BY rowid")]
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(row[0], json.loads(row[1])) for row in self.backend.query_all(f"SELECT key, doc FROM {self.name} ORDER BY rowid")]
+
+
+class SqliteEventStore(EventStore):
+    """Session events in an `events` table of the backend's database, indexed by session id."""
+
+    def __init__(self, backend: "SqliteBackend"):
+        self.backend = backend
+        self.appends = 0
+
+    def append(self, session_id: str, event_type: str, data: Optional[dict] = None, timestamp: Optional[str] = None) -> None:
+        timestamp = timestamp or datetime.now().isoformat()
+        self.backend.execute(
+            "INSERT INTO events (session_id, type, timestamp, data) VALUES (?, ?, ?, ?)",
+            (session_id, event_type, timestamp, json.dumps(data, default=json_default)),
+        )
+        self.appends += 1
+
+    def iter_events(self, session_id: str) -> Iterator[Event]:
+        rows = self.backend.query_all("SELECT type, timestamp, data FROM events WHERE session_id = ? ORDER BY id", (session_id,))
+        for event_type, timestamp, data in rows:
+            yield Event(type=event_type, timestamp=timestamp, data=json.loads(data))
+
+    def last(self, session_id: str) -> Optional[Event]:
+        row = self.backend.query_one("SELECT type, timestamp, data FROM events WHERE session_id = ? ORDER BY id DESC LIMIT 1", (session_id,))
+        if row is None:
+            return None
+        return Event(type=row[0], timestamp=row[1], data=json.loads(row[2]))
+
+    def retain(self, session_id: str, event_types: Iterable[str]) -> None:
+        event_types = list(event_types)
+        placeholders = ", ".join("?" for _ in event_types)
+        condition = f" AND type NOT IN ({placeholders})" if event_types else ""
+        self.backend.execute(f"DELETE FROM events WHERE session_id = ?{condition}", (session_id, *event_types))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"appends": self.appends}
+
+
+class SqliteSessionLeases(SessionLeases):
+    """Leases in a `leases` table, so that they are shared by every worker process using the database."""
+
+    def __init__(self, backend: "SqliteBackend"):
+        self.backend = backend
+
+    def acquire(self, session_id: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self.backend.transaction() as connection:
+            row = connection.execute("SELECT owner, expires_at FROM leases WHERE session_id = ?", (session_id,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO leases (session_id, owner, expires_at) VALUES (?, ?, ?)",
+                (session_id, owner, now + ttl_seconds),
+            )
+            return True
+
+    def release(self, session_id: str, owner: str) -> None:
+        self.backend.execute("DELETE FROM leases WHERE session_id = ? AND owner = ?", (session_id, owner))
+
+    def owner(self, session_id: str) -> Optional[str]:
+        row = self.backend.query_one("SELECT owner FROM leases WHERE session_id = ? AND expires_at > ?", (session_id, time.time()))
+        return row[0] if row else None
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Stores every collection in a SQLite database (WAL mode), one table per collection.
+    Only the documents that are asked for are loaded, and sessions can be queried through indexes on
+    `user_id`, `course_id` and `status`. Collections are write-through, so `persist` has nothing left to do.
+
+    Several worker processes can share the database: writes take the write lock up front (BEGIN IMMEDIATE)
+    and wait up to `busy_timeout` seconds for it, sessions are owned through leases, and every write bumps
+    a per-collection version so other workers can drop cached models.
+    """
+    write_through = True
+
+    def __init__(self, path: str, busy_timeout: float = 30.0):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        self.collections = {name: SqliteCollection(self, name) for name in COLLECTION_FILES}
+        self.events = SqliteEventStore(self)
+        self.leases = SqliteSessionLeases(self)
+
+    def _create_schema(self):
+        with self._lock:
+            for name in COLLECTION_FILES:
+                columns = "".join(f", {field} TEXT" for field in INDEXED_FIELDS.get(name, []))
+                self._connection.execute(f"CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, doc TEXT NOT NULL{columns})")
+                for field in INDEXED_FIELDS.get(name, []):
+                    self._connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{field} ON {name} ({field})")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, type TEXT NOT NULL, timestamp TEXT, data TEXT)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_events_session_id ON events (session_id)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS leases (session_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS collection_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, tuple(params))
+
+    def query_one(self, sql: str, params: Iterable[Any] = ()):
+        with self._lock:
+            return self._connection.execute(sql, tuple(params)).fetchone()
+
+    def query_all(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, tuple(params)).fetchall()
+
+    def put_many(self, name: str, documents: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Upsert documents into a collection table in a single transaction."""
+        fields = INDEXED_FIELDS.get(name, [])
+        columns = ", ".join(["key", "doc"] + fields)
+        placeholders = ", ".join("?" for _ in range(len(fields) + 2))
+        rows = [
+            (key, json.dumps(document, default=json_default), *[_column_value(document.get(field)) for field in fields])
+            for key, document in documents
+        ]
+        with self.transaction() as connection:
+            connection.executemany(f"INSERT OR REPLACE INTO {name} ({columns}) VALUES ({placeholders})", rows)
+            _bump_version(connection, name)
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction. Takes the database write lock up front so concurrent workers queue instead of deadlocking."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def collection(self, name: str):
+        if name == "characters":
+            # Characters are a small, read-only list of seed documents
+            return self.collections[name].values()
+        return self.collections[name]
+
+    def event_store(self) -> EventStore:
+        return self.events
+
+    def session_leases(self) -> SessionLeases:
+        return self.leases
+
+    def collection_version(self, name: str) -> Optional[int]:
+        row = self.query_one("SELECT version FROM collection_versions WHERE name = ?", (name,))
+        return row[0] if row else 0
+
+    def persist(self, name: str, key: str) -> None:
+        # Writes already went to the database when the document was assigned into the collection
+        pass
+
+    def find(self, name: str, field: str, values: List[Any]) -> List[Dict[str, Any]]:
+        values = [_column_value(value) for value in values]
+        if not values:
+            return []
+        placeholders = ", ".join("?" for _ in values)
+        if field == KEY_FIELDS[name]:
+            column = "key"
+        elif field in INDEXED_FIELDS.get(name, []):
+            column = field
+        else:
+            return [document for document in self.collections[name].values() if document.get(field) in values]
+        rows = self.query_all(f"SELECT doc FROM {name} WHERE {column} IN ({placeholders}) ORDER BY rowid", values)
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,375 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, MutableMapping, Optional, Tuple, Union
+
+from app.dao import binary_snapshot
+from app.dao.bounded import BoundedCollection
+from app.dao.event_store import EventStore, FileEventStore
+from app.dao.indexes import HashIndex, IndexedDict
+from app.dao.journal import Journal, write_snapshot
+from app.dao.leases import LocalSessionLeases, SessionLeases
+from app.dao.sharded import ShardedStore
+from app.dao.writer import BackgroundWriter
+
+logger = logging.getLogger(__name__)
+
+
+def load_json_data(file_path: str) -> Dict[str, Any]:
+    """Load data from a JSON file."""
+    try:
+        with open(file_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        return {}
+
+def save_json_data(file_path: str, data: Dict[str, Any]) -> None:
+    """Save data to a JSON file. The file is replaced atomically, so a crash never leaves it half-written."""
+    write_snapshot(file_path, data)
+
+
+# Collection attribute on Db -> file name in the data directory
+COLLECTION_FILES = {
+    "users": "users.json",
+    "courses": "courses.json",
+    "sessions": "sessions.json",
+    "games": "games.json",
+    "reports": "dashboards.json",
+    "characters": "characters.json",
+    "histories": "histories.json",
+}
+# Collections that are written at runtime (games and characters are read-only seed data)
+WRITABLE_COLLECTIONS = ["users", "courses", "sessions", "reports", "histories"]
+# Append-only session event log of the json backend, see FileEventStore
+EVENTS_FILE = "events.jsonl"
+# Collections stored one file per entity in the "sharded" persistence mode
+SHARDED_COLLECTIONS = ["users", "sessions", "histories"]
+# In-memory hash indexes kept by the json backend
+INDEXED_FIELDS = {
+    "sessions": ["user_id", "course_id"],
+}
+
+
+class StorageBackend:
+    """
+    Storage behind the Db method surface.
+
+    `collection()` returns a dict-like view of a collection (routes read `db.sessions`, `db.courses` directly,
+    so it has to behave like the dicts they always got). `characters` is a list of character documents.
+    Writes are done by assigning into the collection and then calling `persist()` for the changed key
+    (deletes likewise, by deleting the key first).
+    Backends whose collections write through to storage on assignment set `write_through`.
+    """
+    write_through = False
+
+    def collection(self, name: str) -> Union[MutableMapping[str, Any], List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def event_store(self) -> EventStore:
+        raise NotImplementedError
+
+    def session_leases(self) -> SessionLeases:
+        raise NotImplementedError
+
+    def collection_version(self, name: str) -> Optional[int]:
+        """
+        Counter that changes whenever `name` is written by any process sharing the storage, or None if the
+        storage is private to this process. Used to invalidate caches of other workers' writes.
+        """
+        return None
+
+    def persist(self, name: str, key: str) -> None:
+        raise NotImplementedError
+
+    def persist_many(self, name: str, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.persist(name, key)
+
+    def put_many(self, name: str, documents: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Write many documents of a collection, persisted together (one file rewrite, one transaction, ...)."""
+        collection = self.collection(name)
+        keys = []
+        for key, document in documents:
+            collection[key] = document
+            keys.append(key)
+        self.persist_many(name, keys)
+
+    def find(self, name: str, field: str, values: List[Any]) -> List[Dict[str, Any]]:
+        """Documents of `name` whose `field` is one of `values`."""
+        raise NotImplementedError
+
+    async def flush(self) -> None:
+        """Wait until every write persisted so far is durable."""
+        pass
+
+    def check_consistency(self) -> List[str]:
+        """Verify internal structures (e.g. indexes) against the stored documents. Returns the problems found."""
+        return []
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class JsonBackend(StorageBackend):
+    """
+    All collections are held in memory as dicts, loaded from the JSON files in `data_dir` the first time
+    they are accessed.
+
+    persistence_mode:
+        "file": every write rewrites the whole collection file.
+        "journal": writes append the changed entity to a journal, which is compacted into the collection files in the background.
+        "sharded": users and sessions are stored one file per entity (see ShardedStore), other collections as in "file".
+
+    With `background_writer`, persistence runs on a writer thread (see BackgroundWriter) instead of inside the caller.
+    With `binary_snapshot`, collection files are loaded from a binary snapshot next to them when it is up to date
+    (see app.dao.binary_snapshot), and the snapshot is rebuilt when it is not.
+    With `session_cache_bytes` (sharded mode only), at most that many bytes of sessions are kept in memory and
+    inactive sessions are evicted to their entity files (see BoundedCollection).
+    With `migrate_events` disabled, `event_logs` embedded in old session documents are left in place instead
+    of being moved into the event store (app.dao.migrate reads the data directory without changing it).
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        persistence_mode: str = "file",
+        background_writer: bool = False,
+        binary_snapshot: bool = False,
+        session_cache_bytes: int = 0,
+        migrate_events: bool = True,
+    ):
+        self.data_dir = data_dir
+        self.migrate_events = migrate_events
+        self.persistence_mode = persistence_mode
+        self.binary_snapshot = binary_snapshot
+        self.shards = {}
+        if persistence_mode == "sharded":
+            self.shards = {name: ShardedStore(os.path.join(data_dir, name)) for name in SHARDED_COLLECTIONS}
+        elif session_cache_bytes:
+            # Evicted sessions have to be readable one at a time, which needs one file per session
+            logger.warning("The session cache budget only applies to the sharded persistence mode, ignoring it")
+            session_cache_bytes = 0
+        self.session_cache_bytes = session_cache_bytes
+        # Loaded collections, filled in by `collection()`. The writer and snapshot threads load through it too.
+        self.collections = {}
+        self._load_lock = threading.RLock()
+        self.load_seconds: Dict[str, float] = {}
+        # Serializes rewrites of a collection file ("file" mode): the event loop, the writer thread and the
+        # snapshotter thread all write through `write`
+        self._file_locks = {name: threading.Lock() for name in COLLECTION_FILES}
+        self.binary_snapshot_hits = 0
+        # Characters are a read-only list, so their index is built once over list positions when they are loaded
+        self.character_index = HashIndex("name")
+        self.journal = None
+        if persistence_mode == "journal":
+            self.journal = Journal(
+                data_dir,
+                {name: self._path(name) for name in WRITABLE_COLLECTIONS},
+                compact_threshold_bytes=int(os.environ.get("DB_JOURNAL_COMPACT_BYTES", 4 * 1024 * 1024)),
+                compact_interval_seconds=float(os.environ.get("DB_JOURNAL_COMPACT_INTERVAL", 300)),
+            )
+            self.journal.start_compactor(self._writable_collections)
+        elif persistence_mode not in ("file", "sharded"):
+            raise ValueError(f"Unknown persistence mode: {persistence_mode}")
+        self.events = FileEventStore(os.path.join(data_dir, EVENTS_FILE))
+        self.leases = LocalSessionLeases()
+        self.writer = None
+        if background_writer:
+            self.writer = BackgroundWriter(
+                self.write,
+                coalesce_window=float(os.environ.get("DB_WRITER_COALESCE_MS", 50)) / 1000,
+                max_queue_size=int(os.environ.get("DB_WRITER_QUEUE_SIZE", 1024)),
+            )
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.data_dir, COLLECTION_FILES[name])
+
+    def _read_file(self, name: str):
+        if not self.binary_snapshot:
+            return load_json_data(self._path(name))
+        data, hit = binary_snapshot.load(self._path(name), load_json_data)
+        self.binary_snapshot_hits += hit
+        return data
+
+    def _import_shards(self, name: str) -> Dict[str, Any]:
+        # First start in sharded mode: split the existing collection file into shards
+        shards = self.shards[name]
+        data = load_json_data(self._path(name))
+        shards.import_all(data)
+        logger.info(f"Imported {len(data)} {name} from {self._path(name)} into {shards.root}")
+        return data
+
+    def _load(self, name: str):
+        shards = self.shards.get(name)
+        if shards is None:
+            return self._read_file(name)
+        if not shards.exists():
+            return self._import_shards(name)
+        return shards.load_all()
+
+    def _load_bounded_sessions(self) -> BoundedCollection:
+        shards = self.shards["sessions"]
+        if not shards.exists():
+            self._import_shards("sessions")
+        sessions = BoundedCollection(
+            shards,
+            INDEXED_FIELDS.get("sessions", []),
+            self.session_cache_bytes,
+            # Sessions driven by a live connection stay resident
+            is_pinned=lambda session_id: self.leases.owner(session_id) is not None,
+        )
+
+        def documents():
+            # Streamed, so that only the sessions within the budget are ever held in memory
+            for session_id, session_json in shards.iter_all():
+                if self.migrate_events and session_json.get("event_logs"):
+                    session_json = self._move_embedded_events(session_id, session_json)
+                    shards.write(session_id, session_json)
+                yield session_id, session_json
+
+        sessions.load(documents())
+        return sessions
+
+    def _load_collection(self, name: str):
+        started = time.monotonic()
+        if name == "sessions" and self.session_cache_bytes:
+            data = self.collections[name] = self._load_bounded_sessions()
+            self.load_seconds[name] = round(time.monotonic() - started, 6)
+            return data
+        data = self._load(name)
+        if self.journal and name in WRITABLE_COLLECTIONS:
+            self.journal.replay({name: data})
+        if isinstance(data, dict):
+            data = IndexedDict(data, INDEXED_FIELDS.get(name, []))
+        if name == "characters":
+            self.character_index.rebuild(enumerate(data))
+        self.collections[name] = data
+        if name == "sessions" and self.migrate_events:
+            self._migrate_embedded_events(data)
+        self.load_seconds[name] = round(time.monotonic() - started, 6)
+        return data
+
+    def _move_embedded_events(self, session_id: str, session_json: Dict[str, Any]) -> Dict[str, Any]:
+        for event in session_json["event_logs"]:
+            self.events.append(session_id, event.get("type"), event.get("data"), event.get("timestamp"))
+        return {key: value for key, value in session_json.items() if key != "event_logs"}
+
+    def _migrate_embedded_events(self, sessions: Dict[str, Any]):
+        """Move `event_logs` of session documents written before the event store existed into the event store."""
+        migrated = []
+        for session_id, session_json in list(sessions.items()):
+            if not session_json.get("event_logs"):
+                continue
+            sessions[session_id] = self._move_embedded_events(session_id, session_json)
+            migrated.append(session_id)
+        if migrated:
+            self.persist_many("sessions", migrated)
+
+    def _writable_collections(self) -> Dict[str, Dict[str, Any]]:
+        # Compaction rewrites every snapshot file, so collections that were not used yet are loaded first
+        return {name: self.collection(name) for name in WRITABLE_COLLECTIONS}
+
+    def collection(self, name: str):
+        collection = self.collections.get(name)
+        if collection is None:
+            with self._load_lock:
+                collection = self.collections.get(name)
+                if collection is None:
+                    collection = self._load_collection(name)
+        return collection
+
+    def event_store(self) -> EventStore:
+        return self.events
+
+    def session_leases(self) -> SessionLeases:
+        return self.leases
+
+    def persist(self, name: str, key: str) -> None:
+        if self.writer:
+            self.writer.submit(name, key)
+        else:
+            self.write(name, [key])
+
+    def persist_many(self, name: str, keys: Iterable[str]) -> None:
+        if self.writer:
+            for key in keys:
+                self.writer.submit(name, key)
+        else:
+            # One write for all of them (a single file rewrite in "file" mode)
+            self.write(name, keys)
+
+    def write(self, name: str, keys: Iterable[str]) -> None:
+        """Write the current state of `keys` in collection `name`. May run on the writer thread."""
+        collection = self.collection(name)
+        if isinstance(collection, BoundedCollection):
+            for key in keys:
+                collection.write_out(key)
+        elif name in self.shards:
+            for key in keys:
+                value = collection.get(key)
+                if value is not None:
+                    self.shards[name].write(key, value)
+                else:
+                    self.shards[name].delete(key)
+        elif self.journal:
+            for key in keys:
+                # A missing key was deleted, which is journaled as a null value
+                self.journal.append(name, key, collection.get(key))
+        else:
+            # Entities are replaced on write, never mutated in place, so a shallow copy (atomic under the GIL)
+            # is a consistent snapshot that json.dump can walk while the event loop keeps mutating the collection.
+            # It is taken under the lock, so the last rewrite of the file always holds the newest copy.
+            with self._file_locks[name]:
+                save_json_data(self._path(name), dict(collection))
+
+    async def flush(self) -> None:
+        if self.writer:
+            await self.writer.flush()
+
+    def find(self, name: str, field: str, values: List[Any]) -> List[Dict[str, Any]]:
+        collection = self.collection(name)
+        if name == "characters" and field == "name":
+            # Keep the order of the characters file, like a scan would
+            return [collection[position] for position in sorted(self.character_index.lookup(values))]
+        if isinstance(collection, (IndexedDict, BoundedCollection)) and field in collection.indexes:
+            return collection.lookup(field, values)
+        documents = collection.values() if isinstance(collection, Mapping) else collection
+        return [document for document in documents if document.get(field) in values]
+
+    def check_consistency(self) -> List[str]:
+        problems = []
+        for name, collection in list(self.collections.items()):
+            if isinstance(collection, (IndexedDict, BoundedCollection)):
+                problems += [f"{name}: {problem}" for problem in collection.check_indexes()]
+        if "characters" in self.collections:
+            problems += [f"characters: {problem}" for problem in self.character_index.check(enumerate(self.collections["characters"]))]
+        return problems
+
+    def close(self) -> None:
+        if self.writer:
+            self.writer.close()
+        if self.journal:
+            self.journal.close()
+        self.events.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"events": self.events.stats(), "load_seconds": dict(self.load_seconds)}
+        if self.binary_snapshot:
+            stats["binary_snapshot_hits"] = self.binary_snapshot_hits
+        if self.journal:
+            stats["journal"] = self.journal.stats()
+        if self.writer:
+            stats["writer"] = self.writer.stats()
+        for name, shards in self.shards.items():
+            stats[f"{name}_shards"] = shards.stats()
+        sessions = self.collections.get("sessions")
+        if isinstance(sessions, BoundedCollection):
+            stats["session_cache"] = sessions.stats()
+        return stats
@@ -0,0 +1,217 @@
+import base64
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+# Skill snapshots younger than this many days are kept as they were recorded
+RAW_DAYS = int(os.environ.get("DB_HISTORY_RAW_DAYS", 30))
+# Older snapshots are merged into one point per day until this age, and into one point per week after it
+DAILY_DAYS = int(os.environ.get("DB_HISTORY_DAILY_DAYS", 180))
+
+EPOCH_DAY = date(1970, 1, 1)
+
+
+def _day_number(day: date) -> int:
+    return (day - EPOCH_DAY).days
+
+
+def _bucket(timestamp: datetime, now: datetime) -> Optional[str]:
+    """Bucket a point of this age is merged into, or None while it is kept as recorded."""
+    age = (now - timestamp.replace(tzinfo=None)).days
+    if age < RAW_DAYS:
+        return None
+    if age < DAILY_DAYS:
+        return timestamp.date().isoformat()
+    week_start = timestamp.date() - timedelta(days=timestamp.weekday())
+    return f"week:{week_start.isoformat()}"
+
+
+def _merge(points: List[Dict[str, Any]]) -> Dict[str, Any]:
+    values: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    for point in points:
+        for field, value in point["v"].items():
+            count = point.get("n", {}).get(field, 1)
+            values[field] = values.get(field, 0.0) + value * count
+            counts[field] = counts.get(field, 0) + count
+    return {
+        # The merged point sits at its first snapshot, so points stay in time order
+        "t": points[0]["t"],
+        "v": {field: values[field] / counts[field] for field in values},
+        "n": counts,
+    }
+
+
+class UserHistory:
+    """
+    Time series of one user: the skill stats of every dashboard build and the days the user was active.
+
+    Stored as one document in the `histories` collection:
+        {
+            "user_id": ...,
+            "points": [{"t": iso timestamp, "v": {skill: score}, "n": {skill: snapshots merged}}, ...],
+            "sums": {skill: sum of every snapshot ever}, "counts": {skill: number of snapshots},
+            "first_day": day number of bit 0 of the activity bitmap,
+            "activity": base64 bitmap, bit i set when the user was active on first_day + i,
+            "sessions": {session id: the snapshot recorded for it, {"t": ..., "v": ...}},
+        }
+    Points are appended; old ones are downsampled (see RAW_DAYS, DAILY_DAYS), so the document stays small
+    however long the user has been learning. The aggregate is kept as running sums, and the streak is read
+    from the bitmap, so neither needs the sessions or their events.
+    A session has one snapshot: when its stats are rebuilt, the new snapshot replaces the previous one.
+    """
+
+    def __init__(self, user_id: str, document: Optional[Dict[str, Any]] = None):
+        document = document or {}
+        self.user_id = user_id
+        self.points: List[Dict[str, Any]] = list(document.get("points", []))
+        self.sums: Dict[str, float] = dict(document.get("sums", {}))
+        self.counts: Dict[str, int] = dict(document.get("counts", {}))
+        self.first_day: Optional[int] = document.get("first_day")
+        self.activity = bytearray(base64.b64decode(document.get("activity", "")))
+        self.sessions: Dict[str, Dict[str, Any]] = dict(document.get("sessions", {}))
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "points": self.points,
+            "sums": self.sums,
+            "counts": self.counts,
+            "first_day": self.first_day,
+            "activity": base64.b64encode(bytes(self.activity)).decode("ascii"),
+            "sessions": self.sessions,
+        }
+
+    def append(
+        self,
+        timestamp: datetime,
+        values: Dict[str, Optional[float]],
+        now: Optional[datetime] = None,
+        session_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Record a skill stats snapshot (scores that are None are left out) and downsample the old points.
+        A snapshot of `session_id` replaces the one recorded for that session before.
+        Returns whether it was recorded: False if it is empty.
+        """
+        values = {field: float(value) for field, value in values.items() if value is not None}
+        if not values:
+            return False
+        if session_id is not None:
+            previous = self.sessions.get(session_id)
+            if previous is not None:
+                self._remove(previous)
+            self.sessions[session_id] = {"t": timestamp.isoformat(), "v": values}
+        for field, value in values.items():
+            self.sums[field] = self.sums.get(field, 0.0) + value
+            self.counts[field] = self.counts.get(field, 0) + 1
+        self.points.append({"t": timestamp.isoformat(), "v": values})
+        self.downsample(now or datetime.now())
+        return True
+
+    def _remove(self, snapshot: Dict[str, Any]):
+        """Take a recorded snapshot out of the running sums and out of its point, merged or not."""
+        for field, value in snapshot["v"].items():
+            self.sums[field] = self.sums.get(field, 0.0) - value
+            self.counts[field] = self.counts.get(field, 0) - 1
+            if self.counts[field] <= 0:
+                del self.sums[field], self.counts[field]
+        # Its point is the last one at or before it: a merged point sits at its first snapshot
+        index = None
+        for i, point in enumerate(self.points):
+            if point["t"] > snapshot["t"]:
+                break
+            index = i
+        if index is None:
+            return
+        point = self.points[index]
+        if "n" not in point:
+            if point["t"] == snapshot["t"]:
+                del self.points[index]
+            return
+        values, counts = dict(point["v"]), dict(point["n"])
+        for field, value in snapshot["v"].items():
+            count = counts.get(field, 0)
+            if count <= 1:
+                values.pop(field, None)
+                counts.pop(field, None)
+            else:
+                values[field] = (values[field] * count - value) / (count - 1)
+                counts[field] = count - 1
+        if values:
+            self.points[index] = {"t": point["t"], "v": values, "n": counts}
+        else:
+            del self.points[index]
+
+    def downsample(self, now: datetime):
+        merged: List[Dict[str, Any]] = []
+        group: List[Dict[str, Any]] = []
+        group_bucket = None
+        for point in self.points:
+            bucket = _bucket(datetime.fromisoformat(point["t"]), now)
+            if bucket is None or bucket != group_bucket:
+                if group:
+                    merged.append(_merge(group) if len(group) > 1 else group[0])
+                group, group_bucket = [], bucket
+            if bucket is None:
+                merged.append(point)
+            else:
+                group.append(point)
+        if group:
+            merged.append(_merge(group) if len(group) > 1 else group[0])
+        self.points = merged
+
+    def aggregate(self) -> Dict[str, float]:
+        """Average of every snapshot ever recorded, per skill."""
+        return {field: self.sums[field] / self.counts[field] for field in self.sums if self.counts.get(field)}
+
+    def history(self) -> List[Dict[str, float]]:
+        return [point["v"] for point in self.points]
+
+    def mark_active(self, day: date) -> bool:
+        """Set the activity bit of `day`. Returns whether it changed (i.e. whether the document needs a write)."""
+        number = _day_number(day)
+        if self.first_day is None:
+            self.first_day = number
+        if number < self.first_day:
+            # Backfilled day before the start of the bitmap: shift it by whole bytes
+            shift = (self.first_day - number + 7) // 8
+            self.activity[0:0] = bytes(shift)
+            self.first_day -= shift * 8
+        offset = number - self.first_day
+        index, bit = divmod(offset, 8)
+        if index >= len(self.activity):
+            self.activity.extend(bytes(index - len(self.activity) + 1))
+        if self.activity[index] & (1 << bit):
+            return False
+        self.activity[index] |= 1 << bit
+        return True
+
+    def is_active(self, day: date) -> bool:
+        if self.first_day is None:
+            return False
+        offset = _day_number(day) - self.first_day
+        if offset < 0 or offset >= len(self.activity) * 8:
+            return False
+        index, bit = divmod(offset, 8)
+        return bool(self.activity[index] & (1 << bit))
+
+    def active_days(self) -> Iterable[date]:
+        for index, byte in enumerate(self.activity):
+            for bit in range(8):
+                if byte & (1 << bit):
+                    yield EPOCH_DAY + timedelta(days=self.first_day + index * 8 + bit)
+
+    def streak(self, today: Optional[date] = None) -> int:
+        """
+        Consecutive active days up to today. A streak that ended yesterday still counts, since the user may
+        not have learned yet today.
+        """
+        day = today or date.today()
+        if not self.is_active(day):
+            day -= timedelta(days=1)
+        streak = 0
+        while self.is_active(day):
+            streak += 1
+            day -= timedelta(days=1)
+        return streak
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Barrier:
+    def __init__(self):
+        self.future = Future()
+
+
+class BackgroundWriter:
+    """
+    Moves persistence I/O off the event loop onto a dedicated writer thread.
+
+    `submit(collection, key)` only enqueues the fact that an entity changed. The writer thread collects
+    everything submitted within `coalesce_window` seconds and calls `write(collection, keys)` once per
+    collection, so N updates to the same collection in a window become a single flush. `write` reads the
+    current state of the collection itself (see JsonBackend.write), so the latest value always wins.
+
+    `submit` never blocks (it is called from coroutines). An entity that is already waiting to be written is not
+    queued again, and when the bounded queue is full the entity is parked in an overflow set that the writer
+    thread drains with its next batch. Both only hold distinct entities, so they stay bounded by the data set.
+    """
+
+    def __init__(self, write: Callable[[str, Set[str]], None], coalesce_window: float = 0.05, max_queue_size: int = 1024):
+        self.write = write
+        self.coalesce_window = coalesce_window
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stopped = False
+        # Entities queued or parked in the overflow set, not picked up by the writer thread yet
+        self._pending: Set[Tuple[str, str]] = set()
+        self._overflow: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.flushes = 0
+        self.errors = 0
+        self.pending_hits = 0
+        self.overflowed_submits = 0
+        self.max_queue_depth = 0
+        self.last_flush_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, collection: str, key: str) -> None:
+        item = (collection, key)
+        with self._lock:
+            self.submitted += 1
+            if item in self._pending:
+                # The writer reads the current value when it gets to it, so one pending write is enough
+                self.pending_hits += 1
+                return
+            self._pending.add(item)
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._overflow.add(item)
+                self.overflowed_submits += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    def _take(self, item: Tuple[str, str]) -> None:
+        with self._lock:
+            self._pending.discard(item)
+
+    def _take_overflow(self) -> Set[Tuple[str, str]]:
+        with self._lock:
+            overflow, self._overflow = self._overflow, set()
+            self._pending.difference_update(overflow)
+        return overflow
+
+    def _barrier(self) -> Future:
+        barrier = _Barrier()
+        self._queue.put(barrier)
+        return barrier.future
+
+    async def flush(self) -> None:
+        """Wait until everything submitted so far is written. Does not block the event loop."""
+        barrier = _Barrier()
+        try:
+            self._queue.put_nowait(barrier)
+        except queue.Full:
+            # Wait for room on a worker thread rather than on the event loop
+            await asyncio.to_thread(self._queue.put, barrier)
+        await asyncio.wrap_future(barrier.future)
+
+    def flush_sync(self, timeout: float = None) -> None:
+        self._barrier().result(timeout)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            pending: Dict[str, Set[str]] = {}
+            barriers = []
+            deadline = time.monotonic() + self.coalesce_window
+            while True:
+                if isinstance(item, _Barrier):
+                    # Durability point: flush right away instead of waiting for the window to close
+                    barriers.append(item)
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                self._take(item)
+                collection, key = item
+                pending.setdefault(collection, set()).add(key)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            # Entities parked while the queue was full, submitted before anything still in the queue
+            for collection, key in self._take_overflow():
+                pending.setdefault(collection, set()).add(key)
+            error = None
+            for collection, keys in pending.items():
+                started = time.monotonic()
+                try:
+                    self.write(collection, keys)
+                except Exception as e:
+                    error = e
+                    self.errors += 1
+                    logger.error(f"Background write of {collection} failed: {str(e)}")
+                self.flushes += 1
+                self.last_flush_seconds = time.monotonic() - started
+            for barrier in barriers:
+                if error:
+                    barrier.future.set_exception(error)
+                else:
+                    barrier.future.set_result(None)
+
+    def close(self, timeout: float = 30.0) -> None:
+        if self._stopped:
+            return
+        self._stopped = True
+        self.flush_sync(timeout)
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_capacity": self._queue.maxsize,
+            "submitted": self.submitted,
+            "flushes": self.flushes,
+            "coalesced": max(self.submitted - self.flushes, 0),
+            "errors": self.errors,
+            "pending_hits": self.pending_hits,
+            "overflow_size": len(self._overflow),
+            "overflowed_submits": self.overflowed_submits,
+            "last_flush_seconds": round(self.last_flush_seconds, 6),
+        }
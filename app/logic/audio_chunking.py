@@ -0,0 +1,120 @@
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from app.utils.metrics import metrics
+
+# "adaptive", or "fixed" for chunks of AUDIO_CHUNK_SIZE bytes throughout
+POLICY = os.environ.get("AUDIO_CHUNK_POLICY", "adaptive")
+# Audio bytes per chunk of the fixed policy
+FIXED_CHUNK_SIZE = int(os.environ.get("AUDIO_CHUNK_SIZE", 16384))
+# First chunk of an utterance: about 125ms of 128kbps mp3, so playback starts as soon as possible
+FIRST_CHUNK_SIZE = int(os.environ.get("AUDIO_FIRST_CHUNK_SIZE", 2048))
+# Bounds of the later chunks
+MIN_CHUNK_SIZE = int(os.environ.get("AUDIO_MIN_CHUNK_SIZE", 4096))
+MAX_CHUNK_SIZE = int(os.environ.get("AUDIO_MAX_CHUNK_SIZE", 65536))
+# Later chunks are sized to take about this long to send at the client's measured throughput
+CHUNK_TARGET_MS = float(os.environ.get("AUDIO_CHUNK_TARGET_MS", 250))
+# Each chunk is at most this many times the previous one, so sizes ramp up from the first chunk
+CHUNK_GROWTH = float(os.environ.get("AUDIO_CHUNK_GROWTH", 2))
+
+# Weight of the newest sample in the throughput average
+THROUGHPUT_ALPHA = 0.3
+
+
+class Throughput:
+    """Moving average of how fast a connection takes audio, in bytes per second of send time."""
+
+    def __init__(self):
+        self.bytes_per_second: Optional[float] = None
+
+    def record(self, size: int, seconds: float) -> None:
+        if size <= 0:
+            return
+        sample = size / max(seconds, 1e-6)
+        if self.bytes_per_second is None:
+            self.bytes_per_second = sample
+        else:
+            self.bytes_per_second += THROUGHPUT_ALPHA * (sample - self.bytes_per_second)
+
+
+class ChunkingStats:
+    """Counters of the audio chunks sent, served under `audio_chunks` on GET /api/metrics."""
+
+    def __init__(self):
+        self.utterances = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.first_chunk_bytes = 0
+        self.first_audio_utterances = 0
+        self.first_audio_seconds = 0.0
+        metrics.register("audio_chunks", self.stats)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": POLICY,
+            "utterances": self.utterances,
+            "chunks": self.chunks,
+            "avg_chunk_bytes": round(self.bytes / self.chunks) if self.chunks else None,
+            "avg_first_chunk_bytes": round(self.first_chunk_bytes / self.first_audio_utterances) if self.first_audio_utterances else None,
+            "avg_time_to_first_audio_ms": round(self.first_audio_seconds / self.first_audio_utterances * 1000, 2) if self.first_audio_utterances else None,
+        }
+
+
+chunking_stats = ChunkingStats()
+
+
+class AudioChunker:
+    """
+    Decides when the audio buffered for one utterance is sent as a chunk.
+
+    Adaptive policy: the first chunk is small (FIRST_CHUNK_SIZE) so the student hears something quickly.
+    Later chunks are as large as the connection sends in about CHUNK_TARGET_MS, at most CHUNK_GROWTH times
+    the previous one and within MIN_CHUNK_SIZE..MAX_CHUNK_SIZE. While more synthesized audio waits to be
+    read or to be sent to the client (the sender or the client is behind), it is merged into a later chunk rather than sent as more, smaller messages.
+
+    The chunk sizes and the time to first audio of the utterance are kept for its execute_command event.
+    """
+
+    def __init__(self, throughput: Throughput):
+        self.throughput = throughput
+        self.sizes: List[int] = []
+        self.started = time.perf_counter()
+        self.first_audio_seconds: Optional[float] = None
+
+    def target(self) -> int:
+        if POLICY == "fixed":
+            return FIXED_CHUNK_SIZE
+        if not self.sizes:
+            return FIRST_CHUNK_SIZE
+        size = self.sizes[-1] * CHUNK_GROWTH
+        if self.throughput.bytes_per_second is not None:
+            size = min(size, self.throughput.bytes_per_second * CHUNK_TARGET_MS / 1000)
+        return int(min(max(size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE))
+
+    def ready(self, buffered: int, backlog: int = 0) -> bool:
+        """Whether `buffered` bytes make a chunk, with `backlog` more bytes already synthesized and waiting."""
+        if buffered < self.target():
+            return False
+        # The first chunk is never held back, so a slow client starts playing it as soon as possible
+        return POLICY == "fixed" or not self.sizes or not backlog or buffered + backlog > MAX_CHUNK_SIZE
+
+    def sent(self, size: int) -> None:
+        """Record a chunk of `size` bytes handed to the connection (whose sender measures the throughput)."""
+        if self.first_audio_seconds is None:
+            self.first_audio_seconds = time.perf_counter() - self.started
+        self.sizes.append(size)
+
+    def finish(self) -> Dict[str, Any]:
+        """Record the utterance in the metrics. Returns its chunking, for the execute_command event."""
+        chunking_stats.utterances += 1
+        chunking_stats.chunks += len(self.sizes)
+        chunking_stats.bytes += sum(self.sizes)
+        if self.first_audio_seconds is not None:
+            chunking_stats.first_audio_utterances += 1
+            chunking_stats.first_audio_seconds += self.first_audio_seconds
+            chunking_stats.first_chunk_bytes += self.sizes[0]
+        return {
+            "chunk_sizes": self.sizes,
+            "time_to_first_audio_ms": round(self.first_audio_seconds * 1000, 2) if self.first_audio_seconds is not None else None,
+        }
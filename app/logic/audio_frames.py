@@ -0,0 +1,43 @@
+import struct
+from typing import Tuple
+
+# Header of a protocol v2 binary audio frame, followed by the audio bytes:
+#   command sequence id (uint32), chunk index (uint32), flags (uint8), little endian
+HEADER = struct.Struct("<IIB")
+FLAG_END = 0x01
+
+
+class AudioFrames:
+    """
+    Builds the binary audio frames of one utterance (protocol v2).
+
+    Audio is appended to a bytearray that already has room for the header in front, so a frame is the
+    buffer itself once the header is packed into it: no base64, no JSON, and no concatenation of
+    immutable bytes. Each frame hands its buffer off and starts a new one.
+    """
+
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.index = 0
+        self._buffer = bytearray(HEADER.size)
+
+    def add(self, chunk: bytes) -> None:
+        self._buffer += chunk
+
+    def __len__(self) -> int:
+        """Audio bytes waiting for the next frame."""
+        return len(self._buffer) - HEADER.size
+
+    def frame(self, end: bool = False) -> bytearray:
+        """The next frame, with the audio added since the previous one. The last frame has the end flag."""
+        frame = self._buffer
+        HEADER.pack_into(frame, 0, self.seq, self.index, FLAG_END if end else 0)
+        self.index += 1
+        self._buffer = bytearray(HEADER.size)
+        return frame
+
+
+def parse_frame(frame: bytes) -> Tuple[int, int, bool, memoryview]:
+    """(command sequence id, chunk index, end, audio) of a binary audio frame."""
+    seq, index, flags = HEADER.unpack_from(frame)
+    return seq, index, bool(flags & FLAG_END), memoryview(frame)[HEADER.size:]
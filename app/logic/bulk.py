@@ -0,0 +1,82 @@
+"""
+Validation of record batches for the bulk import endpoints.
+
+Pydantic validation holds the GIL, so large batches are validated in a pool of worker processes
+(spawned, not forked, since the server process runs threads). Small batches are validated inline, where
+the pool would cost more than it saves.
+"""
+import asyncio
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+from app.models.bulk import BulkRecordResult, BulkResult
+
+# Batches with at least this many records are validated in the process pool
+BULK_PARALLEL_THRESHOLD = int(os.environ.get("BULK_PARALLEL_THRESHOLD", 1000))
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", min(4, os.cpu_count() or 1)))
+BULK_MAX_RECORDS = int(os.environ.get("BULK_MAX_RECORDS", 10000))
+
+# (validated model dump, None) or (None, error message), per record
+Validated = Tuple[Optional[Dict[str, Any]], Optional[str]]
+
+_executor = None
+
+
+def _error_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in detail['loc']) or 'record'}: {detail['msg']}" for detail in error.errors())
+
+
+def validate_chunk(model: Type[BaseModel], records: List[Any]) -> List[Validated]:
+    results = []
+    for record in records:
+        try:
+            results.append((model.model_validate(record).model_dump(), None))
+        except ValidationError as e:
+            results.append((None, _error_message(e)))
+    return results
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(BULK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def validate_records(model: Type[BaseModel], records: List[Any]) -> List[Validated]:
+    """Validate `records` against `model`. Results are in the order of the records."""
+    if len(records) > BULK_MAX_RECORDS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_RECORDS} records per request")
+    if len(records) < BULK_PARALLEL_THRESHOLD or BULK_WORKERS <= 1:
+        return validate_chunk(model, records)
+    # A few chunks per worker, so that a slow chunk does not leave the other workers idle
+    chunk_size = math.ceil(len(records) / (BULK_WORKERS * 4))
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*[
+        loop.run_in_executor(_get_executor(), validate_chunk, model, records[start:start + chunk_size])
+        for start in range(0, len(records), chunk_size)
+    ])
+    return [result for chunk in chunks for result in chunk]
+
+
+def record_id(record: Any, field: str = "id") -> Optional[str]:
+    value = record.get(field) if isinstance(record, dict) else None
+    return str(value) if value is not None else None
+
+
+def summarize(results: List[BulkRecordResult]) -> BulkResult:
+    succeeded = sum(result.ok for result in results)
+    return BulkResult(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
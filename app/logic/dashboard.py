@@ -1,12 +1,21 @@
-from datetime import datetime
 import json
+import logging
+import os
+from datetime import date, datetime
+from typing import Dict
 from app.models.course import CommandType
-from app.models.dashboard import ActivityStatus, Dashboard, ParentStats
-from app.models.session import Event, Session
+from app.models.dashboard import ActivityStatus, Dashboard, ParentStats, SessionStats, SkillStats, UserStats
+from app.models.session import Session
 from app.dao.db import Db
+from app.logic.live_session import LiveSession, fold_heartbeat, live_sessions
 from app.resources.openai import create_response
 from app.utils.prompts import session_stats_system_prompt
 
+logger = logging.getLogger(__name__)
+
+# How long the builder waits for a session that a websocket handler is working on, before leaving it for the next build
+SESSION_LOCK_TIMEOUT = float(os.environ.get("DASHBOARD_SESSION_LOCK_TIMEOUT", 30))
+
 
 class DashboardBuilder:
     def __init__(self, user_id: str):
@@ -15,26 +24,33 @@ class DashboardBuilder:
         self.user = self.db.get_user(self.user_id)
         self.sessions = self.db.get_sessions_by_user_id(self.user_id)
 
-    async def build_session_stats(self):
-        event_logs = self.session.event_logs
-        if len(event_logs) > 0 and event_logs[-1].type == "dashboard_built":
-            return
-        day_wise_time_spent = {}
+    async def build_session_stats(self, session: Session) -> bool:
+        """Fill in the stats of a session from its events. Returns whether the session changed."""
+        self.session = session
+        if self.db.is_archived(self.session.id):
+            # Archived sessions are completed and their stats were built before archiving
+            return False
+        # Time spent is not in the events: it is folded into the session as pings arrive (see LiveSession.heartbeat)
+        day_wise_time_spent = dict(self.session.time_spent_per_day or {})
+        last_event = self.db.events.last(self.session.id)
+        if last_event is not None and last_event.type == "dashboard_built" and self.session.session_stats is not None:
+            if self.session.session_stats.time_spent_per_day == day_wise_time_spent:
+                return False
+            # Only heartbeats since the last build (e.g. pings after COMPLETED): nothing new for the LLM to score
+            self.update_time_spent(day_wise_time_spent)
+            return True
+        # Ping events stored before that, folded into the session's counters once (they are trimmed below)
+        ping_time_spent = {}
         last_ping_timestamp = None
         course = self.db.get_course(self.session.course_id)
         phases_completed = 0
         questions_answered = 0
         questions_correctly_answered = 0
         questions_asked = 0
-        for event in event_logs:
+        speech_interactions_count = 0
+        for event in self.db.events.iter_events(self.session.id):
             if event.type == "ping":
-                day = event.timestamp.split("T")[0]
-                if day not in day_wise_time_spent:
-                    day_wise_time_spent[day] = 0
-                else:
-                    if last_ping_timestamp is not None:
-                        if event.timestamp - last_ping_timestamp <= 40:
-                            day_wise_time_spent[day] += event.timestamp - last_ping_timestamp
+                fold_heartbeat(ping_time_spent, last_ping_timestamp, event.timestamp)
                 last_ping_timestamp = event.timestamp
             elif event.type == "next_phase":
                 phases_completed += 1
@@ -49,12 +65,21 @@ class DashboardBuilder:
                 if event.data.get("command", {}).get("command_type") in [CommandType.MCQ_QUESTION, CommandType.BINARY_CHOICE_QUESTION]:
                     questions_asked += 1
 
+        if ping_time_spent:
+            for day, seconds in ping_time_spent.items():
+                day_wise_time_spent[day] = day_wise_time_spent.get(day, 0) + seconds
+            self.session.time_spent_per_day = dict(day_wise_time_spent)
+
+        if self.session.session_stats is None:
+            self.session.session_stats = SessionStats(session_id=self.session.id)
+        if self.session.session_stats.skill_stats is None:
+            self.session.session_stats.skill_stats = SkillStats()
+        self.session.session_stats.date = self.session.session_stats.date or datetime.now()
         self.session.session_stats.questions_answered = questions_answered
         self.session.session_stats.questions_asked = questions_asked
-        self.session.session_stats.time_spent_per_day = day_wise_time_spent
         self.session.session_stats.speech_interactions_count = speech_interactions_count
-        self.session.session_stats.session_time = sum(day_wise_time_spent.values())
-        self.session.session_stats.mastery_score = questions_correctly_answered / questions_asked
+        self.session.session_stats.mastery_score = questions_correctly_answered / questions_asked if questions_asked else None
+        self.session.session_stats.skill_stats.mastery_score = self.session.session_stats.mastery_score
         self.session.session_stats.completion = phases_completed / course.stats.total_phases
 
         # Use LLM to get subjective stats
@@ -76,15 +101,45 @@ class DashboardBuilder:
         self.session.session_stats.learning_insights = response.get("learning_insights")
         self.session.session_stats.parent_recommendations = response.get("parent_recommendations")
 
+        # The user's time series gets this session's skill snapshot (replacing an earlier build's) and active days, see UserHistory
+        self.db.record_skill_stats(
+            self.user_id, self.session.id, self.session.session_stats.date, self.session.session_stats.skill_stats.model_dump()
+        )
+        self.update_time_spent(day_wise_time_spent)
+
         # Resetting this so that the system instructions are set again when the user starts learning
         self.session.system_instructions = None
-        # Clean up event logs
-        self.session.event_logs = [event for event in self.session.event_logs if event.type == "dashboard_built"]
-        self.session.event_logs.append(Event(type="dashboard_built", data={}, timestamp=datetime.now().isoformat()))
-        self.db.update_session_in_memory(self.session.id, self.session.model_dump())
+        # Clean up event logs (moved to the cold tier when there is one)
+        self.db.trim_events(self.session.id, ["dashboard_built"])
+        self.db.events.append(self.session.id, "dashboard_built", {})
+        return True
+
+    def update_time_spent(self, day_wise_time_spent: Dict[str, float]):
+        """Set the time spent of the session's stats, and mark its days as active in the user's time series."""
+        self.session.session_stats.time_spent_per_day = day_wise_time_spent
+        self.session.session_stats.session_time = sum(day_wise_time_spent.values())
+        for day in day_wise_time_spent:
+            self.db.record_activity(self.user_id, date.fromisoformat(day))
+
+    def backfill_history(self):
+        """Seed the time series of users whose sessions were built before it existed, once."""
+        history = self.db.get_user_history(self.user_id)
+        if history.counts:
+            return
+        sessions = sorted(
+            (session for session in self.sessions if session.session_stats and session.session_stats.skill_stats),
+            key=lambda session: session.session_stats.date or session.created_at or datetime.min,
+        )
+        if not sessions:
+            return
+        for session in sessions:
+            timestamp = session.session_stats.date or session.created_at or datetime.now()
+            history.append(timestamp, session.session_stats.skill_stats.model_dump(), session_id=session.id)
+            for day in session.session_stats.time_spent_per_day or {}:
+                history.mark_active(date.fromisoformat(day))
+        self.db.update_user_history(history)
 
     def build_user_stats(self):
-        # Get the total time spent in the learning sessions
         """
         User stats:
             streak: int
@@ -95,27 +150,25 @@ class DashboardBuilder:
             learning_insights: Optional[str] = None
             skill_stats_history: Optional[List[SkillStats]] = None
             skill_stats_aggregate: Optional[SkillStats] = None
+
+        The skill history, its aggregate and the streak come from the user's time series (see UserHistory),
+        not from the sessions, so they cost the same however many sessions the user has.
         """
-        self.user.user_stats.total_learning_time = sum([session.session_stats.session_time for session in self.sessions])
-        self.user.user_stats.overall_completion_rate = sum([session.session_stats.completion for session in self.sessions]) / len(self.sessions)
-        self.user.user_stats.total_lessons_started = len(self.sessions)
-        self.user.user_stats.average_session_time = total_time_spent / len(self.sessions)
-        self.user.user_stats.skill_stats_history = [session.session_stats.skill_stats for session in self.sessions]
-        # List of session insights
-        self.user.user_stats.learning_insights = [session.session_stats.learning_insights for session in self.sessions] 
-        # Average of all the sessions' skill stats
-        self.user.user_stats.skill_stats_aggregate = {
-            "mastery_score": sum([session.session_stats.skill_stats.mastery_score for session in self.sessions]) / len(self.sessions),
-            "retention_score": sum([session.session_stats.skill_stats.retention_score for session in self.sessions]) / len(self.sessions),
-            "critical_thinking_score": sum([session.session_stats.skill_stats.critical_thinking_score for session in self.sessions]) / len(self.sessions),
-            "problem_solving_score": sum([session.session_stats.skill_stats.problem_solving_score for session in self.sessions]) / len(self.sessions),
-            "creativity_score": sum([session.session_stats.skill_stats.creativity_score for session in self.sessions]) / len(self.sessions),
-            "communication_score": sum([session.session_stats.skill_stats.communication_score for session in self.sessions]) / len(self.sessions),
-            "self_awareness_score": sum([session.session_stats.skill_stats.self_awareness_score for session in self.sessions]) / len(self.sessions),
-            "social_skills_score": sum([session.session_stats.skill_stats.social_skills_score for session in self.sessions]) / len(self.sessions),
-            "emotional_intelligence_score": sum([session.session_stats.skill_stats.emotional_intelligence_score for session in self.sessions]) / len(self.sessions),
-            "curiosity_score": sum([session.session_stats.skill_stats.curiosity_score for session in self.sessions]) / len(self.sessions),
-        }
+        session_stats = [session.session_stats for session in self.sessions if session.session_stats]
+        total_learning_time = sum(stats.session_time or 0 for stats in session_stats)
+        history = self.db.get_user_history(self.user_id)
+        aggregate = history.aggregate()
+        self.user.user_stats = UserStats(
+            streak=history.streak(),
+            total_learning_time=total_learning_time,
+            overall_completion_rate=sum(stats.completion or 0 for stats in session_stats) / len(self.sessions) if self.sessions else 0.0,
+            total_lessons_started=len(self.sessions),
+            average_session_time=total_learning_time / len(self.sessions) if self.sessions else 0.0,
+            # List of session insights
+            learning_insights=[stats.learning_insights for stats in session_stats if stats.learning_insights],
+            skill_stats_history=[SkillStats(**values) for values in history.history()],
+            skill_stats_aggregate=SkillStats(**aggregate) if aggregate else None,
+        )
 
 
     def build_parent_stats(self):
@@ -134,13 +187,24 @@ class DashboardBuilder:
 
 
     async def build_dashboard(self):
-        # Should lock the session before building the dashboard, and unlock it after the dashboard is built.
-        # This is because the system instructions are changed for building the dashbord. Build the dashboard only when the user is inactive.
-        for session in self.sessions:
-            await self.build_session_stats(session)
+        # Each session is locked while its stats are built (see LiveSessions), since the system instructions
+        # are changed for building the dashboard. A live session's handlers wait for it and vice versa.
+        self.backfill_history()
+        for index, session in enumerate(self.sessions):
+            async with live_sessions.serialized(session.id, timeout=SESSION_LOCK_TIMEOUT) as locked:
+                if not locked:
+                    logger.warning(f"Session {session.id} is busy, its stats are left for the next dashboard build")
+                    continue
+                # The connection's live state when the session is live, so that neither overwrites the other
+                live = live_sessions.get(session.id) or LiveSession(self.db, self.db.get_session(session.id) or session)
+                self.sessions[index] = live.session
+                if await self.build_session_stats(live.session):
+                    live.mark("session_stats", "system_instructions", "time_spent_per_day")
+                    live.commit()
         self.build_user_stats()
         parent_stats = self.build_parent_stats()
-        self.db.update_user(self.user_id, self.user.model_dump())
+        # The history lives in the user's time series (and the dashboard), not in the user document
+        self.db.update_user(self.user_id, self.user.model_dump(exclude={"user_stats": {"skill_stats_history"}}))
         dashboard = Dashboard(
             user_id=self.user_id,
             user_stats=self.user.user_stats,
@@ -1,20 +1,29 @@
 import asyncio
-import json
 import base64
-from typing import Dict, Any, Optional, Union, List
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List
 import logging
 from datetime import datetime
 from fastapi import WebSocket
 
-from app.dao.db import Db
-from app.logic.command_parser import CommandParser
+from app.dao.db import SESSION_LEASE_TTL, Db
+from app.logic.audio_chunking import AudioChunker, Throughput
+from app.logic.audio_frames import HEADER, AudioFrames
 from app.logic.dashboard import DashboardBuilder
+from app.logic.live_session import LiveSession, live_sessions
+from app.logic.outbound import FEATURE_COMMAND_BATCHES, PRIORITY_LANES, SLOW_CLIENT_CLOSE_CODE, Outbound, SlowClientError
+from app.logic.phase_prefetch import PhasePrefetcher
+from app.logic.turn_pipeline import AudioStream, TurnPipeline, pipeline_stats
 from app.models.character import Character
 from app.models.course import (
     AckPayload, BinaryChoiceQuestionPayload, ClassmatePointPayload, Command, CommandType, Course, MultipleChoiceQuestionPayload, PhaseType, StudentPointPayload,
     TeacherSpeechPayload, ClassmateSpeechPayload, TwoPlayerGamePayload, WhiteboardPayload, WaitForStudentPayload, GamePayload
 )
-from app.models.session import Event, Session, SessionStatus
+from app.models.session import Session, SessionProgress, SessionStatus
 from app.resources.elevenlabs import create_speech_stream
 from app.resources.openai import create_response
 from app.resources.deepgram import transcribe_audio
@@ -22,22 +31,108 @@ from app.utils import prompts
 
 logger = logging.getLogger(__name__)
 
+# Highest protocol version the server speaks, see websocket_contract.md. Clients opt in with a hello message.
+PROTOCOL_VERSION = 2
+# Optional features a client can ask for in its hello message
+FEATURES = [FEATURE_COMMAND_BATCHES]
+# A ping renews the session lease once this long has passed since it was last taken
+LEASE_RENEW_INTERVAL = SESSION_LEASE_TTL / 4
+
 class LearningInterface:
     def __init__(self, websocket: WebSocket):
         self.db = Db.get_instance()
         self.websocket = websocket
+        # Sessions driven through this connection, flushed to storage and released when it closes
+        self.session_ids = set()
+        # Lease owner id, unique across workers and hosts
+        self.connection_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # How fast this client takes audio, for the size of the audio chunks
+        self.audio_throughput = Throughput()
+        # Everything sent to the client goes through here, see Outbound
+        self.outbound = Outbound(websocket, self.connection_id, self.audio_throughput)
+        # Audio and game code of the next content phase, fetched while the student is in the current one
+        self.prefetcher = PhasePrefetcher(self.db, lambda text, voice_id: create_speech_stream(text, voice_id))
+        # 1: everything is JSON, audio base64 encoded in the commands. 2: commands carry a sequence id and
+        # speech audio goes out as binary frames (see AudioFrames).
+        self.protocol = 1
+        self.command_seq = 0
+        # Command whose frames are being queued (protocol 2), cut if its turn is interrupted before they all are
+        self.sending_seq: Optional[int] = None
+        # Messages being handled, concurrently (see receive)
+        self.tasks = set()
+        # Task running the turn of each session, which a new student interaction interrupts (barge-in)
+        self.turns: Dict[str, asyncio.Task] = {}
+        self.interrupted_tasks = set()
+        # When this connection last took the lease of each of its sessions
+        self.lease_renewed: Dict[str, float] = {}
+        # Set once the socket is closed because the client could not be sent to (see connection_lost)
+        self.connection_closed = False
+
+    def claim_session(self, session_id: str):
+        """Take (or renew) this connection's ownership lease on the session."""
+        if not self.db.acquire_session_lease(session_id, self.connection_id):
+            raise ValueError(f"Session with id {session_id} is active on another connection")
+        self.session_ids.add(session_id)
+        self.lease_renewed[session_id] = time.monotonic()
+
+    def live_session(self, session_id: str) -> LiveSession:
+        """
+        This connection's live state of the session. Loaded once, when the connection first uses the
+        session; later messages work on the same Session instead of reading it from the Db again.
+        """
+        live = live_sessions.get(session_id)
+        if live is None:
+            session = self.db.get_session(session_id)
+            if not session:
+                raise ValueError(f"Session with id {session_id} not found")
+            self.claim_session(session_id)
+            # A reopened archived session is worked on in the live store again
+            self.db.restore_session(session_id)
+            return live_sessions.attach(self.db, session, self.connection_id)
+        self.claim_session(session_id)
+        live.owner = self.connection_id
+        return live
+
+    def save(self, session: Session, *fields: str):
+        """Write the given top-level fields of a live session back to the Db (in memory, see Db.patch_session)."""
+        live = live_sessions.get(session.id)
+        if live is None or live.owner != self.connection_id:
+            # This connection's lease lapsed in the meantime: take the session back, unless another connection
+            # holds it now (then claim_session raises, and nothing of this connection's is written over it)
+            self.claim_session(session.id)
+            live = live_sessions.attach(self.db, session, self.connection_id)
+        live.mark(*fields)
+        live.commit()
+
+    async def close(self):
+        """Called when the websocket disconnects: persist the in-memory state of this connection's sessions."""
+        # Nobody is left to hear the turns in flight
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.outbound.close()
+        self.prefetcher.cancel()
+        # Sessions another connection took over (after this one's lease lapsed) are that connection's now
+        owned = [session_id for session_id in self.session_ids if live_sessions.detach(session_id, self.connection_id)]
+        self.db.flush_dirty_sessions(owned)
+        for session_id in owned:
+            # Completed sessions leave the hot store once nobody is connected to them
+            self.db.archive_session(session_id)
+        await self.db.flush()
+        for session_id in self.session_ids:
+            self.db.release_session_lease(session_id, self.connection_id)
     
     def log_event(self, session: Session, event_type: str, data: Optional[dict] = None):
-        session.event_logs.append(Event(type=event_type, data=data, timestamp=datetime.now().isoformat()))
-        self.db.update_session_in_memory(session.id, session.model_dump())
+        # Events go to the event store; the session document itself is only written when its state changes
+        self.db.events.append(session.id, event_type, data)
+        # Streaks are read from the days the user was active, see UserHistory
+        self.db.record_activity(session.user_id)
 
     """
     Validate and sanitize the session
     """
     def validate_inputs(self, session_id: str):
-        session_data = self.db.get_session(session_id)
-        if not session_data:
-            raise ValueError(f"Session with id {session_id} not found")
+        session_data = self.live_session(session_id).session
         course = self.db.get_course(session_data.course_id)
         if not course:
             raise ValueError(f"Course with id {session_data.course_id} not found")
@@ -47,44 +142,171 @@ class LearningInterface:
         return session_data, course, characters
 
     async def handle_error(self, session_data: Session, error_message: str):
-        await self.websocket.send_json({
-            "type": "error",
-            "message": error_message,
-            "timestamp": datetime.now().isoformat()
-        })
+        try:
+            await self.outbound.send_json({
+                "type": "error",
+                "message": error_message,
+                "timestamp": datetime.now().isoformat()
+            })
+        except SlowClientError as e:
+            await self.connection_lost(e)
+            return
         if session_data:
             self.log_event(session_data, "error", {"message": error_message})
 
+    def receive(self, message: Dict[str, Any]) -> None:
+        """
+        Handle a message from the client in a task of its own, so the connection keeps reading (pings, and a
+        student who interrupts) while a turn runs. Messages of a session are still handled one at a time, in
+        order (see process_message). A student interaction interrupts the turn in flight of its session.
+        """
+        if message.get("type") == "student_interaction":
+            self.interrupt(message.get("session_id"))
+        task = asyncio.ensure_future(self.process_message(message))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def interrupt(self, session_id: Optional[str]) -> None:
+        """Barge-in: cancel the turn the session is running, if any. Its OpenAI and ElevenLabs streams are closed."""
+        task = self.turns.get(session_id)
+        if task is not None and not task.done():
+            self.interrupted_tasks.add(task)
+            task.cancel()
+
+    @contextmanager
+    def interruptible(self, session: Session):
+        """The block is the turn of the session, which interrupt() cancels."""
+        task = asyncio.current_task()
+        self.turns[session.id] = task
+        try:
+            yield
+        finally:
+            if self.turns.get(session.id) is task:
+                del self.turns[session.id]
+
     async def process_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process incoming WebSocket messages and return appropriate responses.
         """
         message_type = message.get("type", "unknown")
+        session_id = message.get("session_id")
         
         try:
-            if message_type == "ping":
-                await self._handle_ping(message)
-            elif message_type == "start_session":
-                await self._handle_start_session(message)
-            elif message_type == "next_phase":
-                await self._handle_next_phase(message)
-            elif message_type == "student_interaction":
-                await self._handle_student_interaction(message)
-            elif message_type == "start_two_player_game":
-                await self._handle_two_player_game(message)
-            elif message_type == "finish_two_player_game":
-                await self._handle_finish_two_player_game(message)
-            else:
-                await self.handle_error(None, f"Unknown message type: {message_type}")
+            if message_type == "ping" and self.heartbeat(session_id):
+                # Fast path: nothing to validate or store, and no waiting for the session's lock (e.g. behind a turn)
+                await self.send_pong()
+                return
+            # One message of a session at a time, and never while the dashboard builder updates it
+            async with live_sessions.serialized(session_id):
+                try:
+                    await self._dispatch(message_type, message)
+                except asyncio.CancelledError:
+                    task = asyncio.current_task()
+                    if task not in self.interrupted_tasks:
+                        raise
+                    self.interrupted_tasks.discard(task)
+                    # Still under the session's lock: nothing of the next turn is queued yet
+                    await self.turn_interrupted(session_id)
+        except SlowClientError as e:
+            await self.connection_lost(e)
         except Exception as e:
             logger.error(f"Error in process_message: {str(e)}")
             await self.handle_error(None, f"Internal error: {str(e)}")
+
+    async def connection_lost(self, error: SlowClientError):
+        """
+        Nothing can be sent to the client anymore (the disconnect policy closed it, or a send failed): close
+        the socket, so that the receive loop ends and `close` cleans up, instead of reporting to nobody.
+        """
+        if self.connection_closed:
+            return
+        self.connection_closed = True
+        logger.warning(f"Closing connection {self.connection_id}: {str(error)}")
+        try:
+            await self.websocket.close(code=SLOW_CLIENT_CLOSE_CODE)
+        except Exception:
+            # Already closed
+            pass
+
+    async def turn_interrupted(self, session_id: str):
+        """
+        Drop what the interrupted turn left to send and tell the client where it was cut: in protocol 2, the
+        sequence id of the first command the client did not get in full.
+        """
+        pipeline_stats.interrupted += 1
+        seqs = self.outbound.discard_turn()
+        if self.sending_seq is not None:
+            seqs.add(self.sending_seq)
+            self.sending_seq = None
+        message = {"type": "interrupted"}
+        if self.protocol >= 2:
+            message["seq"] = min(seqs) if seqs else None
+        await self.outbound.send_json(message)
+        live = live_sessions.get(session_id)
+        if live is not None:
+            self.log_event(live.session, "interrupted", {"seq": min(seqs) if seqs else None})
+
+    async def _dispatch(self, message_type: str, message: Dict[str, Any]):
+        if message_type == "hello":
+            await self._handle_hello(message)
+        elif message_type == "ping":
+            await self._handle_ping(message)
+        elif message_type == "start_session":
+            await self._handle_start_session(message)
+        elif message_type == "next_phase":
+            await self._handle_next_phase(message)
+        elif message_type == "student_interaction":
+            await self._handle_student_interaction(message)
+        elif message_type == "start_two_player_game":
+            await self._handle_two_player_game(message)
+        elif message_type == "finish_two_player_game":
+            await self._handle_finish_two_player_game(message)
+        else:
+            await self.handle_error(None, f"Unknown message type: {message_type}")
     
+    async def _handle_hello(self, message: Dict[str, Any]):
+        """Protocol negotiation: the highest version both sides speak, and the optional features both support."""
+        try:
+            requested = int(message.get("protocol", 1))
+        except (TypeError, ValueError):
+            requested = 1
+        self.protocol = max(1, min(requested, PROTOCOL_VERSION))
+        requested_features = message.get("features")
+        features = [feature for feature in FEATURES if isinstance(requested_features, list) and feature in requested_features]
+        self.outbound.batching = FEATURE_COMMAND_BATCHES in features
+        # Audio frames carry their command's seq from version 2 on, so control messages may overtake them
+        self.outbound.priority_lanes = PRIORITY_LANES and self.protocol >= 2
+        await self.outbound.send_json({
+            "type": "hello",
+            "protocol": self.protocol,
+            "features": features,
+        })
+
     async def _handle_ping(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        # The session is not live on this connection yet: load it, later pings take the fast path (see process_message)
         session_id = message.get("session_id", "")
-        session, _, _ = self.validate_inputs(session_id)
-        self.log_event(session, "ping", {})
-        await self.websocket.send_json({
+        self.live_session(session_id)
+        self.heartbeat(session_id)
+        await self.send_pong()
+
+    def heartbeat(self, session_id: Optional[str]) -> bool:
+        """
+        Record a ping of a session this connection drives, in memory only: the time spent is folded into the
+        live session (see LiveSession.heartbeat), and the lease is renewed every LEASE_RENEW_INTERVAL.
+        False if the session is not live on this connection.
+        """
+        live = live_sessions.get(session_id)
+        if live is None or session_id not in self.session_ids:
+            return False
+        if time.monotonic() - self.lease_renewed.get(session_id, 0) >= LEASE_RENEW_INTERVAL:
+            self.claim_session(session_id)
+        live.heartbeat()
+        # Streaks are read from the days the user was active, see UserHistory
+        self.db.record_activity(live.session.user_id)
+        return True
+
+    async def send_pong(self):
+        await self.outbound.send_json({
             "type": "pong",
             "message": "Server is alive",
             "timestamp": datetime.now().isoformat()
@@ -97,24 +319,36 @@ class LearningInterface:
         await self.start_phase(session_data, course, characters)
     
     def progress_to_next_phase(self, session: Session, course: Course):
-        phase_id = session.progress.phase_id
-        topic_id = session.progress.topic_id
+        progress = self.next_progress(session.progress, course)
+        if progress is None:
+            return False
+        session.progress.topic_id = progress.topic_id
+        session.progress.module_id = progress.module_id
+        session.progress.phase_id = progress.phase_id
+        return True
+
+    def next_progress(self, progress: SessionProgress, course: Course) -> Optional[SessionProgress]:
+        """Progress of the phase after `progress`, or None at the end of the course."""
+        phase_id = progress.phase_id if progress.phase_id is not None else 0
+        topic_id = progress.topic_id
         topic = course.topics[topic_id]
-        module_id = session.progress.module_id
+        module_id = progress.module_id
         module = topic.modules[module_id]
         if phase_id < len(module.phases) - 1:
-            session.progress.phase_id = phase_id + 1
-            return True
+            return progress.model_copy(update={"phase_id": phase_id + 1})
         if module_id < len(topic.modules) - 1:
-            session.progress.module_id = module_id + 1
-            session.progress.phase_id = 0
-            return True
+            return progress.model_copy(update={"module_id": module_id + 1, "phase_id": 0})
         if topic_id < len(course.topics) - 1:
-            session.progress.topic_id = topic_id + 1
-            session.progress.module_id = 0
-            session.progress.phase_id = 0
-            return True
-        return False
+            return progress.model_copy(update={"topic_id": topic_id + 1, "module_id": 0, "phase_id": 0})
+        return None
+
+    def prefetch_next_phase(self, session: Session, course: Course):
+        progress = self.next_progress(session.progress, course)
+        if progress is None:
+            return
+        phase = course.topics[progress.topic_id].modules[progress.module_id].phases[progress.phase_id]
+        if phase.type == PhaseType.CONTENT and phase.content:
+            self.prefetcher.schedule(session, progress, phase.content)
 
     async def _handle_next_phase(self, message: Dict[str, Any]) -> Dict[str, Any]:
         session_id = message.get("session_id", "")
@@ -127,16 +361,17 @@ class LearningInterface:
 
     async def _handle_student_interaction(self, message: Dict[str, Any]) -> Dict[str, Any]:
         session_id = message.get("session_id", "")
-        session = self.db.get_session(session_id)
-        if not session:
-            await self.websocket.send_json({
+        try:
+            session = self.live_session(session_id).session
+        except ValueError as e:
+            await self.outbound.send_json({
                 "type": "error",
-                "message": f"Session with id {session_id} not found",
+                "message": str(e),
             })
             return
         course = self.db.get_course(session.course_id)
         if not course:
-            await self.websocket.send_json({
+            await self.outbound.send_json({
                 "type": "error",
                 "message": f"Course with id {session.course_id} not found",
             })
@@ -147,11 +382,26 @@ class LearningInterface:
             text = await transcribe_audio(audio_bytes)
             if text:
                 interaction["transcription"] = text
-                await self.websocket.send_json({
+                await self.outbound.send_json({
                     "type": "student_speech",
                     "text": text
                 })
                 text = f"Student has said something. Please respond accordingly. Use the commands to respond. Feel free to use whiteboard/teacher/classmate speech and other commands. If required, use the student's information to make the session more engaging and personalized. Use analogies that the student can relate to, using the student's information. Stick to the information provided by the student. The following is what the student said: {text}\nEmit <FINISH_MODULE/> at the end if the student's query is answered and the main part of this phase is complete."
+                try:
+                    await self.create_response_and_execute(
+                        {
+                            "message": text,
+                            "instructions": session.system_instructions,
+                            "previous_response_id": session.previous_response_id
+                        },
+                        session
+                    )
+                finally:
+                    # Also when the student interrupts the response
+                    self.log_event(session, "student_interaction", {"interaction": interaction})
+        elif interaction.get("type") in ["mcq_question", "binary_choice_question"]:
+            text = f"Student answered {'correctly' if interaction.get('correct', False) else 'incorrectly'}. Student's answer: {interaction.get('answer', '')}. Explain the answer if needed. Use only the defined commands, and no other command. If something is to be explained, use TEACHER_SPEECH and other defined commands. Feel free to use whiteboard/teacher/classmate speech and other commands. Emit <FINISH_MODULE/> command at the end so that we can proceed. Do not overcomplicate this, and emit FINISH_MODULE to proceed further."
+            try:
                 await self.create_response_and_execute(
                     {
                         "message": text,
@@ -160,20 +410,10 @@ class LearningInterface:
                     },
                     session
                 )
+            finally:
                 self.log_event(session, "student_interaction", {"interaction": interaction})
-        elif interaction.get("type") in ["mcq_question", "binary_choice_question"]:
-            text = f"Student answered {'correctly' if interaction.get('correct', False) else 'incorrectly'}. Student's answer: {interaction.get('answer', '')}. Explain the answer if needed. Use only the defined commands, and no other command. If something is to be explained, use TEACHER_SPEECH and other defined commands. Feel free to use whiteboard/teacher/classmate speech and other commands. Emit <FINISH_MODULE/> command at the end so that we can proceed. Do not overcomplicate this, and emit FINISH_MODULE to proceed further."
-            await self.create_response_and_execute(
-                {
-                    "message": text,
-                    "instructions": session.system_instructions,
-                    "previous_response_id": session.previous_response_id
-                },
-                session
-            )
-            self.log_event(session, "student_interaction", {"interaction": interaction})
         else:
-            await self.websocket.send_json({
+            await self.outbound.send_json({
                 "type": "error",
                 "message": "Unknown message type",
             })
@@ -185,6 +425,7 @@ class LearningInterface:
         two_player_game_payload = TwoPlayerGamePayload(**two_player_game)
         system_prompt = prompts.get_two_player_game_system_prompt(two_player_game_payload)
         session.system_instructions = system_prompt
+        self.save(session, "system_instructions")
         await self.create_response_and_execute(
             {
                 "message": "Start the game with a small, crisp announcement speech from the teacher. Then, emit the CLASSMATE_SPEECH command with the first speech from the classmate.",
@@ -206,6 +447,7 @@ class LearningInterface:
             session
         )
         session.system_instructions = None
+        self.save(session, "system_instructions")
 
     async def start_phase(self, session: Session, course: Course, characters: List[Character]):
         phase_id = session.progress.phase_id if session.progress.phase_id is not None else 0
@@ -221,11 +463,18 @@ class LearningInterface:
             session.checkpoint_response_id = None
         else:
             session.previous_response_id = session.checkpoint_response_id
+        self.save(session, "progress", "system_instructions", "status", "previous_response_id", "checkpoint_response_id")
         self.log_event(session, "start_phase", {"progress": session.progress.model_dump()})
         content_string = "".join([cmd.to_string() for cmd in phase.content]) if phase.content else None
         phase_update_prompt = prompts.phase_update_prompt(content_string, phase.instruction)
         if phase.type == PhaseType.CONTENT:
-            await self.execute_commands(phase.content, session)  
+            # Audio and game code prefetched during the previous phase are used where they are ready
+            self.prefetcher.use(session.id, session.progress)
+            try:
+                # execute_commands fills in audio/game code on the commands, and the course instance is shared (see Db.get_course)
+                await self.execute_commands([command.model_copy(deep=True) for command in phase.content], session)
+            finally:
+                self.prefetcher.release()
         await self.create_response_and_execute(
             {
                 "message": phase_update_prompt,
@@ -234,13 +483,17 @@ class LearningInterface:
             },
             session
         )
+        self.prefetch_next_phase(session, course)
     
     async def finish_module(self, session: Session, course: Course):
         session.status = SessionStatus.COMPLETED
+        self.prefetcher.cancel()
         self.log_event(session, "finish_module", {})
-        self.db.update_session(session.id, session.model_dump())
+        self.save(session, "status", "progress", "checkpoint_response_id")
+        self.db.flush_dirty_sessions([session.id])
+        await self.db.flush()
         # Can add some personalised feedback and messages here.
-        await self.websocket.send_json({
+        await self.outbound.send_json({
             "type": "finish_module",
             "message": "Module finished",
         })
@@ -259,83 +512,149 @@ class LearningInterface:
             "delta": "In",
             "sequence_number": 1
         }
+        The response is streamed through a TurnPipeline: deltas keep being read and parsed while earlier
+        commands are synthesized and sent.
         """
-        # response = await create_response(message=phase_update_prompt, instructions=session.system_instructions, previous_response_id=session.previous_response_id)
         create_response_args["stream"] = True
-        response_stream = await create_response(**create_response_args)
-        response_id = None
-        command_parser = CommandParser()
-        async for response in response_stream:
-            if response.type == "response.created":
-                response_id = response.response.id
-            elif response.type == "response.output_text.delta":
-                command_parser.add(response.delta)
-                commands = command_parser.parse()
-                await self.execute_commands(commands, session)
-            elif response.type == "response.completed":
-                logger.info("Response completed")
+        with self.interruptible(session):
+            response_stream = await create_response(**create_response_args)
+            response_id = await self.turn_pipeline(session).run_response(response_stream)
+        # An interrupted response is not continued from: the student did not hear all of it
         session.previous_response_id = response_id
-        self.db.update_session_in_memory(session.id, session.model_dump())
+        self.save(session, "previous_response_id")
+
+    async def execute_commands(self, commands: List[Command], session: Session):
+        with self.interruptible(session):
+            await self.turn_pipeline(session).run_commands(commands)
+
+    def turn_pipeline(self, session: Session) -> TurnPipeline:
+        pipeline = None
+
+        async def send(command: Command, audio):
+            await self.send_command(command, audio, session, pipeline)
+
+        pipeline = TurnPipeline(
+            enrich=self.enrich_command,
+            synthesize=lambda command: self.synthesize_command(command, session),
+            send=send,
+            on_error=self.command_failed,
+        )
+        return pipeline
+
+    def enrich_command(self, command: Command):
+        if command.command_type == CommandType.GAME:
+            code = self.prefetcher.game_code(command.payload.game_id)
+            if code is None:
+                code = self.db.get_game(command.payload.game_id).code
+            command.payload.code = code
+
+    def synthesize_command(self, command: Command, session: Session):
+        if command.command_type not in [CommandType.TEACHER_SPEECH, CommandType.CLASSMATE_SPEECH]:
+            return None
+        if self.outbound.text_only:
+            # The client was too slow for audio (see Outbound), speech goes out as text only
+            return None
+        voice_id = session.teacher.voice_id if command.command_type == CommandType.TEACHER_SPEECH else session.classmate.voice_id
+        prefetched = self.prefetcher.audio(command.payload.text, voice_id)
+        if prefetched is not None:
+            return prefetched
+        return create_speech_stream(command.payload.text, voice_id)
+
+    async def command_failed(self, command: Command, error: Exception):
+        if isinstance(error, SlowClientError):
+            # The client is gone: the rest of the turn has nobody to go to
+            raise error
+        logger.error(f"Error executing command {command.command_type}: {str(error)}")
+        await self.handle_error(None, f"Error executing command: {str(error)}")
+
+    def command_message(self, command: Command, seq: Optional[int] = None) -> Dict[str, Any]:
+        message = {
+            "type": "command",
+            "command": command.model_dump()
+        }
+        if seq is not None:
+            message["seq"] = seq
+        return message
 
     """
     For both types of speech commands, text and audio can be sent separately. The UI handles what to do based on the data available.
     """
-    async def execute_commands(self, commands: List[Command], session: Session):
-        for command in commands:
-            try:
-                if command.command_type in [CommandType.TEACHER_SPEECH, CommandType.CLASSMATE_SPEECH]:
-                    # Handle commands that need streaming
-                    await self.websocket.send_json({
-                        "type": "command",
-                        "command": command.model_dump()
-                    })
-                    self.log_event(session, "execute_command", {"command": command.model_dump()})
-                    voice_id = session.teacher.voice_id if command.command_type == CommandType.TEACHER_SPEECH else session.classmate.voice_id
-                    audio_stream = await create_speech_stream(command.payload.text, voice_id)
-                    command.payload.text = None
-                    
-                    # Buffer audio chunks to reduce WebSocket message frequency
-                    audio_buffer = b""
-                    chunk_size_threshold = 16384  # Send chunks when buffer reaches this size
-                    
-                    async for chunk in audio_stream:
-                        if isinstance(chunk, bytes):
-                            audio_buffer += chunk
-                            
-                            # Send when buffer is large enough or this is the last chunk
-                            if len(audio_buffer) >= chunk_size_threshold:
-                                command.payload.audio_bytes = base64.b64encode(audio_buffer).decode('utf-8')
-                                await self.websocket.send_json({
-                                    "type": "command",
-                                    "command": command.model_dump()
-                                })
-                                audio_buffer = b""  # Reset buffer
-                    
-                    # Send any remaining audio data
-                    if audio_buffer:
-                        command.payload.audio_bytes = base64.b64encode(audio_buffer).decode('utf-8')
-                        await self.websocket.send_json({
-                            "type": "command",
-                            "command": command.model_dump()
-                        })
-                    
-                    # Send a final message to indicate audio stream is complete
-                    command.payload.audio_bytes = None
-                    command.payload.stream_complete = True
-                    await self.websocket.send_json({
-                        "type": "command",
-                        "command": command.model_dump()
-                    })
-                else:
-                    # Handle commands that are flushed out at once
-                    if command.command_type == CommandType.GAME:
-                        game = self.db.get_game(command.payload.game_id)
-                        command.payload.code = game.code
-                    await self.websocket.send_json({
-                        "type": "command",
-                        "command": command.model_dump()
-                    })
-                self.log_event(session, "execute_command", {"command": command.model_dump()})
-            except Exception as e:
-                logger.error(f"Error executing command {command.command_type}: {str(e)}")
-                await self.handle_error(None, f"Error executing command: {str(e)}")
\ No newline at end of file
+    async def send_command(self, command: Command, audio: Optional[AudioStream], session: Session, pipeline: TurnPipeline):
+        if self.protocol >= 2:
+            await self.send_command_v2(command, audio, session, pipeline)
+            return
+        if audio is not None:
+            # Speech: the text first, then the audio as it is synthesized
+            await self.outbound.send_command(self.command_message(command))
+            self.log_event(session, "execute_command", {"command": command.model_dump()})
+            command.payload.text = None
+
+            # Buffer audio chunks to reduce WebSocket message frequency, see AudioChunker for their size
+            chunker = AudioChunker(self.audio_throughput)
+            audio_buffer = bytearray()
+
+            async def send_buffer():
+                command.payload.audio_bytes = base64.b64encode(audio_buffer).decode('utf-8')
+                await self.outbound.send_json(self.command_message(command), audio=True)
+                chunker.sent(len(audio_buffer))
+                pipeline.audio_sent()
+
+            async for chunk in audio:
+                if isinstance(chunk, bytes):
+                    audio_buffer += chunk
+                    if chunker.ready(len(audio_buffer), audio.backlog + self.outbound.queued_bytes):
+                        await send_buffer()
+                        audio_buffer = bytearray()
+
+            # Send any remaining audio data
+            if audio_buffer:
+                await send_buffer()
+
+            # Send a final message to indicate audio stream is complete
+            command.payload.audio_bytes = None
+            command.payload.stream_complete = True
+            await self.outbound.send_command(self.command_message(command))
+            self.log_event(session, "execute_command", {"command": command.model_dump(), "audio": chunker.finish()})
+        else:
+            # Handle commands that are flushed out at once
+            await self.outbound.send_command(self.command_message(command))
+            self.log_event(session, "execute_command", {"command": command.model_dump()})
+
+    async def send_command_v2(self, command: Command, audio: Optional[AudioStream], session: Session, pipeline: TurnPipeline):
+        """
+        Protocol 2: every command is sent once as JSON with a sequence id. The audio of a speech command
+        follows as binary frames tagged with that id, the last one with the end flag.
+        """
+        self.command_seq += 1
+        seq = self.command_seq
+        self.sending_seq = seq
+        # The command message keeps its place among the commands; only its audio frames are bulk (see Outbound)
+        await self.outbound.send_command(self.command_message(command, seq), seq=seq)
+        if audio is not None:
+            self.log_event(session, "execute_command", {"command": command.model_dump()})
+            chunker = AudioChunker(self.audio_throughput)
+            frames = AudioFrames(seq)
+
+            async def send_frame(end: bool = False):
+                size = len(frames)
+                frame = frames.frame(end)
+                # If a slow client does not get the audio, it still gets the end of the utterance
+                await self.outbound.send_bytes(frame, audio=size > 0, keep=bytes(frame[:HEADER.size]) if end else None, seq=seq)
+                if size:
+                    chunker.sent(size)
+                    pipeline.audio_sent()
+
+            async for chunk in audio:
+                frames.add(chunk)
+                if chunker.ready(len(frames), audio.backlog + self.outbound.queued_bytes):
+                    await send_frame()
+            # The end frame carries whatever audio is left, possibly none
+            await send_frame(end=True)
+            # Fully queued: if the turn is cut now, Outbound.discard_turn knows whether any of it was not sent
+            self.sending_seq = None
+            command.payload.text = None
+            command.payload.stream_complete = True
+            self.log_event(session, "execute_command", {"command": command.model_dump(), "audio": chunker.finish()})
+        else:
+            self.sending_seq = None
+            self.log_event(session, "execute_command", {"command": command.model_dump()})
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set
+
+from app.dao.db import Db
+from app.models.session import Session
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# A gap between two heartbeats longer than this is time away, not time spent
+HEARTBEAT_GAP_CAP_SECONDS = 40
+# The heartbeat fields of a live session are written to its document at least this often (and with every commit)
+HEARTBEAT_COMMIT_INTERVAL = float(os.environ.get("HEARTBEAT_COMMIT_INTERVAL", 60))
+HEARTBEAT_FIELDS = ["time_spent_per_day", "last_alive_timestamp"]
+
+
+def fold_heartbeat(time_spent: Dict[str, float], last: Optional[datetime], now: datetime) -> None:
+    """
+    Add a heartbeat at `now` to the seconds spent per day, `last` being the previous heartbeat: the gap
+    counts towards the day, unless it is the day's first heartbeat or the gap exceeds HEARTBEAT_GAP_CAP_SECONDS.
+    """
+    day = now.date().isoformat()
+    if day not in time_spent:
+        time_spent[day] = 0
+    elif last is not None:
+        gap = (now - last).total_seconds()
+        if 0 <= gap <= HEARTBEAT_GAP_CAP_SECONDS:
+            time_spent[day] += gap
+
+
+class TaskLock:
+    """
+    asyncio lock that the task holding it can acquire again. A handler that completes a module builds the
+    dashboard, which locks every session of the user, including the one the handler already holds.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._owner: Optional[asyncio.Task] = None
+        self._depth = 0
+        self.waiters = 0
+
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        task = asyncio.current_task()
+        if self._owner is task:
+            self._depth += 1
+            return True
+        self.waiters += 1
+        try:
+            if timeout is None:
+                await self._lock.acquire()
+            else:
+                await asyncio.wait_for(self._lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiters -= 1
+        self._owner = task
+        self._depth = 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            self._lock.release()
+
+    def held_by_other_task(self) -> bool:
+        return self._owner is not None and self._owner is not asyncio.current_task()
+
+    def idle(self) -> bool:
+        return self._owner is None and self.waiters == 0
+
+
+class LiveSession:
+    """
+    Authoritative state of a session while something works on it: the Session is loaded once and kept,
+    instead of being rebuilt from its document on every message. Changes are written back field by field:
+    `mark` the top-level fields that changed and `commit` patches only those into the stored document.
+    `owner` is the connection driving it (its lease owner id), None when nothing live does.
+    """
+
+    def __init__(self, db: Db, session: Session, owner: Optional[str] = None):
+        self.db = db
+        self.session = session
+        self.owner = owner
+        self._changed: Set[str] = set()
+        self._committed = time.monotonic()
+
+    @property
+    def id(self) -> str:
+        return self.session.id
+
+    def mark(self, *fields: str) -> None:
+        self._changed.update(fields)
+
+    def commit(self, fields: Optional[Iterable[str]] = None) -> None:
+        """Write the marked fields (only those among `fields`, if given) to the stored document."""
+        fields = self._changed if fields is None else self._changed & set(fields)
+        if not fields:
+            return
+        changes = self.session.model_dump(include=fields)
+        self._committed = time.monotonic()
+        if not self.db.patch_session(self.id, changes):
+            # Kept marked, so that the changes are not lost if the session shows up again
+            logger.error(f"Session {self.id} is not in the store, {sorted(fields)} not written")
+            return
+        self._changed = self._changed - fields
+        live_sessions.patches += 1
+        live_sessions.fields_written += len(changes)
+
+    def heartbeat(self, now: Optional[datetime] = None) -> None:
+        """
+        A heartbeat of the client: fold it into the session's time spent per day (see fold_heartbeat) instead
+        of storing it. Only the live Session changes; its heartbeat fields are written with the next commit,
+        or by this one once HEARTBEAT_COMMIT_INTERVAL has passed. Needs no lock: nothing else writes them.
+        """
+        now = now or datetime.now()
+        session = self.session
+        if session.time_spent_per_day is None:
+            session.time_spent_per_day = {}
+        fold_heartbeat(session.time_spent_per_day, session.last_alive_timestamp, now)
+        session.last_alive_timestamp = now
+        self.mark(*HEARTBEAT_FIELDS)
+        live_sessions.heartbeats += 1
+        if time.monotonic() - self._committed >= HEARTBEAT_COMMIT_INTERVAL:
+            # Only its own fields: a handler may be halfway through changing others
+            self.commit(HEARTBEAT_FIELDS)
+
+
+class LiveSessions:
+    """
+    Process-wide registry of the sessions driven by websocket connections, and of per-session locks.
+
+    Every websocket handler runs under its session's lock (`serialized`), and so does the dashboard builder
+    for each session it updates, so one never overwrites what the other changed in between. The dashboard
+    builder works on the live Session when there is one, so its changes land in the connection's state too.
+    A session only has one live connection at a time (see Db.acquire_session_lease).
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, LiveSession] = {}
+        self._locks: Dict[str, TaskLock] = {}
+        self.loads = 0
+        self.patches = 0
+        self.fields_written = 0
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+        self.heartbeats = 0
+        metrics.register("live_sessions", self.stats)
+
+    def get(self, session_id: str) -> Optional[LiveSession]:
+        return self._sessions.get(session_id)
+
+    def attach(self, db: Db, session: Session, owner: str) -> LiveSession:
+        """
+        Make `session` the live state of its session id, driven by `owner`, unless there already is one: that
+        one is returned, and `owner` takes it over (it holds the session's lease, see Db.acquire_session_lease).
+        """
+        live = self._sessions.get(session.id)
+        if live is None:
+            self.loads += 1
+            live = self._sessions[session.id] = LiveSession(db, session, owner)
+        live.owner = owner
+        return live
+
+    def detach(self, session_id: str, owner: str) -> bool:
+        """
+        Commit and drop the live state of a session that `owner` drives. Returns False, leaving it alone, if
+        another connection took the session over (e.g. after `owner`'s lease lapsed).
+        """
+        live = self._sessions.get(session_id)
+        if live is None or live.owner != owner:
+            return False
+        del self._sessions[session_id]
+        live.commit()
+        return True
+
+    @asynccontextmanager
+    async def serialized(self, session_id: Optional[str], timeout: Optional[float] = None):
+        """
+        Run the block under the session's lock. Yields whether the lock was taken: False only when `timeout`
+        ran out, and then the block must not touch the session. Without a session id there is nothing to lock.
+        """
+        if not session_id:
+            yield True
+            return
+        lock = self._locks.setdefault(session_id, TaskLock())
+        if lock.held_by_other_task():
+            self.lock_waits += 1
+        acquired = await lock.acquire(timeout)
+        if not acquired:
+            self.lock_timeouts += 1
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+            if lock.idle() and self._locks.get(session_id) is lock:
+                del self._locks[session_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "live": len(self._sessions),
+            "locked": sum(1 for lock in self._locks.values() if not lock.idle()),
+            "loads": self.loads,
+            "patches": self.patches,
+            "fields_written": self.fields_written,
+            "lock_waits": self.lock_waits,
+            "lock_timeouts": self.lock_timeouts,
+            "heartbeats": self.heartbeats,
+        }
+
+
+live_sessions = LiveSessions()
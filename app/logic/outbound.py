@@ -0,0 +1,394 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket
+
+from app.logic.audio_chunking import Throughput
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Feature a client asks for in its hello message to get command envelopes
+FEATURE_COMMAND_BATCHES = "command_batches"
+# A batch reaching either cap is sent right away
+BATCH_MAX_COMMANDS = int(os.environ.get("OUTBOUND_BATCH_MAX_COMMANDS", 32))
+BATCH_MAX_BYTES = int(os.environ.get("OUTBOUND_BATCH_MAX_BYTES", 65536))
+# How long a command may wait for more to join its envelope. 0: only the commands of the same event loop tick
+BATCH_MAX_DELAY_MS = float(os.environ.get("OUTBOUND_BATCH_MAX_DELAY_MS", 0))
+
+# Frames and bytes waiting to be sent to one client before it counts as slow
+QUEUE_SIZE = int(os.environ.get("OUTBOUND_QUEUE_SIZE", 64))
+QUEUE_MAX_BYTES = int(os.environ.get("OUTBOUND_QUEUE_MAX_BYTES", 1024 * 1024))
+# What happens when a client's queue is full:
+#   wait (default): the turn waits for the client (the OpenAI and ElevenLabs streams with it)
+#   drop_audio: the audio waiting in the queue is stale, it is dropped
+#   text_only: as drop_audio, and the connection gets no more audio (speech is no longer synthesized)
+#   disconnect: the connection is closed
+SLOW_CLIENT_POLICIES = ["wait", "drop_audio", "text_only", "disconnect"]
+SLOW_CLIENT_POLICY = os.environ.get("OUTBOUND_SLOW_CLIENT_POLICY", "wait")
+# Close code of the disconnect policy: try again later
+SLOW_CLIENT_CLOSE_CODE = 1013
+# Control frames overtake bulk ones (speech audio) on connections that negotiated protocol 2, whose audio frames
+# carry the sequence id of their command. Off, and on protocol 1: everything is sent in the order it was queued.
+PRIORITY_LANES = os.environ.get("OUTBOUND_PRIORITY_LANES", "true").lower() in ("1", "true", "yes")
+CONTROL, BULK = 0, 1
+LANES = ["control", "bulk"]
+
+
+class SlowClientError(Exception):
+    """Raised to whoever sends to a connection that was closed or failed."""
+
+
+def _encode(message: Dict[str, Any]) -> str:
+    # As WebSocket.send_json encodes
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class _Frame:
+    __slots__ = ("data", "lane", "audio", "keep", "turn", "seq", "queued")
+
+    def __init__(
+        self,
+        data: Union[str, bytes, bytearray],
+        lane: int = CONTROL,
+        audio: bool = False,
+        keep: Optional[bytes] = None,
+        turn: bool = False,
+        seq: Optional[int] = None,
+    ):
+        self.data = data
+        self.lane = lane
+        # Audio can be dropped for a slow client. `keep` is sent instead, if any (e.g. the end marker of an utterance).
+        self.audio = audio
+        self.keep = keep
+        # Commands and audio of a turn, dropped when the turn is interrupted. `seq`: the command sequence id, if any.
+        self.turn = turn
+        self.seq = seq
+        self.queued = time.perf_counter()
+
+    def kept(self) -> "_Frame":
+        return _Frame(self.keep, self.lane, turn=self.turn, seq=self.seq)
+
+
+class OutboundStats:
+    """Counters of the messages sent to every websocket client, served under `outbound` on GET /api/metrics."""
+
+    def __init__(self):
+        # Messages handed to Outbound, and websocket frames they went out in
+        self.messages = 0
+        self.frames = 0
+        self.envelopes = 0
+        self.enveloped_commands = 0
+        self.dropped_audio_frames = 0
+        self.dropped_audio_bytes = 0
+        self.full = 0
+        # Frames of interrupted turns that were never sent
+        self.discarded = 0
+        # Control frames sent ahead of bulk frames queued before them
+        self.overtakes = 0
+        self.text_only = 0
+        self.disconnects = 0
+        self.errors = 0
+        self._connections: "weakref.WeakSet[Outbound]" = weakref.WeakSet()
+        metrics.register("outbound", self.stats)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slow_client_policy": SLOW_CLIENT_POLICY,
+            "priority_lanes": PRIORITY_LANES,
+            "messages": self.messages,
+            "frames": self.frames,
+            "envelopes": self.envelopes,
+            "enveloped_commands": self.enveloped_commands,
+            "avg_commands_per_envelope": round(self.enveloped_commands / self.envelopes, 2) if self.envelopes else None,
+            # Times a queue was full, and what the slow client policy did about it
+            "full": self.full,
+            "overtakes": self.overtakes,
+            "discarded": self.discarded,
+            "dropped_audio_frames": self.dropped_audio_frames,
+            "dropped_audio_bytes": self.dropped_audio_bytes,
+            "text_only": self.text_only,
+            "disconnects": self.disconnects,
+            "errors": self.errors,
+            "connections": [outbound.stats() for outbound in list(self._connections)],
+        }
+
+
+outbound_stats = OutboundStats()
+
+
+class Outbound:
+    """
+    Everything a LearningInterface sends to its client goes through here.
+
+    Messages are put in a bounded queue that a sender task of the connection drains, so a slow client does
+    not hold up the turn that produces them. With `priority_lanes` (protocol 2, see PRIORITY_LANES) the queue
+    has two lanes, each sent in order: bulk, for the audio frames of speech commands, and control,
+    for everything else (every command message, pong, errors, ...). Control frames go first, so a question or an
+    error does not wait behind the audio of an earlier utterance, while commands, and the frames of an utterance,
+    keep their order. Without lanes everything goes in the control lane. When the queue is full (QUEUE_SIZE frames or QUEUE_MAX_BYTES),
+    SLOW_CLIENT_POLICY decides: wait for room, drop the queued audio, go text-only, or disconnect.
+
+    With command batching (negotiated per connection, see `FEATURE_COMMAND_BATCHES`), `send_command` does
+    not queue right away: the commands of a lane that become ready in the same event loop tick (e.g. the
+    student points, whiteboard and acknowledgement parsed from one LLM delta) go out as one frame
+        {"type": "commands", "commands": [<command message>, ...]}
+    A batch is queued on the next tick (or after BATCH_MAX_DELAY_MS), as soon as it reaches BATCH_MAX_COMMANDS
+    or BATCH_MAX_BYTES, and before anything else is queued, so batching does not reorder anything. A batch
+    of a single command is sent as the plain command message.
+    """
+
+    def __init__(self, websocket: WebSocket, connection_id: str = "", throughput: Optional[Throughput] = None):
+        self.websocket = websocket
+        self.connection_id = connection_id
+        # Measured on the audio the sender task sends, see AudioChunker
+        self.throughput = throughput or Throughput()
+        self.batching = False
+        # Set once the client negotiated protocol 2, see PRIORITY_LANES
+        self.priority_lanes = False
+        # Set by the text_only policy: audio is no longer sent
+        self.text_only = False
+        # Per lane: encoded command messages, with their sequence ids
+        self._batches: List[List[Tuple[str, Optional[int]]]] = [[], []]
+        self._batch_bytes = [0, 0]
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lanes: List[Deque[_Frame]] = [deque(), deque()]
+        self.queued_bytes = 0
+        self.max_queue_depth = 0
+        self._not_empty = asyncio.Event()
+        self._room = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self._error: Optional[Exception] = None
+        self.frames_sent = 0
+        self.send_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        outbound_stats._connections.add(self)
+
+    def _lane(self, bulk: bool) -> int:
+        return BULK if bulk and self.priority_lanes else CONTROL
+
+    async def send_json(self, message: Dict[str, Any], audio: bool = False) -> None:
+        """Queue a message. `audio`: it carries the audio of an utterance, which a slow client may not get."""
+        outbound_stats.messages += 1
+        await self._put(_Frame(_encode(message), self._lane(audio), audio, turn=audio))
+
+    async def send_bytes(self, data: Union[bytes, bytearray], audio: bool = False, keep: Optional[bytes] = None, seq: Optional[int] = None) -> None:
+        """Queue a binary frame of an utterance. `keep`: what to send instead if the audio is dropped."""
+        outbound_stats.messages += 1
+        await self._put(_Frame(data, self._lane(True), audio, keep, turn=True, seq=seq))
+
+    async def send_command(self, message: Dict[str, Any], seq: Optional[int] = None) -> None:
+        """Send a command message, batched with the other commands of this tick when batching is on."""
+        lane = CONTROL
+        if not self.batching:
+            outbound_stats.messages += 1
+            await self._put(_Frame(_encode(message), lane, turn=True, seq=seq))
+            return
+        self._check()
+        outbound_stats.messages += 1
+        encoded = _encode(message)
+        self._batches[lane].append((encoded, seq))
+        self._batch_bytes[lane] += len(encoded)
+        if len(self._batches[lane]) >= BATCH_MAX_COMMANDS or self._batch_bytes[lane] >= BATCH_MAX_BYTES:
+            self._queue_batches()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        if BATCH_MAX_DELAY_MS > 0:
+            await asyncio.sleep(BATCH_MAX_DELAY_MS / 1000)
+        self._flush_task = None
+        self._queue_batches()
+
+    def _queue_batches(self) -> None:
+        # Queued whether or not there is room, ahead of whatever waits for room
+        if self._error is not None:
+            return
+        for lane, batch in enumerate(self._batches):
+            if not batch:
+                continue
+            self._batches[lane] = []
+            self._batch_bytes[lane] = 0
+            if len(batch) == 1:
+                frame = batch[0][0]
+            else:
+                frame = '{"type":"commands","commands":[' + ",".join(encoded for encoded, _ in batch) + "]}"
+                outbound_stats.envelopes += 1
+                outbound_stats.enveloped_commands += len(batch)
+            seqs = [seq for _, seq in batch if seq is not None]
+            self._append(_Frame(frame, lane, turn=True, seq=min(seqs) if seqs else None))
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise SlowClientError(str(self._error))
+
+    def queue_depth(self) -> int:
+        return len(self._lanes[CONTROL]) + len(self._lanes[BULK])
+
+    def _full(self) -> bool:
+        return self.queue_depth() >= QUEUE_SIZE or self.queued_bytes >= QUEUE_MAX_BYTES
+
+    async def _put(self, frame: _Frame) -> None:
+        self._check()
+        self._queue_batches()
+        while True:
+            if frame.audio and self.text_only:
+                if frame.keep is None:
+                    self._dropped(frame)
+                    return
+                frame = frame.kept()
+            if not self._full():
+                break
+            outbound_stats.full += 1
+            if SLOW_CLIENT_POLICY == "disconnect":
+                await self._disconnect()
+            elif SLOW_CLIENT_POLICY in ("drop_audio", "text_only") and self._drop_audio():
+                if SLOW_CLIENT_POLICY == "text_only" and not self.text_only:
+                    logger.warning(f"Client {self.connection_id} is too slow, sending text only")
+                    self.text_only = True
+                    outbound_stats.text_only += 1
+            else:
+                self._room.clear()
+                await self._room.wait()
+            self._check()
+        self._append(frame)
+
+    def _append(self, frame: _Frame) -> None:
+        self._lanes[frame.lane].append(frame)
+        self.queued_bytes += len(frame.data)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+        self._not_empty.set()
+        if self._sender is None:
+            self._sender = asyncio.ensure_future(self._send_loop())
+
+    def _dropped(self, frame: _Frame) -> None:
+        outbound_stats.dropped_audio_frames += 1
+        outbound_stats.dropped_audio_bytes += len(frame.data)
+
+    def _drop_audio(self) -> bool:
+        """Drop the queued audio (keeping the end markers). Returns whether that made any room."""
+        kept: Deque[_Frame] = deque()
+        freed = 0
+        lane = self._lane(True)
+        for frame in self._lanes[lane]:
+            if not frame.audio:
+                kept.append(frame)
+                continue
+            self._dropped(frame)
+            freed += len(frame.data)
+            if frame.keep is not None:
+                kept.append(frame.kept())
+                freed -= len(frame.keep)
+        self._lanes[lane] = kept
+        self.queued_bytes -= freed
+        return not self._full()
+
+    def discard_turn(self) -> Set[int]:
+        """
+        Drop the commands and audio that are queued or batched and not sent yet, because their turn was
+        interrupted. Other messages stay. Returns the sequence ids of the commands dropped.
+        """
+        seqs = set()
+        for index, lane in enumerate(self._lanes):
+            kept: Deque[_Frame] = deque()
+            for frame in lane:
+                if not frame.turn:
+                    kept.append(frame)
+                    continue
+                outbound_stats.discarded += 1
+                self.queued_bytes -= len(frame.data)
+                if frame.seq is not None:
+                    seqs.add(frame.seq)
+            self._lanes[index] = kept
+        for batch in self._batches:
+            outbound_stats.discarded += len(batch)
+            seqs.update(seq for _, seq in batch if seq is not None)
+        self._batches = [[], []]
+        self._batch_bytes = [0, 0]
+        self._room.set()
+        return seqs
+
+    async def _disconnect(self) -> None:
+        logger.warning(f"Client {self.connection_id} is too slow, disconnecting")
+        outbound_stats.disconnects += 1
+        self._error = SlowClientError("Client too slow")
+        self.close()
+        try:
+            await self.websocket.close(code=SLOW_CLIENT_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def _send_loop(self) -> None:
+        while True:
+            while not self.queue_depth():
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            control, bulk = self._lanes
+            if control:
+                frame = control.popleft()
+                if bulk and bulk[0].queued < frame.queued:
+                    outbound_stats.overtakes += 1
+            else:
+                frame = bulk.popleft()
+            self.queued_bytes -= len(frame.data)
+            self._room.set()
+            started = time.perf_counter()
+            try:
+                if isinstance(frame.data, str):
+                    await self.websocket.send_text(frame.data)
+                else:
+                    await self.websocket.send_bytes(frame.data)
+            except Exception as e:
+                outbound_stats.errors += 1
+                logger.error(f"Error sending to client {self.connection_id}: {str(e)}")
+                self._error = e
+                self._room.set()
+                self._clear()
+                return
+            seconds = time.perf_counter() - started
+            self.frames_sent += 1
+            self.send_seconds += seconds
+            self.queue_wait_seconds += started - frame.queued
+            outbound_stats.frames += 1
+            if frame.audio:
+                self.throughput.record(len(frame.data), seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connection_id": self.connection_id,
+            "queue_depth": {lane: len(self._lanes[index]) for index, lane in enumerate(LANES)},
+            "queued_bytes": self.queued_bytes,
+            "max_queue_depth": self.max_queue_depth,
+            "frames_sent": self.frames_sent,
+            "avg_send_ms": round(self.send_seconds / self.frames_sent * 1000, 3) if self.frames_sent else None,
+            # Time from queueing a frame to starting to send it
+            "avg_queue_wait_ms": round(self.queue_wait_seconds / self.frames_sent * 1000, 3) if self.frames_sent else None,
+            "text_only": self.text_only,
+        }
+
+    def _clear(self) -> None:
+        self._batches = [[], []]
+        self._batch_bytes = [0, 0]
+        for lane in self._lanes:
+            lane.clear()
+        self.queued_bytes = 0
+
+    def close(self) -> None:
+        """The client is gone: what is still queued or batched cannot be delivered."""
+        for task in (self._flush_task, self._sender):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        self._flush_task = None
+        self._sender = None
+        self._clear()
+        # Wakes whoever waits for room, to find the connection closed
+        if self._error is None:
+            self._error = SlowClientError("Connection closed")
+        self._room.set()
+        outbound_stats._connections.discard(self)
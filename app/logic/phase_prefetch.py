@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.dao.db import Db
+from app.logic.turn_pipeline import _close_stream
+from app.models.course import Command, CommandType
+from app.models.session import Session, SessionProgress
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Prefetching of the next content phase, on by default
+ENABLED = os.environ.get("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# Audio and game code held by the prefetchers of the whole process, in bytes
+MEMORY_BUDGET = int(os.environ.get("PREFETCH_MEMORY_BUDGET", 32 * 1024 * 1024))
+# Prefetched audio is replayed in chunks of this size, like a synthesis stream
+REPLAY_CHUNK_SIZE = 4096
+
+SPEECH_COMMANDS = [CommandType.TEACHER_SPEECH, CommandType.CLASSMATE_SPEECH]
+
+
+class PrefetchStats:
+    """Counters of every prefetcher of the process, served under `prefetch` on GET /api/metrics."""
+
+    def __init__(self):
+        # Bytes held right now, against MEMORY_BUDGET
+        self.bytes = 0
+        self.phases = 0
+        self.hits = 0
+        self.misses = 0
+        # Items prefetched and never used, e.g. when the session ended or went elsewhere
+        self.waste = 0
+        self.wasted_bytes = 0
+        self.over_budget = 0
+        self.cancelled = 0
+        self.errors = 0
+        metrics.register("prefetch", self.stats)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": ENABLED,
+            "bytes": self.bytes,
+            "memory_budget": MEMORY_BUDGET,
+            "phases": self.phases,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else None,
+            "waste": self.waste,
+            "wasted_bytes": self.wasted_bytes,
+            "over_budget": self.over_budget,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+        }
+
+
+prefetch_stats = PrefetchStats()
+
+
+async def _replay(audio: bytes) -> AsyncIterator[bytes]:
+    for start in range(0, len(audio), REPLAY_CHUNK_SIZE):
+        yield audio[start:start + REPLAY_CHUNK_SIZE]
+
+
+class PhasePrefetcher:
+    """
+    Warms the next phase of a connection's session while the student is still in the current one.
+
+    The commands of a content phase are static, so once a phase has started, the audio of the next
+    phase's speech commands and the code of its games are fetched in the background (`schedule`). When
+    that phase starts, its commands are executed between `use` and `release`, and `audio` and `game_code`
+    serve what was prefetched; anything else is a miss, fetched as usual. What was prefetched and not
+    used is dropped and counted as waste, also when the prefetch is cancelled (`cancel`, when the session
+    ends or the connection closes).
+
+    Entries are keyed by content (text and voice, game id), so the commands need no identity of their own.
+    All prefetchers share MEMORY_BUDGET: audio that would exceed it is not prefetched.
+    """
+
+    def __init__(self, db: Db, synthesize: Callable[[str, str], Awaitable[AsyncIterator[bytes]]]):
+        self.db = db
+        self.synthesize = synthesize
+        self._key: Optional[Tuple[str, int, int, int]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._audio: Dict[Tuple[str, str], bytes] = {}
+        self._games: Dict[str, str] = {}
+        # Set while the prefetched phase is executed
+        self._in_use = False
+
+    @staticmethod
+    def phase_key(session_id: str, progress: SessionProgress) -> Tuple[str, int, int, int]:
+        return session_id, progress.topic_id, progress.module_id, progress.phase_id or 0
+
+    def schedule(self, session: Session, progress: SessionProgress, commands: List[Command]) -> None:
+        """Start prefetching the content commands of the phase at `progress`, dropping an earlier prefetch."""
+        self.cancel()
+        if not ENABLED:
+            return
+        self._key = self.phase_key(session.id, progress)
+        prefetch_stats.phases += 1
+        self._task = asyncio.ensure_future(self._warm(session, [command.model_copy(deep=True) for command in commands]))
+
+    async def _warm(self, session: Session, commands: List[Command]) -> None:
+        try:
+            for command in commands:
+                if command.command_type == CommandType.GAME and command.payload.game_id not in self._games:
+                    code = self.db.get_game(command.payload.game_id).code
+                    self._games[command.payload.game_id] = code
+                    prefetch_stats.bytes += len(code or "")
+                elif command.command_type in SPEECH_COMMANDS:
+                    voice_id = session.teacher.voice_id if command.command_type == CommandType.TEACHER_SPEECH else session.classmate.voice_id
+                    key = (command.payload.text, voice_id)
+                    if key in self._audio:
+                        continue
+                    audio = bytearray()
+                    chunks = await self.synthesize(command.payload.text, voice_id)
+                    try:
+                        async for chunk in chunks:
+                            audio += chunk
+                            if prefetch_stats.bytes + len(audio) > MEMORY_BUDGET:
+                                # The rest of the phase is fetched when it is executed
+                                prefetch_stats.over_budget += 1
+                                return
+                    finally:
+                        # Abandoned over budget or cancelled: the provider stream must not stay open
+                        await _close_stream(chunks)
+                    self._audio[key] = bytes(audio)
+                    prefetch_stats.bytes += len(audio)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            prefetch_stats.errors += 1
+            logger.warning(f"Prefetch of the next phase failed: {str(e)}")
+
+    def use(self, session_id: str, progress: SessionProgress) -> None:
+        """
+        The phase at `progress` starts: serve what was prefetched for it until `release`. A prefetch of
+        another phase is dropped, one still running is stopped and what it has so far is used.
+        """
+        if self._key != self.phase_key(session_id, progress):
+            self.cancel()
+        elif self._task is not None:
+            if not self._task.done():
+                prefetch_stats.cancelled += 1
+                self._task.cancel()
+            self._task = None
+        self._in_use = True
+
+    def release(self) -> None:
+        self._in_use = False
+        self.cancel()
+
+    def cancel(self) -> None:
+        """Stop prefetching and drop what was prefetched and not used."""
+        if self._task is not None and not self._task.done():
+            prefetch_stats.cancelled += 1
+            self._task.cancel()
+        self._task = None
+        self._key = None
+        for item in list(self._audio.values()) + list(self._games.values()):
+            prefetch_stats.waste += 1
+            prefetch_stats.wasted_bytes += len(item or "")
+            prefetch_stats.bytes -= len(item or "")
+        self._audio = {}
+        self._games = {}
+
+    def audio(self, text: str, voice_id: str) -> Optional[Awaitable[AsyncIterator[bytes]]]:
+        """The prefetched audio of a speech command, as a synthesis stream would return it, or None."""
+        if not self._in_use:
+            return None
+        audio = self._audio.pop((text, voice_id), None)
+        if audio is None:
+            prefetch_stats.misses += 1
+            return None
+        prefetch_stats.hits += 1
+        prefetch_stats.bytes -= len(audio)
+
+        async def stream():
+            return _replay(audio)
+
+        return stream()
+
+    def game_code(self, game_id: str) -> Optional[str]:
+        if not self._in_use:
+            return None
+        if game_id not in self._games:
+            prefetch_stats.misses += 1
+            return None
+        code = self._games.pop(game_id)
+        prefetch_stats.hits += 1
+        prefetch_stats.bytes -= len(code or "")
+        return code
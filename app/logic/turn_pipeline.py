@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import os
+import time
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.logic.command_parser import CommandParser
+from app.models.course import Command
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Items each queue between two stages holds before the stage feeding it waits
+QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 16))
+# Speech commands whose audio is synthesized while an earlier one is still being sent
+TTS_AHEAD = int(os.environ.get("PIPELINE_TTS_AHEAD", 2))
+# Audio chunks buffered per utterance before its synthesis waits for the sender
+AUDIO_QUEUE_CHUNKS = int(os.environ.get("PIPELINE_AUDIO_QUEUE_CHUNKS", 64))
+
+STAGES = ["reader", "parser", "enrich", "tts", "sender"]
+_DONE = object()
+
+
+async def _close_stream(stream) -> None:
+    """Close a provider stream (OpenAI stream, or async generator of ElevenLabs audio) that is abandoned."""
+    close = getattr(stream, "close", None) if not hasattr(stream, "aclose") else stream.aclose
+    if close is None:
+        return
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception as e:
+        logger.warning(f"Error closing stream: {str(e)}")
+
+
+def _discard(speech: Awaitable[Any]) -> None:
+    """A synthesis that is cancelled before it started never will."""
+    if asyncio.iscoroutine(speech):
+        speech.close()
+
+
+class PipelineStats:
+    """Counters of every turn pipeline of the process, served under `pipeline` on GET /api/metrics."""
+
+    def __init__(self):
+        self.items = {stage: 0 for stage in STAGES}
+        self.service_seconds = {stage: 0.0 for stage in STAGES}
+        self.max_queue_depth = {stage: 0 for stage in STAGES}
+        self.turns = 0
+        # Turns cut short by the student (barge-in)
+        self.interrupted = 0
+        self.turn_seconds = 0.0
+        self.first_audio_turns = 0
+        self.first_audio_seconds = 0.0
+        self._running: "weakref.WeakSet[TurnPipeline]" = weakref.WeakSet()
+        metrics.register("pipeline", self.stats)
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.items[stage] += 1
+        self.service_seconds[stage] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        depths = {stage: 0 for stage in STAGES}
+        for pipeline in list(self._running):
+            for stage, queue in pipeline.queues.items():
+                depths[stage] += queue.qsize()
+        return {
+            "running": len(self._running),
+            "turns": self.turns,
+            "interrupted": self.interrupted,
+            "avg_turn_ms": round(self.turn_seconds / self.turns * 1000, 2) if self.turns else None,
+            "avg_time_to_first_audio_ms": round(self.first_audio_seconds / self.first_audio_turns * 1000, 2) if self.first_audio_turns else None,
+            "stages": {
+                stage: {
+                    "items": self.items[stage],
+                    "avg_service_ms": round(self.service_seconds[stage] / self.items[stage] * 1000, 3) if self.items[stage] else None,
+                    # Items waiting in front of the stage, now and at most
+                    "queue_depth": depths[stage],
+                    "max_queue_depth": self.max_queue_depth[stage],
+                }
+                for stage in STAGES
+            },
+        }
+
+
+pipeline_stats = PipelineStats()
+
+
+class AudioStream:
+    """
+    Audio chunks of one utterance, synthesized in the background into a bounded queue and read by the
+    sender as an async iterator. `backlog` is the number of bytes synthesized and not read yet.
+    """
+
+    def __init__(self):
+        self.chunks: asyncio.Queue = asyncio.Queue(AUDIO_QUEUE_CHUNKS)
+        self.backlog = 0
+
+    async def put(self, chunk: Any) -> None:
+        """Queue a chunk of audio, an exception the synthesis failed with, or _DONE."""
+        await self.chunks.put(chunk)
+        if isinstance(chunk, (bytes, bytearray)):
+            self.backlog += len(chunk)
+
+    def __aiter__(self) -> "AudioStream":
+        return self
+
+    async def __anext__(self) -> bytes:
+        chunk = await self.chunks.get()
+        if chunk is _DONE:
+            raise StopAsyncIteration
+        if isinstance(chunk, Exception):
+            raise chunk
+        self.backlog -= len(chunk)
+        return chunk
+
+
+class TurnPipeline:
+    """
+    One turn (a streamed LLM response, or the static commands of a phase) run as stages connected by
+    bounded queues, each stage a task of its own:
+
+        reader -> parser -> enrich -> tts -> sender
+
+    reader pulls text deltas off the OpenAI stream, parser turns them into commands, enrich fills in what
+    comes from the Db (game code), tts starts the audio synthesis of speech commands, and sender delivers
+    commands to the client. The LLM stream keeps being read while audio is synthesized and sent, and up
+    to TTS_AHEAD utterances are synthesized ahead of the one being sent. The sender takes commands in the
+    order they were parsed and finishes each (all of its audio) before the next, so delivery order is
+    exactly the one of the response. A full queue holds the stage before it back, all the way to the LLM.
+
+    `enrich(command)` prepares a command. `synthesize(command)` returns None for commands without audio,
+    and for speech commands an awaitable of the stream of audio bytes, which is awaited in the background.
+    `send(command, audio)` delivers a command, with the AudioStream of its audio chunks (None without
+    audio). A failure of one command goes to `on_error(command, exception)` and the turn goes on with
+    the next command.
+    """
+
+    def __init__(
+        self,
+        enrich: Callable[[Command], None],
+        synthesize: Callable[[Command], Optional[Awaitable[AsyncIterator[bytes]]]],
+        send: Callable[[Command, Optional[AudioStream]], Awaitable[None]],
+        on_error: Callable[[Command, Exception], Awaitable[None]],
+    ):
+        self.enrich = enrich
+        self.synthesize = synthesize
+        self.send = send
+        self.on_error = on_error
+        # Queue in front of each stage (the reader reads the LLM stream)
+        self.queues: Dict[str, asyncio.Queue] = {stage: asyncio.Queue(QUEUE_SIZE) for stage in STAGES[1:]}
+        # Utterances being synthesized: the one being sent and up to TTS_AHEAD after it
+        self._synthesis_slots = asyncio.Semaphore(TTS_AHEAD + 1)
+        self.response_id: Optional[str] = None
+        self._audio_tasks: List[asyncio.Task] = []
+        self._started = 0.0
+        self._first_audio = False
+
+    async def run_response(self, response_stream) -> Optional[str]:
+        """Run a turn from a streamed OpenAI response. Returns the response id."""
+        await self._run([self._read(response_stream), self._parse()])
+        return self.response_id
+
+    async def run_commands(self, commands: List[Command]) -> None:
+        """Run a turn of already parsed commands (e.g. the static content of a phase)."""
+
+        async def feed():
+            for command in commands:
+                await self._put("enrich", command)
+            await self._put("enrich", _DONE)
+
+        await self._run([feed()])
+
+    async def _run(self, producers: List[Awaitable[None]]) -> None:
+        self._started = time.perf_counter()
+        pipeline_stats._running.add(self)
+        tasks = [asyncio.ensure_future(producer) for producer in producers]
+        tasks += [asyncio.ensure_future(self._enrich()), asyncio.ensure_future(self._tts()), asyncio.ensure_future(self._sender())]
+        try:
+            # The first failure (e.g. of the LLM stream) stops the whole turn
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks + self._audio_tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, *self._audio_tasks, return_exceptions=True)
+            pipeline_stats._running.discard(self)
+            pipeline_stats.turns += 1
+            pipeline_stats.turn_seconds += time.perf_counter() - self._started
+
+    async def _put(self, stage: str, item: Any) -> None:
+        queue = self.queues[stage]
+        await queue.put(item)
+        if queue.qsize() > pipeline_stats.max_queue_depth[stage]:
+            pipeline_stats.max_queue_depth[stage] = queue.qsize()
+
+    async def _read(self, response_stream) -> None:
+        iterator = response_stream.__aiter__()
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    event = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                pipeline_stats.record("reader", time.perf_counter() - started)
+                if event.type == "response.created":
+                    self.response_id = event.response.id
+                elif event.type == "response.output_text.delta":
+                    await self._put("parser", event.delta)
+                elif event.type == "response.completed":
+                    logger.info("Response completed")
+        except asyncio.CancelledError:
+            # Closing the connection ends the response, so an interrupted turn stops using tokens right away
+            await _close_stream(response_stream)
+            raise
+        await self._put("parser", _DONE)
+
+    async def _parse(self) -> None:
+        command_parser = CommandParser()
+        while True:
+            delta = await self.queues["parser"].get()
+            if delta is _DONE:
+                break
+            started = time.perf_counter()
+            command_parser.add(delta)
+            commands = command_parser.parse()
+            pipeline_stats.record("parser", time.perf_counter() - started)
+            for command in commands:
+                await self._put("enrich", command)
+        await self._put("enrich", _DONE)
+
+    async def _enrich(self) -> None:
+        while True:
+            command = await self.queues["enrich"].get()
+            if command is _DONE:
+                break
+            started = time.perf_counter()
+            error = None
+            try:
+                self.enrich(command)
+            except Exception as e:
+                # Reported by the sender, in the position of the command
+                error = e
+            pipeline_stats.record("enrich", time.perf_counter() - started)
+            await self._put("tts", (command, error))
+        await self._put("tts", _DONE)
+
+    async def _tts(self) -> None:
+        while True:
+            item = await self.queues["tts"].get()
+            if item is _DONE:
+                break
+            command, error = item
+            started = time.perf_counter()
+            speech = self.synthesize(command) if error is None else None
+            if speech is not None:
+                # Waits while TTS_AHEAD utterances are synthesized ahead of the sender
+                try:
+                    await self._synthesis_slots.acquire()
+                except asyncio.CancelledError:
+                    _discard(speech)
+                    raise
+                started = time.perf_counter()
+            audio = self._start_synthesis(speech) if speech is not None else None
+            pipeline_stats.record("tts", time.perf_counter() - started)
+            await self._put("sender", (command, audio, error))
+        await self._put("sender", _DONE)
+
+    def _start_synthesis(self, speech: Awaitable[AsyncIterator[bytes]]) -> AudioStream:
+        """Synthesize audio in the background into an AudioStream."""
+        stream = AudioStream()
+
+        async def pump():
+            chunks = None
+            try:
+                chunks = await speech
+                async for chunk in chunks:
+                    await stream.put(chunk)
+                await stream.put(_DONE)
+            except asyncio.CancelledError:
+                if chunks is None:
+                    _discard(speech)
+                else:
+                    await _close_stream(chunks)
+                raise
+            except Exception as e:
+                # Raised in the sender, where the command fails
+                await stream.put(e)
+
+        self._audio_tasks.append(asyncio.ensure_future(pump()))
+        return stream
+
+    def audio_sent(self) -> None:
+        """Called by `send` whenever it sent audio, for the time to first audio of the turn."""
+        if not self._first_audio:
+            self._first_audio = True
+            pipeline_stats.first_audio_turns += 1
+            pipeline_stats.first_audio_seconds += time.perf_counter() - self._started
+
+    async def _sender(self) -> None:
+        while True:
+            item = await self.queues["sender"].get()
+            if item is _DONE:
+                break
+            command, audio, error = item
+            started = time.perf_counter()
+            try:
+                if error is not None:
+                    raise error
+                await self.send(command, audio)
+            except Exception as e:
+                await self.on_error(command, e)
+            finally:
+                if audio is not None:
+                    self._synthesis_slots.release()
+                pipeline_stats.record("sender", time.perf_counter() - started)
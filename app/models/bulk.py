@@ -0,0 +1,16 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class BulkRecordResult(BaseModel):
+    # Position of the record in the request
+    index: int
+    id: Optional[str] = None
+    ok: bool
+    error: Optional[str] = None
+
+
+class BulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkRecordResult]
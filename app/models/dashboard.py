@@ -5,7 +5,8 @@ from pydantic import BaseModel
 
 
 class SkillStats(BaseModel):
-    mastery_score: float
+    # None for sessions that had no questions
+    mastery_score: Optional[float] = None
     retention_score: Optional[float] = None
     critical_thinking_score: Optional[float] = None
     problem_solving_score: Optional[float] = None
@@ -1,7 +1,7 @@
 from datetime import datetime
 from enum import Enum
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from app.models.character import Character
 from app.models.dashboard import SessionStats
@@ -22,7 +22,16 @@ class SessionStatus(str, Enum):
     COMPLETED = "COMPLETED"
     NOT_STARTED = "NOT_STARTED"
 
+class CreateSessionRequest(BaseModel):
+    user_id: str
+    course_id: str
+    topic_id: Optional[int] = None
+    module_id: Optional[int] = None
+    phase_id: Optional[int] = None
+    characters: Optional[List[str]] = None
+
 class Session(BaseModel):
+    """A learning session. Its events are not part of the session document, see Db.events."""
     id: str
     user_id: str
     course_id: str
@@ -34,8 +43,9 @@ class Session(BaseModel):
     system_instructions: Optional[str] = None
     session_stats: Optional[SessionStats] = None
     created_at: Optional[datetime] = None
-    event_logs: Optional[List[Event]] = []
+    # Time of the last heartbeat (ping), and the seconds spent per day folded from the heartbeats, see LiveSession.heartbeat
     last_alive_timestamp: Optional[datetime] = None
+    time_spent_per_day: Optional[Dict[str, float]] = None
     # Teacher character name
     teacher: Optional[Character] = None
     # Classmate character name
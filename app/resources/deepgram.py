@@ -2,7 +2,6 @@ import base64
 from functools import cache
 import io
 import os
-from deepgram import PrerecordedOptions, DeepgramClient, FileSource
 
 
 """
@@ -21,6 +20,8 @@ class DeepgramResource:
 
     def __new__(cls):
         if cls._instance is None:
+            # The SDK is imported on first use rather than at startup, it is slow to import
+            from deepgram import DeepgramClient
             cls._instance = super(DeepgramResource, cls).__new__(cls)
             cls._deepgram = DeepgramClient(api_key=os.environ.get("DEEPGRAM_API_KEY"))
         return cls._instance
@@ -32,6 +33,7 @@ class DeepgramResource:
                 audio_bytes = base64.b64decode(audio_bytes)
         else:
             return None
+        from deepgram import PrerecordedOptions, FileSource
         payload: FileSource = {
             "buffer": audio_bytes,
         }
@@ -45,8 +47,5 @@ class DeepgramResource:
         return response.results.channels[0].alternatives[0].transcript
 
 
-deepgram_resource = DeepgramResource()
-
-
 async def transcribe_audio(audio_bytes: bytes):
-    return await deepgram_resource.transcribe_audio(audio_bytes)
+    return await DeepgramResource().transcribe_audio(audio_bytes)
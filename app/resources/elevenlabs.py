@@ -1,5 +1,4 @@
 import os
-from elevenlabs.client import AsyncElevenLabs
 
 
 class ElevenLabsResource:
@@ -8,6 +7,8 @@ class ElevenLabsResource:
 
     def __new__(cls):
         if cls._instance is None:
+            # The SDK is imported on first use rather than at startup, it is slow to import
+            from elevenlabs.client import AsyncElevenLabs
             cls._instance = super(ElevenLabsResource, cls).__new__(cls)
             cls._eleven = AsyncElevenLabs(api_key=os.environ.get("ELEVENLABS_API_KEY"))
         return cls._instance
@@ -32,11 +33,8 @@ class ElevenLabsResource:
             output_format="mp3_44100_128"
         )
 
-elevenlabs_resource = ElevenLabsResource()
-
-
 async def generate_speech(text: str, voice_id: str):
-    async_iterator = await elevenlabs_resource.generate_speech(text, voice_id)
+    async_iterator = await ElevenLabsResource().generate_speech(text, voice_id)
     audio_bytes = b""
     async for chunk in async_iterator:
         audio_bytes += chunk
@@ -44,4 +42,4 @@ async def generate_speech(text: str, voice_id: str):
 
 
 async def create_speech_stream(text: str, voice_id: str):
-    return await elevenlabs_resource.generate_speech_stream(text, voice_id)
+    return await ElevenLabsResource().generate_speech_stream(text, voice_id)
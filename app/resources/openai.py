@@ -8,14 +8,18 @@ from typing import Dict, Any, Optional
 import os
 import io
 
-import openai
-from openai import AsyncOpenAI
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 
+def _is_retryable(exception: BaseException) -> bool:
+    # Only called once a client exists, so the SDK is already imported
+    import openai
+    return isinstance(exception, (openai.APIError, openai.APIConnectionError, openai.RateLimitError))
+
+
 class OpenAIResource:
     """Singleton OpenAI service for chat completions and other AI features"""
     _instance = None
@@ -23,6 +27,8 @@ class OpenAIResource:
     
     def __new__(cls):
         if cls._instance is None:
+            # The SDK is imported on first use rather than at startup, it is slow to import
+            from openai import AsyncOpenAI
             cls._instance = super(OpenAIResource, cls).__new__(cls)
             cls._client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
         return cls._instance
@@ -53,7 +59,7 @@ class OpenAIResource:
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((openai.APIError, openai.APIConnectionError, openai.RateLimitError))
+        retry=retry_if_exception(_is_retryable)
     )
     async def create_response(
         self,
@@ -92,12 +98,9 @@ class OpenAIResource:
             logger.error(f"Error creating response: {e}")
             raise
 
-# Create a singleton instance for easier imports
-openai_resource = OpenAIResource()
-
 async def transcribe_audio(audio_bytes: bytes):
     """Transcribe audio using OpenAI's API"""
-    response = await openai_resource.transcribe_audio(audio_bytes)
+    response = await OpenAIResource().transcribe_audio(audio_bytes)
     return response
 
 async def create_response(
@@ -113,7 +116,7 @@ async def create_response(
     """
     Create a response using OpenAI's API
     """
-    response = await openai_resource.create_response(
+    response = await OpenAIResource().create_response(
         message=message,
         model=model,
         previous_response_id=previous_response_id,
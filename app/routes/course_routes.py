@@ -1,6 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Body, HTTPException
 
 from app.dao.db import Db
+from app.logic.bulk import record_id, summarize, validate_records
+from app.models.bulk import BulkRecordResult, BulkResult
 from app.models.course import Course, CourseTopic, Module
 
 router = APIRouter(prefix="/api/courses", tags=["courses"])
@@ -17,14 +21,15 @@ async def get_course(course_id: str):
         Course: The course object
     """
     db = Db.get_instance()
+    course = db.get_course(course_id)
     
-    if course_id not in db.courses:
+    if course is None:
         raise HTTPException(
             status_code=404,
             detail=f"Course with id '{course_id}' not found"
         )
     
-    return Course(**db.courses[course_id])
+    return course
 
 
 @router.get("/")
@@ -98,3 +103,26 @@ async def update_course(course_id: str, course: Course):
     db = Db.get_instance()
     db.update_course(course_id, course.model_dump())
     return course
+
+
+@router.post("/bulk", response_model=BulkResult)
+async def update_courses(records: List[Dict[str, Any]] = Body(...)) -> BulkResult:
+    """
+    Create or replace many courses at once. Every record is validated on its own, invalid ones are reported
+    and skipped, and the valid ones are written with a single persistence flush.
+    """
+    db = Db.get_instance()
+    results = []
+    courses = {}
+    for index, (course, error) in enumerate(await validate_records(Course, records)):
+        if error is None and course["id"] in courses:
+            error = "Duplicate id in batch"
+        if error is not None:
+            results.append(BulkRecordResult(index=index, id=record_id(records[index]), ok=False, error=error))
+            continue
+        courses[course["id"]] = course
+        results.append(BulkRecordResult(index=index, id=course["id"], ok=True))
+    if courses:
+        db.update_courses(courses)
+        await db.flush()
+    return summarize(results)
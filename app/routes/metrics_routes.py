@@ -0,0 +1,10 @@
+from typing import Any, Dict
+from fastapi import APIRouter
+from app.utils.metrics import metrics
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("/")
+async def get_metrics() -> Dict[str, Any]:
+    return metrics.snapshot()
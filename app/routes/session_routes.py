@@ -1,43 +1,22 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from fastapi import APIRouter, Body, HTTPException
+from typing import Dict, Any, List
 import uuid
 from datetime import datetime
 
 from app.dao.db import Db
+from app.logic.bulk import summarize, validate_records
+from app.models.bulk import BulkRecordResult, BulkResult
 from app.models.character import CharacterRole
-from app.models.session import Session, SessionStatus
+from app.models.session import CreateSessionRequest, Session, SessionStatus
 
 router = APIRouter(prefix="/api/sessions", tags=["sessions"])
 
-class CreateSessionRequest(BaseModel):
-    user_id: str
-    course_id: str
-    topic_id: Optional[int] = None
-    module_id: Optional[int] = None
-    phase_id: Optional[int] = None
-    characters: Optional[List[str]] = None
 
-
-@router.post("/", response_model=Session)
-async def create_session(request: CreateSessionRequest):
-    """
-    Create a new learning session for a user and course.
-    
-    Args:
-        request: Contains user_id and course_id
-        
-    Returns:
-        SessionResponse: The created session object
-    """
-    db = Db.get_instance()
-    
+def new_session(db: Db, request: CreateSessionRequest) -> Dict[str, Any]:
+    """Session document for a create request. Raises LookupError if the course or characters do not exist."""
     # Validate that course exists
     if request.course_id not in db.courses:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Course with id '{request.course_id}' not found"
-        )
+        raise LookupError(f"Course with id '{request.course_id}' not found")
     
     if request.topic_id is None:
         request.topic_id = 0
@@ -49,16 +28,13 @@ async def create_session(request: CreateSessionRequest):
     teacher = next((character for character in characters if character.role == CharacterRole.TEACHER), None)
     classmate = next((character for character in characters if character.role == CharacterRole.CLASSMATE), None)
     if teacher is None or classmate is None:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Teacher or classmate characters '{character_names}' not selected/not found"
-        )
+        raise LookupError(f"Teacher or classmate characters '{character_names}' not selected/not found")
 
     # Generate unique session ID
     session_id = str(uuid.uuid4())
     
     # Create session object
-    session = {
+    return {
         "id": session_id,
         "user_id": request.user_id,
         "course_id": request.course_id,
@@ -72,12 +48,57 @@ async def create_session(request: CreateSessionRequest):
         "teacher": teacher.model_dump(),
         "classmate": classmate.model_dump()
     }
+
+
+@router.post("/", response_model=Session)
+async def create_session(request: CreateSessionRequest):
+    """
+    Create a new learning session for a user and course.
+    
+    Args:
+        request: Contains user_id and course_id
+        
+    Returns:
+        SessionResponse: The created session object
+    """
+    db = Db.get_instance()
+    try:
+        session = new_session(db, request)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     
     # Add session to sessions data
-    db.update_session(session_id, session)
+    db.update_session(session["id"], session)
+    await db.flush()
     
     return Session(**session)
 
+
+@router.post("/bulk", response_model=BulkResult)
+async def create_sessions(records: List[Dict[str, Any]] = Body(...)) -> BulkResult:
+    """
+    Create many sessions at once, from CreateSessionRequest records. Every record is validated on its own,
+    invalid ones are reported and skipped, and the valid ones are written with a single persistence flush.
+    The id of each created session is in its result.
+    """
+    db = Db.get_instance()
+    results = []
+    sessions = {}
+    for index, (request, error) in enumerate(await validate_records(CreateSessionRequest, records)):
+        if error is None:
+            try:
+                session = new_session(db, CreateSessionRequest(**request))
+                sessions[session["id"]] = session
+                results.append(BulkRecordResult(index=index, id=session["id"], ok=True))
+                continue
+            except LookupError as e:
+                error = str(e)
+        results.append(BulkRecordResult(index=index, ok=False, error=error))
+    if sessions:
+        db.update_sessions(sessions)
+        await db.flush()
+    return summarize(results)
+
 @router.get("/{session_id}", response_model=Session)
 async def get_session(session_id: str):
     """
@@ -90,14 +111,15 @@ async def get_session(session_id: str):
         SessionResponse: The session object
     """
     db = Db.get_instance()
-    
-    if session_id not in db.sessions:
+    # Also finds sessions archived to the cold tier
+    session = db.get_session(session_id)
+    if session is None:
         raise HTTPException(
             status_code=404,
             detail=f"Session with id '{session_id}' not found"
         )
     
-    return Session(**db.sessions[session_id])
+    return session
 
 @router.get("/me")
 async def get_my_sessions():
@@ -1,7 +1,10 @@
 import uuid
-from fastapi import APIRouter
+from typing import Any, Dict, List
+from fastapi import APIRouter, Body
 from pydantic import BaseModel
 from app.dao.db import Db
+from app.logic.bulk import record_id, summarize, validate_records
+from app.models.bulk import BulkRecordResult, BulkResult
 from app.models.user import OnboardingData, User
 
 router = APIRouter(prefix="/api/users", tags=["users"])
@@ -11,8 +14,32 @@ async def create_user(request: User) -> User:
     db = Db.get_instance()
     user = User(id=request.id, name=request.name, onboarding_data=request.onboarding_data)
     db.create_user(request.id, user.model_dump())
+    await db.flush()
     return user
 
+@router.post("/bulk", response_model=BulkResult)
+async def create_users(records: List[Dict[str, Any]] = Body(...)) -> BulkResult:
+    """
+    Create many users at once (e.g. onboarding a school). Every record is validated on its own, invalid
+    ones are reported and skipped, and the valid ones are written with a single persistence flush.
+    """
+    db = Db.get_instance()
+    results = []
+    users = {}
+    for index, (user, error) in enumerate(await validate_records(User, records)):
+        if error is None and user["id"] in users:
+            error = "Duplicate id in batch"
+        if error is not None:
+            results.append(BulkRecordResult(index=index, id=record_id(records[index]), ok=False, error=error))
+            continue
+        # Same fields as create_user: stats start empty
+        users[user["id"]] = {**user, "user_stats": None}
+        results.append(BulkRecordResult(index=index, id=user["id"], ok=True))
+    if users:
+        db.create_users(users)
+        await db.flush()
+    return summarize(results)
+
 @router.get("/{user_id}", response_model=User)
 async def get_user(user_id: str) -> User:
     db = Db.get_instance()
@@ -24,15 +24,15 @@ async def learning_interface_websocket(websocket: WebSocket):
                 message = await websocket.receive_json()
                 logger.info(f"Received message: {message}")
                 
-                # Process the message directly
-                await learning_interface.process_message(message)
+                # Handled in the background, so the next message (e.g. a student interrupting the turn) is read right away
+                learning_interface.receive(message)
                 
             except WebSocketDisconnect:
                 logger.info("WebSocket disconnected")
                 break
             except Exception as e:
                 logger.error(f"Error processing message: {str(e)}")
-                await websocket.send_json({
+                await learning_interface.outbound.send_json({
                     "type": "error", 
                     "message": f"Error processing message: {str(e)}"
                 })
@@ -41,5 +41,9 @@ async def learning_interface_websocket(websocket: WebSocket):
         logger.error(f"Error in websocket connection: {str(e)}")
     finally:
         # Clean up
+        try:
+            await learning_interface.close()
+        except Exception as e:
+            logger.error(f"Error flushing sessions on disconnect: {str(e)}")
         manager.disconnect(websocket)
         logger.info("Client disconnected from learning interface") 
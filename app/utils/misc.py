@@ -0,0 +1,13 @@
+from datetime import date, datetime
+from enum import Enum
+
+
+def json_default(obj):
+    # Ensure complex types like datetime and Enum are converted to JSON-serialisable
+    # representations before writing to disk.
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    # Fallback to string representation for any other non-serialisable types
+    return str(obj)
@@ -7,6 +7,9 @@ from app.routes.course_routes import router as course_router
 from app.routes.user_routes import router as user_router
 from app.routes.dashboard import router as dashboard_router
 from app.routes.character_routes import router as character_router
+from app.routes.metrics_routes import router as metrics_router
+from app.dao.db import Db
+from app.logic import bulk
 
 # Configure logging
 logging.basicConfig(
@@ -41,11 +44,19 @@ app.include_router(course_router)
 app.include_router(user_router)
 app.include_router(dashboard_router)
 app.include_router(character_router)
+app.include_router(metrics_router)
 
 @app.get("/")
 async def root():
     return {"message": "Interactive Tutor Backend API is running"}
 
+@app.on_event("shutdown")
+async def shutdown():
+    # uvicorn runs this on SIGTERM/SIGINT. Flush anything the storage layer still holds in memory
+    # (dirty sessions, the journal, queued background writes) before exiting.
+    Db.get_instance().close()
+    bulk.shutdown()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
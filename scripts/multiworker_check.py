@@ -0,0 +1,154 @@
+"""
+Local multi-process check of the shared sqlite storage.
+
+Spawns several worker processes on one SQLite database, like `uvicorn --workers N` would. Sessions are
+spread over the workers (like connections landing on them behind a load balancer) and each worker claims
+the lease of its sessions. Every worker then also tries to claim every other session, which must fail.
+The owners walk their sessions forward phase by phase, the way `next_phase` messages do, all workers
+writing concurrently. At the end the script verifies that:
+    - every session was owned by exactly one worker
+    - every session's progress matches the expected number of steps (no lost or duplicated updates)
+    - every session has exactly one `next_phase` event per step
+
+Usage:
+    python scripts/multiworker_check.py [--workers 4] [--sessions 40] [--steps 15]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.dao.db import Db  # noqa: E402
+from app.dao.migrate import migrate  # noqa: E402
+from app.models.course import Course  # noqa: E402
+from app.models.session import SessionStatus  # noqa: E402
+
+COURSE_ID = "financial-literacy"
+
+
+def advance(progress: dict, course: Course) -> bool:
+    """Same walk as LearningInterface.progress_to_next_phase, on a progress dict."""
+    topic = course.topics[progress["topic_id"]]
+    module = topic.modules[progress["module_id"]]
+    if progress["phase_id"] < len(module.phases) - 1:
+        progress["phase_id"] += 1
+        return True
+    if progress["module_id"] < len(topic.modules) - 1:
+        progress["module_id"] += 1
+        progress["phase_id"] = 0
+        return True
+    if progress["topic_id"] < len(course.topics) - 1:
+        progress["topic_id"] += 1
+        progress["module_id"] = 0
+        progress["phase_id"] = 0
+        return True
+    return False
+
+
+def worker(data_dir: str, worker_id: int, workers: int, session_ids: list, steps: int, barrier, results):
+    db = Db(data_dir=data_dir, backend="sqlite")
+    owner = f"worker-{worker_id}"
+    course = db.get_course(COURSE_ID)
+    routed = [session_id for index, session_id in enumerate(session_ids) if index % workers == worker_id]
+    owned = [session_id for session_id in routed if db.acquire_session_lease(session_id, owner)]
+    barrier.wait()
+    # Contention: claims on sessions owned by other workers must be refused
+    others = [session_id for session_id in session_ids if session_id not in routed]
+    random.Random(worker_id).shuffle(others)
+    owned += [session_id for session_id in others if db.acquire_session_lease(session_id, owner)]
+    barrier.wait()
+    for _ in range(steps):
+        for session_id in owned:
+            # Renew the lease on every message, like the learning interface does
+            assert db.acquire_session_lease(session_id, owner)
+            session = db.get_session(session_id)
+            progress = session.progress.model_dump()
+            advance(progress, course)
+            session_json = session.model_dump()
+            session_json["progress"] = progress
+            db.update_session_in_memory(session_id, session_json)
+            db.events.append(session_id, "next_phase", {"worker": owner})
+    results.put((worker_id, owned))
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--steps", type=int, default=15)
+    args = parser.parse_args()
+
+    source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "data")
+    data_dir = tempfile.mkdtemp(prefix="tutor-multiworker-")
+    try:
+        for file_name in ("courses.json", "characters.json", "users.json", "games.json"):
+            shutil.copy(os.path.join(source_dir, file_name), data_dir)
+        migrate(data_dir, os.path.join(data_dir, "tutor.db"))
+
+        db = Db(data_dir=data_dir, backend="sqlite")
+        course = db.get_course(COURSE_ID)
+        session_ids = [f"session-{index}" for index in range(args.sessions)]
+        for session_id in session_ids:
+            db.update_session(session_id, {
+                "id": session_id,
+                "user_id": "wert",
+                "course_id": COURSE_ID,
+                "status": SessionStatus.ACTIVE.value,
+                "progress": {"topic_id": 0, "module_id": 0, "phase_id": 0},
+            })
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        barrier = context.Barrier(args.workers)
+        processes = [
+            context.Process(target=worker, args=(data_dir, worker_id, args.workers, session_ids, args.steps, barrier, results))
+            for worker_id in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        owned_by = {}
+        for _ in processes:
+            worker_id, owned = results.get(timeout=300)
+            for session_id in owned:
+                owned_by.setdefault(session_id, []).append(worker_id)
+        for process in processes:
+            process.join()
+
+        expected = {"topic_id": 0, "module_id": 0, "phase_id": 0}
+        for _ in range(args.steps):
+            advance(expected, course)
+
+        failures = []
+        for session_id in session_ids:
+            owners = owned_by.get(session_id, [])
+            if len(owners) != 1:
+                failures.append(f"{session_id}: owned by workers {owners}")
+            progress = db.get_session(session_id).progress.model_dump()
+            if progress != expected:
+                failures.append(f"{session_id}: progress {progress}, expected {expected}")
+            events = [event for event in db.events.iter_events(session_id) if event.type == "next_phase"]
+            if len(events) != args.steps:
+                failures.append(f"{session_id}: {len(events)} next_phase events, expected {args.steps}")
+        db.close()
+
+        per_worker = {worker_id: sum(1 for owners in owned_by.values() if worker_id in owners) for worker_id in range(args.workers)}
+        print(f"workers={args.workers} sessions={args.sessions} steps={args.steps}")
+        print(f"sessions owned per worker: {per_worker}")
+        if failures:
+            print(f"FAILED ({len(failures)} problems)")
+            for failure in failures[:20]:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("OK: every session had a single owner and ended at the expected progress")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
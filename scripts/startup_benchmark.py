@@ -0,0 +1,154 @@
+"""
+Cold start benchmark.
+
+Every measurement runs in a fresh Python process, the way a new worker or pod starts:
+    - import time of `main` (the FastAPI app with all routes)
+    - time to first request: process start -> response of the first HTTP request, for `/health` (no data
+      needed) and for a course and a session lookup (which load the collections they touch)
+    - loading a collection from its JSON file vs from the binary snapshot (DB_BINARY_SNAPSHOT)
+
+The data directory is a copy of app/data, optionally padded with `--sessions` synthetic sessions so the
+difference shows on a realistically large dataset. Runs offline: provider clients are never called.
+
+Usage:
+    python scripts/startup_benchmark.py [--runs 5] [--sessions 20000]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child process. Prints one JSON line of timings in seconds.
+# Requests are sent straight to the ASGI app, as uvicorn would, without opening a socket.
+CHILD = r"""
+import asyncio, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+timings = {{}}
+import main
+timings["import_main"] = time.perf_counter() - started
+
+async def get(path):
+    messages = []
+    async def receive():
+        return {{"type": "http.request", "body": b"", "more_body": False}}
+    async def send(message):
+        messages.append(message)
+    scope = {{
+        "type": "http", "asgi": {{"version": "3.0"}}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "", "headers": [],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8080),
+    }}
+    await main.app(scope, receive, send)
+    return messages[0]["status"]
+
+if {request!r}:
+    status = asyncio.run(get({request!r}))
+    assert status == 200, status
+    timings["first_request"] = time.perf_counter() - started
+    started_second = time.perf_counter()
+    asyncio.run(get({request!r}))
+    timings["second_request"] = time.perf_counter() - started_second
+print(json.dumps(timings))
+"""
+
+CHILD_LOAD = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+from app.dao.storage import JsonBackend
+backend = JsonBackend({data_dir!r}, binary_snapshot={binary!r})
+started = time.perf_counter()
+backend.collection("sessions")
+print(json.dumps({{"load_sessions": time.perf_counter() - started}}))
+"""
+
+
+def run_child(code: str, env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def measure(code: str, env: dict, runs: int) -> dict:
+    results = [run_child(code, env) for _ in range(runs)]
+    return {key: statistics.median(result[key] for result in results) for key in results[0]}
+
+
+def make_data_dir(sessions: int) -> str:
+    data_dir = tempfile.mkdtemp(prefix="tutor-startup-")
+    source_dir = os.path.join(ROOT, "app", "data")
+    for file_name in os.listdir(source_dir):
+        if file_name.endswith(".json"):
+            shutil.copy(os.path.join(source_dir, file_name), data_dir)
+    with open(os.path.join(data_dir, "sessions.json"), "r") as file:
+        documents = json.load(file)
+    for index in range(sessions):
+        session_id = f"bench-session-{index}"
+        documents[session_id] = {
+            "id": session_id,
+            "user_id": f"bench-user-{index % 500}",
+            "course_id": "financial-literacy",
+            "status": "ACTIVE",
+            "progress": {"topic_id": 0, "module_id": index % 3, "phase_id": index % 7},
+            "system_instructions": "You are a friendly tutor. " * 8,
+        }
+    with open(os.path.join(data_dir, "sessions.json"), "w") as file:
+        json.dump(documents, file, indent=2)
+    return data_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Processes per measurement (the median is reported)")
+    parser.add_argument("--sessions", type=int, default=20000, help="Synthetic sessions added to the data set")
+    args = parser.parse_args()
+
+    data_dir = make_data_dir(args.sessions)
+    env = dict(os.environ)
+    env.update({
+        "DB_DATA_DIR": data_dir,
+        "DB_SNAPSHOT_INTERVAL": "0",
+        # Never used, the clients are only constructed on first use
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "unused"),
+        "ELEVENLABS_API_KEY": env.get("ELEVENLABS_API_KEY", "unused"),
+        "DEEPGRAM_API_KEY": env.get("DEEPGRAM_API_KEY", "unused"),
+    })
+    try:
+        rows = []
+        requests = {
+            "/health": "/health",
+            "course": "/api/courses/financial-literacy",
+            "session": "/api/sessions/bench-session-0",
+        }
+        for binary in (False, True):
+            env["DB_BINARY_SNAPSHOT"] = "true" if binary else "false"
+            if binary:
+                # Build the snapshots once, as the first start with DB_BINARY_SNAPSHOT does
+                run_child(CHILD_LOAD.format(root=ROOT, data_dir=data_dir, binary=True), env)
+            label = "binary" if binary else "json"
+            for name, path in requests.items():
+                if binary and name == "/health":
+                    continue
+                timings = measure(CHILD.format(root=ROOT, request=path), env, args.runs)
+                rows.append((f"first request {name} ({label})", timings["first_request"]))
+            load = measure(CHILD_LOAD.format(root=ROOT, data_dir=data_dir, binary=binary), env, args.runs)
+            rows.append((f"load sessions ({label})", load["load_sessions"]))
+        rows.insert(0, ("import main", measure(CHILD.format(root=ROOT, request=""), env, args.runs)["import_main"]))
+
+        print(f"sessions={args.sessions} runs={args.runs} (median of fresh processes)")
+        width = max(len(name) for name, _ in rows)
+        for name, seconds in rows:
+            print(f"  {name:<{width}}  {seconds * 1000:9.1f} ms")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
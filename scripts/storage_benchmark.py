@@ -0,0 +1,239 @@
+"""
+Storage stress benchmark.
+
+Measures the Db operations the websocket and the routes rely on, per storage configuration and data set
+size (1k, 10k and 100k sessions by default):
+    - startup: Db construction and first access to the sessions and their events (what a new worker pays)
+    - get_session, update_session_in_memory, update_session (persisted, followed by a flush)
+    - get_sessions_by_user_id
+    - event appends
+    - peak RSS of the process
+
+Every (configuration, size) pair runs in a fresh process on its own copy of a synthetic data set, so peak
+RSS and startup are not skewed by earlier runs. Operations run until `--ops` operations or `--seconds` per
+operation, whichever comes first (a full-file rewrite of 100k sessions takes long). Runs offline.
+
+`--output` writes the results as JSON; `--compare` prints the ratio of each number to an earlier report,
+so a change to the storage layer can be checked against the numbers from before it.
+
+Usage:
+    python scripts/storage_benchmark.py [--sizes 1000,10000,100000] [--configs json-file,sqlite]
+        [--ops 500] [--seconds 5] [--output report.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration name -> (backend, persistence mode)
+CONFIGS = {
+    "json-file": ("json", "file"),
+    "json-journal": ("json", "journal"),
+    "json-sharded": ("json", "sharded"),
+    "sqlite": ("sqlite", "file"),
+}
+OPERATIONS = ["get_session", "update_session_in_memory", "update_session", "get_sessions_by_user_id", "append_event"]
+SESSIONS_PER_USER = 20
+EVENTS_PER_SESSION = 5
+
+# Runs inside the child process. Prints one JSON line with the results.
+CHILD = r"""
+import asyncio, json, random, resource, sys, time
+sys.path.insert(0, {root!r})
+from app.dao.db import Db
+
+def summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    at = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    return {{
+        "ops": len(latencies),
+        "ops_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(at(0.5) * 1000, 4),
+        "p99_ms": round(at(0.99) * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4),
+    }}
+
+def run(operation, max_ops, max_seconds):
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < max_ops and time.perf_counter() - started < max_seconds:
+        op_started = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - op_started)
+    return summary(latencies, time.perf_counter() - started)
+
+random.seed(7)
+started = time.perf_counter()
+db = Db(data_dir={data_dir!r}, backend={backend!r}, persistence_mode={mode!r})
+session_count = len(db.sessions)
+db.events.last("bench-session-0")
+results = {{"startup_ms": round((time.perf_counter() - started) * 1000, 2), "sessions": session_count}}
+session_ids = [f"bench-session-{{index}}" for index in range({sessions})]
+user_ids = [f"bench-user-{{index}}" for index in range(max(1, {sessions} // {per_user}))]
+documents = {{session_id: db.sessions[session_id] for session_id in random.sample(session_ids, min(200, len(session_ids)))}}
+loop = asyncio.new_event_loop()
+
+def get_session():
+    db.get_session(random.choice(session_ids))
+
+def update_session_in_memory():
+    session_id = random.choice(list(documents))
+    document = dict(documents[session_id], progress={{"topic_id": 0, "module_id": 0, "phase_id": random.randrange(7)}})
+    db.update_session_in_memory(session_id, document)
+
+def update_session():
+    session_id = random.choice(list(documents))
+    document = dict(documents[session_id], progress={{"topic_id": 0, "module_id": 0, "phase_id": random.randrange(7)}})
+    db.update_session(session_id, document)
+    loop.run_until_complete(db.flush())
+
+def get_sessions_by_user_id():
+    db.get_sessions_by_user_id(random.choice(user_ids))
+
+def append_event():
+    db.events.append(random.choice(session_ids), "ping", {{}})
+
+for name in {operations!r}:
+    results[name] = run(globals()[name], {ops}, {seconds})
+db.close()
+loop.close()
+# ru_maxrss survives exec on Linux, so it would report the benchmark's own peak. VmHWM is this process's.
+try:
+    with open("/proc/self/status") as status:
+        rss_kib = next(int(line.split()[1]) for line in status if line.startswith("VmHWM:"))
+except OSError:
+    # ru_maxrss is in bytes on macOS
+    rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+results["peak_rss_mb"] = round(rss_kib / 1024, 1)
+print(json.dumps(results))
+"""
+
+# Opens the data set once, so that one-time conversions (importing the collection files into shards)
+# are not counted as startup
+CHILD_PREPARE = r"""
+import sys
+sys.path.insert(0, {root!r})
+from app.dao.db import Db
+db = Db(data_dir={data_dir!r}, backend={backend!r}, persistence_mode={mode!r})
+len(db.sessions)
+db.close()
+"""
+
+
+def run_child(code: str, env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr)
+    lines = output.stdout.strip().splitlines()
+    return json.loads(lines[-1]) if lines else {}
+
+
+def make_data_set(sessions: int) -> str:
+    """Copy of the seed data (courses, characters, ...) with `sessions` synthetic sessions and their events."""
+    data_dir = tempfile.mkdtemp(prefix="tutor-storage-")
+    source_dir = os.path.join(ROOT, "app", "data")
+    for file_name in os.listdir(source_dir):
+        if file_name.endswith(".json") and file_name != "sessions.json":
+            shutil.copy(os.path.join(source_dir, file_name), data_dir)
+    documents = {}
+    with open(os.path.join(data_dir, "events.jsonl"), "w") as events:
+        for index in range(sessions):
+            session_id = f"bench-session-{index}"
+            documents[session_id] = {
+                "id": session_id,
+                "user_id": f"bench-user-{index // SESSIONS_PER_USER}",
+                "course_id": "financial-literacy",
+                "status": "ACTIVE",
+                "progress": {"topic_id": 0, "module_id": index % 3, "phase_id": index % 7},
+                "system_instructions": "You are a friendly tutor. " * 8,
+                "created_at": "2026-01-01T10:00:00",
+            }
+            for event_index in range(EVENTS_PER_SESSION):
+                events.write(json.dumps([session_id, "ping", f"2026-01-01T10:00:{event_index:02d}", {}]) + "\n")
+    with open(os.path.join(data_dir, "sessions.json"), "w") as file:
+        json.dump(documents, file, indent=2)
+    return data_dir
+
+
+def copy_data_set(source: str, backend: str) -> str:
+    data_dir = tempfile.mkdtemp(prefix="tutor-storage-")
+    shutil.copytree(source, data_dir, dirs_exist_ok=True)
+    if backend == "sqlite":
+        subprocess.run(
+            [sys.executable, "-m", "app.dao.migrate", "--data-dir", data_dir, "--sqlite-path", os.path.join(data_dir, "tutor.db")],
+            cwd=ROOT, check=True, capture_output=True,
+        )
+    return data_dir
+
+
+def print_report(report: dict, baseline: dict = None):
+    columns = ["startup_ms", "peak_rss_mb"] + [f"{operation} p50_ms" for operation in OPERATIONS]
+    print("latencies in ms" + (", (x) = ratio to the baseline" if baseline else ""))
+    for key, results in report.items():
+        print(f"\n{key}")
+        for column in columns:
+            name, _, field = column.partition(" ")
+            value = results[name][field] if field else results[name]
+            line = f"  {column:<38} {value:>12}"
+            if field:
+                line += f"   p99 {results[name]['p99_ms']:>10}  {results[name]['ops_per_second']:>10} ops/s"
+            old = (baseline or {}).get(key, {}).get(name)
+            old = old.get(field) if field and old else old
+            if old:
+                line += f"   ({value / old:.2f}x)"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma separated session counts")
+    parser.add_argument("--configs", default=",".join(CONFIGS), help=f"Comma separated, out of {', '.join(CONFIGS)}")
+    parser.add_argument("--ops", type=int, default=500, help="Maximum operations per measurement")
+    parser.add_argument("--seconds", type=float, default=5, help="Maximum seconds per measurement")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update({
+        "DB_SNAPSHOT_INTERVAL": "0",
+        "DB_COLD_TIER": "false",
+        "DB_SQLITE_PATH": "",
+    })
+    report = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        source = make_data_set(size)
+        try:
+            for config in args.configs.split(","):
+                backend, mode = CONFIGS[config]
+                data_dir = copy_data_set(source, backend)
+                try:
+                    options = dict(root=ROOT, data_dir=data_dir, backend=backend, mode=mode)
+                    run_child(CHILD_PREPARE.format(**options), env)
+                    key = f"{config} sessions={size}"
+                    report[key] = run_child(CHILD.format(
+                        **options, sessions=size, per_user=SESSIONS_PER_USER, operations=OPERATIONS, ops=args.ops, seconds=args.seconds,
+                    ), env)
+                    print(f"done: {key}", file=sys.stderr)
+                finally:
+                    shutil.rmtree(data_dir, ignore_errors=True)
+        finally:
+            shutil.rmtree(source, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+from app.dao.bounded import BoundedCollection, document_size
+from app.dao.sharded import ShardedStore
+
+
+def session_json(session_id: str, user_id: str = "u1", last_alive: str = "2025-01-01T00:00:00"):
+    return {"id": session_id, "user_id": user_id, "last_alive_timestamp": last_alive, "notes": "x" * 1000}
+
+
+def bounded(tmp_path, max_documents: int, pinned=()):
+    store = ShardedStore(str(tmp_path / "sessions"))
+    budget = max_documents * document_size(session_json("s00"))
+    return store, BoundedCollection(store, ["user_id"], budget, is_pinned=lambda key: key in pinned)
+
+
+def test_evicts_least_recently_used_within_budget(tmp_path):
+    _, sessions = bounded(tmp_path, max_documents=3)
+    for index in range(10):
+        sessions[f"s{index:02d}"] = session_json(f"s{index:02d}")
+    stats = sessions.stats()
+    assert stats["resident"] == 3
+    assert stats["resident_bytes"] <= stats["budget_bytes"]
+    assert stats["evictions"] == 7
+    # Every key stays known and indexed
+    assert len(sessions) == 10
+    assert len(sessions.lookup("user_id", ["u1"])) == 10
+    assert sessions.check_indexes() == []
+
+
+def test_evicted_documents_rehydrate_with_their_latest_value(tmp_path):
+    store, sessions = bounded(tmp_path, max_documents=2)
+    sessions["s00"] = session_json("s00", user_id="u2")
+    for index in range(1, 5):
+        sessions[f"s{index:02d}"] = session_json(f"s{index:02d}")
+    # Written out on eviction
+    assert store.read("s00")["user_id"] == "u2"
+    assert sessions["s00"]["user_id"] == "u2"
+    assert sessions.stats()["rehydrations"] == 1
+
+
+def test_pinned_documents_are_never_evicted(tmp_path):
+    _, sessions = bounded(tmp_path, max_documents=2, pinned={"s00"})
+    for index in range(6):
+        sessions[f"s{index:02d}"] = session_json(f"s{index:02d}")
+    rehydrations = sessions.stats()["rehydrations"]
+    sessions["s00"]
+    assert sessions.stats()["rehydrations"] == rehydrations
+
+
+def test_load_keeps_the_most_recently_alive(tmp_path):
+    store, _ = bounded(tmp_path, max_documents=2)
+    store.import_all({f"s{day}": session_json(f"s{day}", last_alive=f"2025-01-0{day}T00:00:00") for day in range(1, 6)})
+    _, sessions = bounded(tmp_path, max_documents=2)
+    sessions.load(store.iter_all())
+    assert sessions.stats()["resident"] == 2
+    rehydrations = sessions.stats()["rehydrations"]
+    sessions["s5"], sessions["s4"]
+    assert sessions.stats()["rehydrations"] == rehydrations
+    sessions["s1"]
+    assert sessions.stats()["rehydrations"] == rehydrations + 1
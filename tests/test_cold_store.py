@@ -0,0 +1,69 @@
+from app.dao.cold_store import ColdStore
+from app.dao.db import Db
+from app.dao.event_export import export_events
+from app.logic.live_session import LiveSession
+
+
+def session_json(session_id: str, user_id: str = "u1", **fields):
+    return {"id": session_id, "user_id": user_id, "course_id": "course-1", "progress": {}, "status": "COMPLETED", **fields}
+
+
+def completed_session(db: Db, session_id: str, user_id: str = "u1"):
+    db.update_session(session_id, session_json(session_id, user_id))
+    db.events.append(session_id, "next_phase", {})
+    db.trim_events(session_id, ["dashboard_built"])
+    db.events.append(session_id, "dashboard_built", {})
+
+
+def test_round_trip(tmp_path):
+    cold = ColdStore(str(tmp_path))
+    cold.put_events("s1", [("next_phase", "2025-01-01T00:00:00", {})])
+    cold.put_session(session_json("s1"), [("dashboard_built", "2025-01-01T00:01:00", {})])
+    cold.put_session(session_json("s2", user_id="u2"))
+
+    # A second process sees the same records
+    reopened = ColdStore(str(tmp_path))
+    assert reopened.get_session("s1") == session_json("s1")
+    assert [document["id"] for document in reopened.find("user_id", ["u2"])] == ["s2"]
+    assert [event[0] for event in reopened.iter_events("s1")] == ["next_phase", "dashboard_built"]
+    assert "s3" not in reopened
+    assert reopened.stats()["sessions"] == 2
+
+
+def test_archived_session_is_readable(tmp_path):
+    db = Db(data_dir=str(tmp_path), persistence_mode="file", backend="json", cold_tier=True)
+    completed_session(db, "s1")
+    assert db.archive_session("s1")
+    assert db.is_archived("s1")
+    assert "s1" not in db.sessions
+    assert db.get_session("s1").id == "s1"
+    assert [session.id for session in db.get_sessions_by_user_id("u1")] == ["s1"]
+    db.close()
+
+
+def test_progress_on_a_reopened_archived_session_is_kept(tmp_path):
+    db = Db(data_dir=str(tmp_path), persistence_mode="file", backend="json", cold_tier=True)
+    completed_session(db, "s1")
+    db.archive_session("s1")
+
+    live = LiveSession(db, db.get_session("s1"))
+    live.session.progress.phase_id = 3
+    live.mark("progress")
+    live.commit()
+    assert not db.is_archived("s1")
+    assert db.sessions["s1"]["progress"]["phase_id"] == 3
+    # The events it was archived with are live again
+    assert db.events.last("s1").type == "dashboard_built"
+    db.close()
+
+
+def test_export_counts_a_session_archived_twice_once(tmp_path):
+    db = Db(data_dir=str(tmp_path), persistence_mode="file", backend="json", cold_tier=True)
+    completed_session(db, "s1")
+    db.archive_session("s1")
+    assert export_events(db.cold, str(tmp_path / "first.npz")) == 2
+
+    assert db.restore_session("s1")
+    assert db.archive_session("s1")
+    assert export_events(db.cold, str(tmp_path / "second.npz")) == 2
+    db.close()
@@ -0,0 +1,64 @@
+import pytest
+
+from app.dao.db import Db
+from app.dao.indexes import IndexedDict
+from app.dao.storage import JsonBackend
+
+
+def session_json(session_id: str, user_id: str, course_id: str = "course-1", **fields):
+    return {"id": session_id, "user_id": user_id, "course_id": course_id, "progress": {}, **fields}
+
+
+@pytest.fixture(params=["file", "journal", "sharded"])
+def db(request, tmp_path):
+    db = Db(data_dir=str(tmp_path), persistence_mode=request.param, backend="json", cold_tier=False)
+    yield db
+    db.close()
+
+
+def test_consistent_after_updates(db):
+    db.update_session("s1", session_json("s1", "u1"))
+    db.update_session("s2", session_json("s2", "u1", course_id="course-2"))
+    db.update_session_in_memory("s3", session_json("s3", "u2"))
+    assert db.check_consistency() == []
+    assert {session.id for session in db.get_sessions_by_user_id("u1")} == {"s1", "s2"}
+
+    # Moving a session to another user updates both index entries
+    db.update_session("s1", session_json("s1", "u2"))
+    assert db.patch_session("s2", {"course_id": "course-3"})
+    assert db.check_consistency() == []
+    assert {session.id for session in db.get_sessions_by_user_id("u1")} == {"s2"}
+    assert {session.id for session in db.get_sessions_by_user_id("u2")} == {"s1", "s3"}
+    assert [document["id"] for document in db.backend.find("sessions", "course_id", ["course-3"])] == ["s2"]
+
+
+def test_consistent_after_deletes(db):
+    db.update_sessions({session_id: session_json(session_id, "u1") for session_id in ("s1", "s2", "s3")})
+    del db.sessions["s1"]
+    db.sessions.pop("s2")
+    db.backend.persist_many("sessions", ["s1", "s2"])
+    assert db.check_consistency() == []
+    assert [session.id for session in db.get_sessions_by_user_id("u1")] == ["s3"]
+
+
+def test_consistent_after_reload(tmp_path):
+    backend = JsonBackend(str(tmp_path))
+    sessions = backend.collection("sessions")
+    sessions["s1"] = session_json("s1", "u1")
+    sessions["s2"] = session_json("s2", "u2")
+    del sessions["s2"]
+    backend.persist_many("sessions", ["s1", "s2"])
+    backend.close()
+
+    reloaded = JsonBackend(str(tmp_path))
+    assert list(reloaded.collection("sessions")) == ["s1"]
+    assert reloaded.check_consistency() == []
+
+
+def test_detects_in_place_mutation():
+    sessions = IndexedDict({"s1": session_json("s1", "u1")}, ["user_id"])
+    # Documents are replaced, never mutated; an in-place change leaves the index stale
+    sessions["s1"]["user_id"] = "u2"
+    problems = sessions.check_indexes()
+    assert any("stale" in problem for problem in problems)
+    assert any("missing" in problem for problem in problems)
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from app.dao.leases import LocalSessionLeases
+from app.dao.sqlite_storage import SqliteBackend
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def leases(request, tmp_path):
+    if request.param == "local":
+        yield LocalSessionLeases()
+        return
+    backend = SqliteBackend(str(tmp_path / "tutor.db"))
+    yield backend.session_leases()
+    backend.close()
+
+
+def test_only_the_owner_holds_the_lease(leases):
+    assert leases.acquire("s1", "conn-a", 60)
+    assert not leases.acquire("s1", "conn-b", 60)
+    # Renewing is fine
+    assert leases.acquire("s1", "conn-a", 60)
+    assert leases.owner("s1") == "conn-a"
+
+
+def test_release_frees_the_session(leases):
+    leases.acquire("s1", "conn-a", 60)
+    # Only the owner can release
+    leases.release("s1", "conn-b")
+    assert leases.owner("s1") == "conn-a"
+    leases.release("s1", "conn-a")
+    assert leases.owner("s1") is None
+    assert leases.acquire("s1", "conn-b", 60)
+
+
+def test_expired_lease_can_be_taken_over(leases):
+    assert leases.acquire("s1", "conn-a", 0.05)
+    time.sleep(0.1)
+    assert leases.owner("s1") is None
+    assert leases.acquire("s1", "conn-b", 60)
+    assert leases.owner("s1") == "conn-b"
+
+
+def test_leases_are_shared_between_sqlite_connections(tmp_path):
+    # Two workers on the same database
+    first, second = SqliteBackend(str(tmp_path / "tutor.db")), SqliteBackend(str(tmp_path / "tutor.db"))
+    try:
+        assert first.session_leases().acquire("s1", "worker-1", 60)
+        assert not second.session_leases().acquire("s1", "worker-2", 60)
+        first.session_leases().release("s1", "worker-1")
+        assert second.session_leases().acquire("s1", "worker-2", 60)
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,29 @@
+import pytest
+from pydantic import ValidationError
+
+from app.dao.model_cache import ModelCache
+from app.models.character import Character
+
+
+def character():
+    return Character(name="Ada", role="teacher", image_url="ada.png", age=30, gender="female", voice_id="voice-1")
+
+
+def test_cached_models_are_frozen():
+    cache = ModelCache()
+    cached = cache.get("characters", "Ada", character)
+    assert isinstance(cached, Character)
+    assert cache.get("characters", "Ada", character) is cached
+    with pytest.raises(ValidationError):
+        cached.voice_id = "voice-2"
+    assert cached.voice_id == "voice-1"
+    assert cached.model_dump() == character().model_dump()
+
+
+def test_copies_can_be_modified():
+    cache = ModelCache()
+    cached = cache.get("characters", "Ada", character)
+    for copy in (cache.get("characters", "Ada", character, copy=True), cached.model_copy(deep=True)):
+        copy.voice_id = "voice-2"
+        assert copy.voice_id == "voice-2"
+    assert cached.voice_id == "voice-1"
@@ -0,0 +1,39 @@
+import os
+import threading
+
+from app.dao.db import Db
+from app.dao.storage import load_json_data
+
+
+def session_json(session_id: str, **fields):
+    return {"id": session_id, "user_id": "u1", "course_id": "course-1", "progress": {}, **fields}
+
+
+def test_snapshotter_and_event_loop_writes_do_not_tear_the_file(tmp_path):
+    db = Db(data_dir=str(tmp_path), persistence_mode="file", backend="json", cold_tier=False)
+    big = "x" * 200_000
+    stop = threading.Event()
+
+    def snapshot_loop():
+        # Stands in for the snapshotter thread
+        while not stop.is_set():
+            db.update_session_in_memory("dirty", session_json("dirty", system_instructions=big))
+            db.flush_dirty_sessions()
+
+    path = os.path.join(str(tmp_path), "sessions.json")
+    db.update_session("s0", session_json("s0"))
+    thread = threading.Thread(target=snapshot_loop)
+    thread.start()
+    try:
+        for index in range(30):
+            db.update_session(f"s{index}", session_json(f"s{index}", system_instructions=big))
+            # Whoever is writing, the file on disk is always a complete document
+            assert load_json_data(path), "sessions.json is half-written"
+    finally:
+        stop.set()
+        thread.join()
+    db.close()
+
+    sessions = load_json_data(path)
+    assert set(sessions) == {"dirty"} | {f"s{index}" for index in range(30)}
+    assert not os.path.exists(f"{path}.tmp")
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+
+from app.dao.db import Db
+from app.dao.timeseries import UserHistory
+from app.logic import dashboard
+from app.logic.dashboard import DashboardBuilder
+
+
+def test_rebuilt_skill_snapshot_replaces_the_sessions_point():
+    now = datetime(2025, 1, 5)
+    history = UserHistory("u1")
+    assert history.append(datetime(2025, 1, 1), {"retention_score": 0.5}, now=now, session_id="s1")
+    assert history.append(datetime(2025, 1, 2), {"retention_score": 0.9}, now=now, session_id="s1")
+    assert history.append(datetime(2025, 1, 3), {"retention_score": 0.7}, now=now, session_id="s2")
+    assert history.history() == [{"retention_score": 0.9}, {"retention_score": 0.7}]
+    assert history.aggregate() == {"retention_score": pytest.approx(0.8)}
+
+    # The recorded snapshots survive a round trip through the stored document
+    reloaded = UserHistory("u1", history.to_document())
+    assert reloaded.append(datetime(2025, 1, 4), {"retention_score": 0.1}, now=now, session_id="s2")
+    assert reloaded.history() == [{"retention_score": 0.9}, {"retention_score": 0.1}]
+    assert reloaded.counts == {"retention_score": 2}
+    assert reloaded.aggregate() == {"retention_score": pytest.approx(0.5)}
+
+
+def test_rebuilt_skill_snapshot_is_taken_out_of_its_merged_point():
+    now = datetime(2025, 6, 1)
+    history = UserHistory("u1")
+    history.append(datetime(2025, 1, 1, 9), {"retention_score": 0.4}, now=now, session_id="s1")
+    history.append(datetime(2025, 1, 1, 18), {"retention_score": 0.8}, now=now, session_id="s2")
+    assert history.points == [{"t": "2025-01-01T09:00:00", "v": {"retention_score": pytest.approx(0.6)}, "n": {"retention_score": 2}}]
+
+    history.append(datetime(2025, 5, 31), {"retention_score": 0.2}, now=now, session_id="s1")
+    assert history.history() == [{"retention_score": pytest.approx(0.8)}, {"retention_score": 0.2}]
+    assert history.aggregate() == {"retention_score": pytest.approx(0.5)}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Db(data_dir=str(tmp_path), persistence_mode="file", backend="json", cold_tier=False)
+    Db._instance = db
+    yield db
+    Db._instance = None
+    db.close()
+
+
+def test_heartbeats_after_a_build_only_update_time_spent(db, monkeypatch):
+    async def create_response(*args, **kwargs):
+        raise AssertionError("time spent alone must not rebuild the stats")
+
+    monkeypatch.setattr(dashboard, "create_response", create_response)
+    db.update_session("s1", {
+        "id": "s1",
+        "user_id": "u1",
+        "course_id": "course-1",
+        "progress": {},
+        "status": "COMPLETED",
+        "time_spent_per_day": {"2025-01-01": 50.0, "2025-01-02": 20.0},
+        "session_stats": {
+            "session_id": "s1",
+            "time_spent_per_day": {"2025-01-01": 50.0},
+            "session_time": 50.0,
+            "engagement_score": 0.8,
+            "skill_stats": {"retention_score": 0.5},
+        },
+    })
+    db.events.append("s1", "dashboard_built", {})
+    db.record_skill_stats("u1", "s1", datetime(2025, 1, 1), {"retention_score": 0.5})
+
+    builder = DashboardBuilder("u1")
+    session = db.get_session("s1")
+    assert asyncio.run(builder.build_session_stats(session))
+    assert session.session_stats.time_spent_per_day == {"2025-01-01": 50.0, "2025-01-02": 20.0}
+    assert session.session_stats.session_time == 70.0
+    assert session.session_stats.engagement_score == 0.8
+    history = db.get_user_history("u1")
+    assert len(history.history()) == 1
+    assert history.is_active(date(2025, 1, 2))
+
+    # Nothing changed since
+    assert not asyncio.run(builder.build_session_stats(session))
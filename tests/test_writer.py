@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+from app.dao.writer import BackgroundWriter
+
+
+class RecordingWrite:
+    """Stands in for JsonBackend.write. Optionally holds the writer thread until `release` is set."""
+
+    def __init__(self, hold: bool = False):
+        self.calls = []
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def __call__(self, collection, keys):
+        self.release.wait(5)
+        self.calls.append((collection, set(keys)))
+
+    def written(self, collection):
+        return set().union(*[keys for name, keys in self.calls if name == collection])
+
+
+def test_flush_waits_for_submitted_writes():
+    write = RecordingWrite()
+    writer = BackgroundWriter(write, coalesce_window=0.01)
+    writer.submit("sessions", "s1")
+    writer.submit("users", "u1")
+    asyncio.run(writer.flush())
+    assert write.written("sessions") == {"s1"}
+    assert write.written("users") == {"u1"}
+    writer.close()
+
+
+def test_coalesces_repeated_submits():
+    write = RecordingWrite()
+    writer = BackgroundWriter(write, coalesce_window=0.05)
+    for _ in range(100):
+        writer.submit("sessions", "s1")
+    writer.flush_sync(5)
+    assert write.written("sessions") == {"s1"}
+    assert len(write.calls) < 100
+    assert writer.stats()["submitted"] == 100
+    writer.close()
+
+
+def test_submit_does_not_block_when_queue_is_full():
+    write = RecordingWrite(hold=True)
+    writer = BackgroundWriter(write, coalesce_window=0, max_queue_size=2)
+    # The writer thread is stuck in its first write, so the queue fills up
+    for index in range(50):
+        writer.submit("sessions", f"s{index}")
+    assert writer.stats()["overflowed_submits"] > 0
+
+    async def flush():
+        flushed = asyncio.ensure_future(writer.flush())
+        # The event loop keeps running while the writer is stuck
+        await asyncio.sleep(0.05)
+        assert not flushed.done()
+        write.release.set()
+        await flushed
+
+    asyncio.run(flush())
+    assert write.written("sessions") == {f"s{index}" for index in range(50)}
+    assert writer.stats()["overflow_size"] == 0
+    writer.close()